@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Compares the header-only overrides writer against the old xarray path.
+
+The old path opened the whole template ``pism_config.nc`` with xarray and
+wrote the entire dataset back out with changed attributes. Each variant runs in
+a fresh subprocess so that the reported peak RSS is not polluted by the other.
+The xarray variant needs ``xarray`` installed, which the plugin itself no
+longer depends on.
+
+Usage::
+
+    $ python benchmarks/bench_override_file.py [--n-attrs 1500] [--repeat 20]
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Allow running from a source checkout without installing:
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fixtures import make_pism_config  # noqa: E402
+
+
+def xarray_override(config_file, overrides_file, overrides_kv_pairs):
+    import xarray as xr
+
+    pism_standard_config = xr.open_dataset(config_file)
+    new_attrs = {
+        key: value
+        for key, value in overrides_kv_pairs.items()
+        if key in pism_standard_config.pism_config.attrs
+    }
+    pism_standard_config.pism_config.attrs = new_attrs
+    pism_standard_config.to_netcdf(overrides_file)
+
+
+def header_only_override(config_file, overrides_file, overrides_kv_pairs):
+    from esm_pism.overrides import read_config_attrs, write_overrides_file
+
+    attrs = read_config_attrs(config_file)
+    new_attrs = {
+        key: value for key, value in overrides_kv_pairs.items() if key in attrs
+    }
+    write_overrides_file(overrides_file, new_attrs)
+
+
+def _run(variant, config_file, workdir, repeat, queue):
+    func = {"xarray": xarray_override, "header_only": header_only_override}[variant]
+    overrides_kv_pairs = {f"group_{i % 40}.parameter_{i}": i * 2 for i in range(0, 200, 7)}
+    # Import cost is not what we measure here:
+    func(config_file, os.path.join(workdir, f"warmup_{variant}.nc"), overrides_kv_pairs)
+    tracemalloc.start()
+    timings = []
+    for i in range(repeat):
+        overrides_file = os.path.join(workdir, f"{variant}_{i}.nc")
+        start = time.perf_counter()
+        func(config_file, overrides_file, overrides_kv_pairs)
+        timings.append(time.perf_counter() - start)
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((variant, min(timings), sum(timings) / len(timings), py_peak, max_rss_kb))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--n-attrs", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as workdir:
+        config_file = make_pism_config(os.path.join(workdir, "pism_config.nc"), args.n_attrs)
+        print(f"Template: {os.path.getsize(config_file) / 1024:.1f} KiB, {args.n_attrs * 3} attributes")
+        print(f"{'variant':<12} {'best [ms]':>10} {'mean [ms]':>10} {'py peak [KiB]':>14} {'max RSS [MiB]':>14}")
+        for variant in ["xarray", "header_only"]:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_run, args=(variant, config_file, workdir, args.repeat, queue))
+            proc.start()
+            proc.join()
+            if proc.exitcode != 0:
+                sys.exit(f"The {variant} variant failed!")
+            name, best, mean, py_peak, max_rss_kb = queue.get()
+            print(
+                f"{name:<12} {best * 1e3:>10.2f} {mean * 1e3:>10.2f} "
+                f"{py_peak / 1024:>14.1f} {max_rss_kb / 1024:>14.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of the plugin pipeline on synthetic configs.
+
+All entry points of the compute recipe are run in recipe order on configs of
+increasing size (see ``fixtures.SIZES``), from the example config up to
+thousands of kv_pairs, flags and coupler files. Every size runs twice in its
+own subprocess: first with an empty cache directory ("cold", like the first
+chunk of an experiment), then again with the caches filled ("warm", like every
+later chunk). Wall time and peak Python memory of every entry point are
+recorded and compared against ``benchmarks/baseline.json``. All inputs are
+generated locally, so the benchmark runs offline.
+
+Usage::
+
+    $ python benchmarks/bench_pipeline.py [--sizes example medium large]
+    $ python benchmarks/bench_pipeline.py --update-baseline
+"""
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from queue import Empty
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from fixtures import SIZES, make_example_config, make_scaled_config  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+RECIPE = [
+    "pism_set_kv_pairs",
+    "pism_set_flags",
+    "pism_set_couplers",
+    "pism_check_forcing_files",
+    "pism_override_file",
+    "pism_assemble_command",
+]
+
+
+def _run_size(size, workdir, queue):
+    from loguru import logger
+
+    from esm_pism import plugin
+
+    logger.remove()
+    if SIZES[size] is None:
+        config = make_example_config(workdir)
+    else:
+        config = make_scaled_config(workdir, **SIZES[size])
+    results = {}
+    for phase in ["cold", "warm"]:
+        phase_config = copy.deepcopy(config)
+        tracemalloc.start()
+        for step in RECIPE:
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            phase_config = getattr(plugin, step)(phase_config)
+            wall = time.perf_counter() - start
+            if phase_config is None:
+                raise RuntimeError(f"{step} failed")
+            results[f"{phase}/{step}"] = {"wall": wall, "peak": tracemalloc.get_traced_memory()[1]}
+        tracemalloc.stop()
+    queue.put(results)
+
+
+def run(sizes):
+    """Runs the benchmark for all ``sizes`` and returns the results"""
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_run_size, args=(size, workdir, queue))
+            proc.start()
+            # Read before joining, so a large result cannot block the child:
+            while True:
+                try:
+                    results[size] = queue.get(timeout=1)
+                    break
+                except Empty:
+                    if not proc.is_alive():
+                        sys.exit(f"The benchmark failed for size {size}!")
+            proc.join()
+    return results
+
+
+def compare(results, baseline, tolerance, slack_ms):
+    """Returns descriptions of all steps slower than the baseline allows"""
+    regressions = []
+    for size, size_results in results.items():
+        for step, result in size_results.items():
+            reference = baseline.get(size, {}).get(step)
+            if reference is None:
+                continue
+            allowed = reference["wall"] * tolerance + slack_ms / 1e3
+            if result["wall"] > allowed:
+                regressions.append(
+                    f"{size} {step}: {result['wall'] * 1e3:.1f} ms > {allowed * 1e3:.1f} ms allowed"
+                )
+            if result["peak"] > reference["peak"] * tolerance + 1024 ** 2:
+                regressions.append(
+                    f"{size} {step}: peak {result['peak'] / 1024:.0f} KiB > "
+                    f"baseline {reference['peak'] / 1024:.0f} KiB"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown factor")
+    parser.add_argument("--slack-ms", type=float, default=5, help="allowed absolute slowdown")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args.sizes)
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    print(f"{'size':<8} {'step':<32} {'wall [ms]':>10} {'baseline':>10} {'peak [KiB]':>11}")
+    for size, size_results in results.items():
+        for step, result in size_results.items():
+            reference = baseline.get(size, {}).get(step, {}).get("wall")
+            reference = f"{reference * 1e3:>10.1f}" if reference is not None else f"{'-':>10}"
+            print(f"{size:<8} {step:<32} {result['wall'] * 1e3:>10.1f} {reference} {result['peak'] / 1024:>11.0f}")
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Updated {BASELINE_FILE}")
+        return
+    regressions = compare(results, baseline, args.tolerance, args.slack_ms)
+    if regressions:
+        sys.exit("Performance regressions:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Measures import and first-call latency of the ``esm_tools.plugins`` entry points.
+
+Every entry point listed in ``setup.cfg`` is loaded in a fresh interpreter, as
+esm_runscripts does for each recipe run, and then called on a synthetic
+experiment config. The first call runs with an empty cache directory ("cold");
+later calls find the caches of the earlier ones ("warm"), like later chunks of
+an experiment. The script exits with an error if any entry point exceeds the
+import or cold-call budget.
+
+Usage::
+
+    $ python benchmarks/bench_startup.py [--import-budget-ms 300] [--call-budget-ms 500]
+"""
+import argparse
+import configparser
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from fixtures import make_example_config  # noqa: E402
+
+HEAVY_MODULES = ["xarray", "pandas", "numpy", "netCDF4"]
+
+CHILD_SCRIPT = """
+import importlib, json, sys, time
+module_name, func_name, config_file = sys.argv[1:]
+start = time.perf_counter()
+func = getattr(importlib.import_module(module_name), func_name)
+imported = time.perf_counter()
+heavy = [m for m in {heavy!r} if m in sys.modules]
+with open(config_file) as f:
+    config = json.load(f)
+from loguru import logger
+logger.remove()
+called = time.perf_counter()
+func(config)
+done = time.perf_counter()
+print(json.dumps({{"import": imported - start, "call": done - called, "heavy": heavy}}))
+"""
+
+
+def entry_points():
+    """Reads the ``esm_tools.plugins`` entry points from ``setup.cfg``"""
+    parser = configparser.ConfigParser()
+    parser.read(os.path.join(REPO_DIR, "setup.cfg"))
+    for line in parser["entry_points"]["esm_tools.plugins"].strip().splitlines():
+        name, target = (part.strip() for part in line.split("="))
+        module_name, func_name = target.split(":")
+        yield name, module_name, func_name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--import-budget-ms", type=float, default=300)
+    parser.add_argument("--call-budget-ms", type=float, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    child_script = CHILD_SCRIPT.format(heavy=HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        config_file = os.path.join(workdir, "config.json")
+        with open(config_file, "w") as f:
+            json.dump(make_example_config(workdir), f)
+        print(f"{'entry point':<24} {'import [ms]':>12} {'cold [ms]':>10} {'warm [ms]':>10}  heavy modules at import")
+        for name, module_name, func_name in entry_points():
+            results = []
+            for _ in range(args.repeat):
+                output = subprocess.run(
+                    [sys.executable, "-c", child_script, module_name, func_name, config_file],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                    env=env,
+                ).stdout
+                results.append(json.loads(output.splitlines()[-1]))
+            import_ms = min(r["import"] for r in results) * 1e3
+            call_ms = results[0]["call"] * 1e3
+            warm_call_ms = min(r["call"] for r in results[1:]) * 1e3 if args.repeat > 1 else float("nan")
+            heavy = ",".join(results[0]["heavy"]) or "-"
+            print(f"{name:<24} {import_ms:>12.1f} {call_ms:>10.1f} {warm_call_ms:>10.1f}  {heavy}")
+            if import_ms > args.import_budget_ms:
+                failures.append(f"{name}: import took {import_ms:.1f} ms > {args.import_budget_ms} ms")
+            if call_ms > args.call_budget_ms:
+                failures.append(f"{name}: cold call took {call_ms:.1f} ms > {args.call_budget_ms} ms")
+    if failures:
+        sys.exit("Over budget:\n" + "\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Synthetic inputs for the benchmarks, generated locally so they run offline.
+"""
+import os
+
+import netCDF4
+import numpy as np
+
+# Problem sizes for the pipeline benchmark: number of kv_pairs, flags,
+# overrides_kv_pairs and coupler files.
+SIZES = {
+    "example": None,
+    "medium": {"n_kv": 200, "n_flags": 100, "n_overrides": 100, "n_files": 20},
+    "large": {"n_kv": 3000, "n_flags": 1000, "n_overrides": 1000, "n_files": 200},
+}
+
+
+# The parameters of the real ``pism_config.nc`` behind the options of the
+# example config, as (type, default, short option):
+EXAMPLE_PARAMETERS = {
+    "atmosphere.given.file": ("string", "", "atmosphere_given_file"),
+    "atmosphere.given.period": ("integer", 0, "atmosphere_given_period"),
+    "energy.basal_melt.use_grounded_cell_fraction": ("flag", "yes", "subgl_basal_melt"),
+    "geometry.grounded_cell_fraction": ("flag", "no", "subgl"),
+    "geometry.remove_icebergs": ("flag", "no", "kill_icebergs"),
+    "ocean.pico.file": ("string", "", "ocean_pico_file"),
+}
+
+
+def make_pism_config(path, n_attrs):
+    """Writes a synthetic ``pism_config.nc`` with ``n_attrs`` parameters"""
+    # PISM ships its config as a classic NetCDF file:
+    with netCDF4.Dataset(path, "w", format="NETCDF3_CLASSIC") as nc:
+        var = nc.createVariable("pism_config", "b")
+        attrs = {}
+        for key, (param_type, default, option) in EXAMPLE_PARAMETERS.items():
+            attrs[key] = default
+            attrs[f"{key}_type"] = param_type
+            attrs[f"{key}_option"] = option
+        for i in range(n_attrs):
+            attrs[f"group_{i % 40}.parameter_{i}"] = float(i)
+            attrs[f"group_{i % 40}.parameter_{i}_doc"] = "A parameter " * 8
+            attrs[f"group_{i % 40}.parameter_{i}_type"] = "number"
+        var.setncatts(attrs)
+    return path
+
+
+def make_example_config(workdir, n_attrs=200):
+    """
+    Builds an experiment config which all plugin entry points accept.
+
+    Parameters
+    ----------
+    workdir : str
+        Directory for the generated files (template config, run dirs)
+    n_attrs : int
+        Number of parameters in the template ``pism_config.nc``
+
+    Returns
+    -------
+    config : dict
+        An experiment config, similar to ``tests/esm_pism_example.yaml``
+    """
+    config_dir = os.path.join(workdir, "config")
+    os.makedirs(config_dir, exist_ok=True)
+    config_file = os.path.join(workdir, "pism_config.nc")
+    if not os.path.exists(config_file):
+        make_pism_config(config_file, n_attrs)
+    forcing_dir = os.path.join(workdir, "forcing")
+    os.makedirs(forcing_dir, exist_ok=True)
+    for name in ["climate_forcing_LIG_16km_monthly.nc", "ocean_forcing_8k_fesom_LIG.nc"]:
+        if not os.path.exists(os.path.join(forcing_dir, name)):
+            make_forcing_file(os.path.join(forcing_dir, name))
+    return {
+        "general": {"nyear": 100},
+        "pism": {
+            "executable": "pismr",
+            "pism_command_line_opts": [],
+            "cache_dir": os.path.join(workdir, "cache"),
+            "config_file": config_file,
+            "thisrun_config_dir": config_dir,
+            "current_year": 0,
+            "input_targets": {"input": "pismr_antarctica_16km.spinup_start.nc"},
+            "outdata_sources": {"ts_file": "ts.nc", "ex_file": "ex.nc"},
+            "restart_out_sources": {"restart": "restart.nc"},
+            "ts_vars": ["ivol", "iareag"],
+            "ts_times": "yearly",
+            "ex_vars": ["thk", "velsurf_mag"],
+            "ex_times": "0:10:1000",
+            "outdata_size": "medium",
+            "flags": ["no_subgl_basal_melt", "subgl"],
+            "kv_pairs": {"verbose": 2},
+            "overrides_kv_pairs": {"group_0.parameter_0": 5, "group_1.parameter_1": 3},
+            "couplers": {
+                "atmosphere": {
+                    "given": {
+                        "files": {
+                            "atmosphere_given_file": f"{forcing_dir}/climate_forcing_LIG_16km_monthly.nc"
+                        },
+                        "kv_pairs": {"atmosphere_given_period": 1},
+                    },
+                },
+                "surface": {"pdd": None},
+                "ocean": {
+                    "pico": {
+                        "files": {"ocean_pico_file": f"{forcing_dir}/ocean_forcing_8k_fesom_LIG.nc"},
+                        "flags": ["kill_icebergs"],
+                    }
+                },
+            },
+        },
+    }
+
+
+def make_forcing_file(path, nx=381, ny=381, n_time=12):
+    """
+    Writes a synthetic monthly forcing file.
+
+    The default grid is the one of a 16 km Antarctica setup, giving a file of
+    about 7 MB.
+    """
+    with netCDF4.Dataset(path, "w", format="NETCDF3_64BIT_OFFSET") as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("y", ny)
+        nc.createDimension("x", nx)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "days since 0-1-1"
+        time.calendar = "365_day"
+        time[:] = np.arange(n_time) * 365.0 / 12
+        for name, size in [("x", nx), ("y", ny)]:
+            coord = nc.createVariable(name, "f8", (name,))
+            coord.units = "m"
+            coord[:] = (np.arange(size) - size // 2) * 16000.0
+        temp = nc.createVariable("air_temp", "f4", ("time", "y", "x"))
+        rng = np.random.default_rng(0)
+        for i in range(n_time):
+            temp[i] = rng.standard_normal((ny, nx)).astype("f4")
+    return path
+
+
+def make_scaled_config(workdir, n_kv, n_flags, n_overrides, n_files, n_attrs=1500, n_unique_files=4):
+    """
+    Builds an experiment config with many options and coupler files.
+
+    Parameters
+    ----------
+    workdir : str
+        Directory for the generated files
+    n_kv, n_flags, n_overrides : int
+        Number of ``kv_pairs``, ``flags`` and ``overrides_kv_pairs``
+    n_files : int
+        Number of coupler files, spread over atmosphere, surface and ocean
+        couplers
+    n_attrs : int
+        Number of parameters in the template ``pism_config.nc``
+    n_unique_files : int
+        Number of distinct forcing files written; the coupler files are links
+        to these, so that large configs do not need gigabytes of disk space
+
+    Returns
+    -------
+    config : dict
+        An experiment config
+    """
+    config = make_example_config(workdir, n_attrs=n_attrs)
+    pism = config["pism"]
+    forcing_dir = os.path.join(workdir, "forcing")
+    os.makedirs(forcing_dir, exist_ok=True)
+    unique_files = []
+    for i in range(n_unique_files):
+        path = os.path.join(forcing_dir, f"unique_{i}.nc")
+        if not os.path.exists(path):
+            make_forcing_file(path)
+        unique_files.append(path)
+    pism["kv_pairs"] = {f"option_{i}": i for i in range(n_kv)}
+    pism["flags"] = [f"flag_{i}" for i in range(n_flags)]
+    pism["overrides_kv_pairs"] = {
+        f"group_{i % 40}.parameter_{i}": i * 2.0 for i in range(min(n_overrides, n_attrs))
+    }
+    couplers = {"atmosphere": {}, "surface": {}, "ocean": {}}
+    for i in range(n_files):
+        coupler_type = list(couplers)[i % 3]
+        model = f"model_{i // 30}"
+        file_path = os.path.join(forcing_dir, f"{coupler_type}_forcing_{i}.nc")
+        if not os.path.lexists(file_path):
+            os.symlink(unique_files[i % n_unique_files], file_path)
+        spec = couplers[coupler_type].setdefault(
+            model, {"files": {}, "kv_pairs": {f"{coupler_type}_{model}_period": 1}}
+        )
+        spec["files"][f"{coupler_type}_{model}_file_{i}"] = file_path
+    pism["couplers"] = couplers
+    # The synthetic options are not in the template, but are still checked:
+    pism["known_options"] = (
+        list(pism["kv_pairs"])
+        + pism["flags"]
+        + [option for coupler in couplers.values() for spec in coupler.values() for option in spec["files"]]
+        + [option for coupler in couplers.values() for spec in coupler.values() for option in spec["kv_pairs"]]
+    )
+    return config
@@ -0,0 +1,286 @@
+"""
+Shared cache of bootstrapped model states.
+
+When PISM starts from a ``spinup_file`` with ``-bootstrap``, it first fills
+in the missing fields and regrids the file onto the model grid, which can
+take a significant part of the first chunk at fine resolution. Every ensemble
+member (or repetition) starting from the same file with the same grid and
+bootstrapping options goes through the same work and ends up in the same
+state.
+
+The state right after bootstrapping (PISM run with ``-y 0``) is therefore
+kept in a cache. It is produced with the command of the run itself, without
+its output and run length options, as couplers and physics options may fill
+in fields of the state. The cache is keyed by these options and fingerprints
+of the contents of the input file and of the files named by the options. Later runs start from the cached state
+with a plain ``-i`` instead. A lock file makes sure concurrent runs do not
+bootstrap the same state twice: whoever holds the lock produces the state,
+everyone else waits for it. The lock uses exclusive creation rather than
+``fcntl`` locks, which are unreliable on many parallel filesystems. Its holder
+keeps touching it, so only the lock of a process which died is taken over.
+"""
+import contextlib
+import os
+import socket
+import subprocess
+import threading
+import time
+import uuid
+
+from loguru import logger
+
+from .cache import tmp_path
+from .store import store_key
+
+BOOTSTRAP_VERSION = 2
+STATE_FILE = "bootstrapped.nc"
+
+# Options which only matter for bootstrapping, and are dropped when starting
+# from a bootstrapped state:
+BOOTSTRAP_OPTIONS = ["bootstrap", "Mx", "My", "Mz", "Mbz", "Lx", "Ly", "Lz", "Lbz", "x_range", "y_range", "z_spacing"]
+BOOTSTRAP_PREFIXES = ["bootstrapping.", "grid."]
+# Options which only concern the output and the length of a run, and are left
+# out of the bootstrapping command:
+RUN_OPTIONS = [
+    "i",
+    "bootstrap",
+    "o",
+    "o_size",
+    "o_format",
+    "ys",
+    "ye",
+    "y",
+    "ts_file",
+    "ts_vars",
+    "ts_times",
+    "extra_file",
+    "extra_vars",
+    "extra_times",
+    "extra_split",
+    "save_file",
+    "save_times",
+    "options_left",
+]
+
+
+def is_bootstrap_option(name):
+    """Whether the option ``name`` (without dashes) influences bootstrapping"""
+    name = name.lstrip("-")
+    return name in BOOTSTRAP_OPTIONS or name.startswith(tuple(BOOTSTRAP_PREFIXES))
+
+
+def is_run_option(name):
+    """Whether the option ``name`` (without dashes) only concerns the output or length of a run"""
+    return name.lstrip("-") in RUN_OPTIONS
+
+
+def state_key(input_fingerprint, options, executable, resolution=None, files=None):
+    """
+    Hashes everything which determines a bootstrapped state.
+
+    Parameters
+    ----------
+    input_fingerprint : str
+        Fingerprint of the contents of the file given to ``-i``
+    options : dict
+        The options of the bootstrapping command, see :func:`is_run_option`
+    executable : str
+        The PISM executable
+    resolution : str, optional
+        The resolution of the setup
+    files : dict, optional
+        Fingerprints of the contents of the files named by the options
+    """
+    return store_key(
+        input=input_fingerprint,
+        options=options,
+        files=files or {},
+        executable=executable,
+        resolution=resolution,
+        bootstrap_version=BOOTSTRAP_VERSION,
+    )
+
+
+def state_path(store_dir, key):
+    """Returns where the state stored under ``key`` is kept"""
+    return os.path.join(store_dir, key[:2], key, STATE_FILE)
+
+
+def _lock_owner(lock_file):
+    """Returns the contents of ``lock_file``, or ``None`` if it does not exist"""
+    try:
+        with open(lock_file) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def try_lock(lock_file, stale_seconds):
+    """
+    Tries to create ``lock_file`` exclusively.
+
+    A lock file which was not refreshed (see :func:`refreshing`) for
+    ``stale_seconds`` is considered abandoned (e.g. by a job which was
+    killed) and is taken over.
+
+    Returns
+    -------
+    token : str or None
+        Identifies the holder of the lock, for :func:`release_lock`; ``None``
+        if the lock is held by someone else
+    """
+    token = f"{socket.gethostname()} {os.getpid()} {uuid.uuid4().hex}\n"
+    try:
+        fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        owner = _lock_owner(lock_file)
+        try:
+            age = time.time() - os.path.getmtime(lock_file)
+        except FileNotFoundError:
+            return try_lock(lock_file, stale_seconds)
+        if age < stale_seconds:
+            return None
+        # Only remove the lock which was found to be stale, not one another
+        # process took over in the meantime:
+        if owner is not None and _lock_owner(lock_file) == owner:
+            logger.warning(f"Taking over the lock {lock_file}, abandoned {age / 60:.0f} minutes ago")
+            release_lock(lock_file, owner)
+        return try_lock(lock_file, stale_seconds)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return token
+
+
+def release_lock(lock_file, token):
+    """Removes ``lock_file`` if it is still held with ``token``"""
+    if _lock_owner(lock_file) != token:
+        logger.warning(f"The lock {lock_file} was taken over by another process")
+        return
+    try:
+        os.remove(lock_file)
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def refreshing(lock_file, token, interval):
+    """Touches ``lock_file`` every ``interval`` seconds while held, so it does not become stale"""
+    done = threading.Event()
+
+    def refresh():
+        while not done.wait(interval):
+            if _lock_owner(lock_file) != token:
+                return
+            try:
+                os.utime(lock_file)
+            except FileNotFoundError:
+                return
+
+    thread = threading.Thread(target=refresh, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def cached_state(store_dir, key, build, timeout=3600, poll=10, stale_seconds=None):
+    """
+    Returns the state stored under ``key``, bootstrapping it first if needed.
+
+    Parameters
+    ----------
+    store_dir : str
+        Root directory of the cache
+    key : str
+        See :func:`state_key`
+    build : callable
+        Called with a path to write the bootstrapped state to
+    timeout : float
+        Seconds to wait for another process producing the same state
+    poll : float
+        Seconds between checks while waiting
+    stale_seconds : float, optional
+        Time without a refresh after which a lock is considered abandoned,
+        default ``timeout``. The holder refreshes it four times as often.
+
+    Returns
+    -------
+    state : str or None
+        The path of the state, or ``None`` if it could not be produced or the
+        wait timed out
+    reused : bool
+        Whether the state already existed or was produced by another process
+    """
+    state = state_path(store_dir, key)
+    if os.path.exists(state):
+        return state, True
+    os.makedirs(os.path.dirname(state), exist_ok=True)
+    lock_file = f"{state}.lock"
+    stale_seconds = stale_seconds or timeout
+    deadline = time.monotonic() + timeout
+    token = try_lock(lock_file, stale_seconds)
+    while not token:
+        if time.monotonic() > deadline:
+            logger.warning(f"Timed out waiting for {lock_file}")
+            return None, False
+        time.sleep(poll)
+        token = try_lock(lock_file, stale_seconds)
+    try:
+        if os.path.exists(state):
+            # Produced while waiting for the lock:
+            return state, True
+        tmp_state = tmp_path(state)
+        try:
+            with refreshing(lock_file, token, stale_seconds / 4):
+                build(tmp_state)
+            os.replace(tmp_state, state)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(f"Unable to bootstrap the state {state}: {e}")
+            return None, False
+        finally:
+            if os.path.exists(tmp_state):
+                os.remove(tmp_state)
+        return state, False
+    finally:
+        release_lock(lock_file, token)
+
+
+def bootstrap(executable, input_file, options, target, launcher=None, cwd=None, log_file=None):
+    """
+    Runs PISM for zero years to write the bootstrapped state to ``target``.
+
+    Parameters
+    ----------
+    executable : str
+        The PISM executable
+    input_file : str
+        The file to bootstrap from
+    options : list of str
+        The options of the run, without its output and run length, e.g.
+        ``["-Mx 301", "-My 561", "-surface given", "-surface_given_file f.nc"]``
+    target : str
+        Where to write the state
+    launcher : list of str, optional
+        Prefix of the command, e.g. ``["srun", "-n", "4"]``
+    cwd : str, optional
+        Working directory
+    log_file : str, optional
+        Where to write the output of PISM
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If PISM fails
+    """
+    command = list(launcher or []) + [executable, "-bootstrap", "-i", input_file]
+    for option in options:
+        command += option.split(None, 1)
+    command += ["-y", "0", "-o", target]
+    logger.info(f"Bootstrapping: {' '.join(command)}")
+    if log_file:
+        with open(log_file, "a") as log:
+            subprocess.run(command, cwd=cwd, check=True, stdout=log, stderr=subprocess.STDOUT)
+    else:
+        subprocess.run(command, cwd=cwd, check=True)
@@ -0,0 +1,132 @@
+"""
+Shared helpers for the on-disk caches used by the PISM plugins.
+
+All caches live below a single directory, which is taken from (in order):
+
+1. ``pism.cache_dir`` in the experiment config
+2. the ``ESM_PISM_CACHE_DIR`` environment variable
+3. ``$XDG_CACHE_HOME/esm_pism`` (usually ``~/.cache/esm_pism``)
+
+Cache entries are plain JSON or NetCDF files which are always published
+atomically (written to a temporary name and then renamed), so several
+experiments may share one cache directory.
+"""
+import hashlib
+import json
+import os
+import threading
+
+from loguru import logger
+
+from .instrument import record_file
+
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def get_cache_dir(pism_config=None, subdir=None):
+    """
+    Determines (and creates) the cache directory.
+
+    Parameters
+    ----------
+    pism_config : dict, optional
+        The PISM section of the experiment config
+    subdir : str, optional
+        A sub-directory for one specific kind of cache
+
+    Returns
+    -------
+    cache_dir : str or None
+        The directory, or ``None`` if it cannot be created
+    """
+    cache_dir = (pism_config or {}).get("cache_dir") or os.environ.get("ESM_PISM_CACHE_DIR")
+    if not cache_dir:
+        cache_dir = os.path.join(
+            os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "esm_pism"
+        )
+    if subdir:
+        cache_dir = os.path.join(cache_dir, subdir)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError as e:
+        logger.warning(f"Unable to use cache directory {cache_dir}: {e}")
+        return None
+    return cache_dir
+
+
+def file_stat_key(path):
+    """Returns the absolute path, size and modification time of ``path``"""
+    stat = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def content_hash(path):
+    """Returns the SHA-256 hex digest of the contents of ``path``"""
+    record_file(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_fingerprint(path, cache_dir=None):
+    """
+    Returns a hash of the contents of ``path``.
+
+    If ``cache_dir`` is given, the hash is remembered there and only computed
+    again when the size or modification time of the file changes.
+    """
+    stat_key = file_stat_key(path)
+    entry_file = os.path.join(cache_dir, f"{path_digest(path)}.json") if cache_dir else None
+    if entry_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        entry = read_json(entry_file)
+        if entry and entry.get("stat") == stat_key:
+            return entry["fingerprint"]
+    digest = content_hash(path)
+    if entry_file:
+        write_json(entry_file, {"stat": stat_key, "fingerprint": digest})
+    return digest
+
+
+def path_digest(path):
+    """Returns a short digest of an absolute path, usable as a file name"""
+    return hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:32]
+
+
+def tmp_path(path):
+    """
+    Returns a temporary name next to ``path`` which is unique per process and
+    thread, to be renamed to ``path`` once complete.
+    """
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def read_json(path):
+    """Reads a JSON cache entry, returning ``None`` if it is missing or broken"""
+    record_file(path)
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    """Atomically writes a JSON cache entry. Failures are only logged."""
+    record_file(path)
+    tmp_file = tmp_path(path)
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, path)
+    except OSError as e:
+        logger.warning(f"Unable to write cache entry {path}: {e}")
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
@@ -0,0 +1,147 @@
+"""
+Structured model of the PISM command line.
+
+Options are kept in insertion order and indexed by their name, so adding an
+option which is already present replaces its value in place rather than adding
+a second copy. The rendered command is therefore identical between runs with
+the same configuration, and its digest can be used as a cache key.
+
+In the experiment config, the options are still stored as a plain list of
+strings in ``pism_command_line_opts``, since the config is written to YAML by
+esm_runscripts. :meth:`PismCommand.from_list` and :meth:`PismCommand.to_list`
+convert between the two.
+"""
+import hashlib
+
+from loguru import logger
+
+CONFLICT_RULES = ["last_wins", "error"]
+
+
+class CommandConflictError(ValueError):
+    """Raised when an option is given twice with different values"""
+
+
+class PismCommand:
+    """
+    An ordered, de-duplicated set of PISM command line options.
+
+    Parameters
+    ----------
+    conflicts : str
+        What to do if an option is added again with a different value:
+        ``"last_wins"`` replaces the old value (with a warning), ``"error"``
+        raises :class:`CommandConflictError`.
+    """
+
+    def __init__(self, conflicts="last_wins"):
+        if conflicts not in CONFLICT_RULES:
+            raise ValueError(f"Unknown conflict rule {conflicts}, use one of {', '.join(CONFLICT_RULES)}")
+        self.conflicts = conflicts
+        # Maps the option name (without leading dashes) to the option as
+        # written (with dashes) and its value, None for flags:
+        self._options = {}
+
+    @staticmethod
+    def _normalize(option):
+        option = str(option).strip()
+        return option if option.startswith("-") else f"-{option}"
+
+    def add(self, option, value=None):
+        """
+        Adds an option; ``value=None`` adds a flag.
+
+        The leading ``-`` of ``option`` is optional.
+        """
+        option = self._normalize(option)
+        name = option.lstrip("-")
+        value = None if value is None else str(value)
+        if name in self._options and self._options[name][1] != value:
+            old_value = self._options[name][1]
+            message = f"PISM option {option} is set twice: {old_value!r} and {value!r}"
+            if self.conflicts == "error":
+                raise CommandConflictError(message)
+            logger.warning(f"{message}; using {value!r}")
+        # Replacing an existing entry keeps its original position:
+        self._options[name] = (option, value)
+        return self
+
+    def set(self, option, value=None):
+        """
+        Sets an option, replacing a previous value without a conflict.
+
+        Meant for deliberate changes of an assembled command, e.g. for the
+        members of an ensemble.
+        """
+        option = self._normalize(option)
+        name = option.lstrip("-")
+        self._options[name] = (self._options.get(name, (option, None))[0], None if value is None else str(value))
+        return self
+
+    def remove(self, option):
+        """Removes ``option``, if it is set"""
+        self._options.pop(self._normalize(option).lstrip("-"), None)
+        return self
+
+    def add_kv_pairs(self, kv_pairs):
+        """Adds all key-value pairs of a dictionary"""
+        for key, value in kv_pairs.items():
+            self.add(key, value)
+        return self
+
+    def add_flags(self, flags):
+        """Adds all flags of a list"""
+        for flag in flags:
+            self.add(flag)
+        return self
+
+    def extend(self, other):
+        """Adds all options of another :class:`PismCommand` or list of strings"""
+        if isinstance(other, PismCommand):
+            for option, value in other._options.values():
+                self.add(option, value)
+        else:
+            self.extend(PismCommand.from_list(other, self.conflicts))
+        return self
+
+    def __contains__(self, option):
+        return self._normalize(option).lstrip("-") in self._options
+
+    def __len__(self):
+        return len(self._options)
+
+    def get(self, option, default=None):
+        """Returns the value of ``option``"""
+        entry = self._options.get(self._normalize(option).lstrip("-"))
+        return default if entry is None else entry[1]
+
+    def names(self):
+        """Returns the option names (without leading dashes), in order"""
+        return list(self._options)
+
+    @classmethod
+    def from_list(cls, options, conflicts="last_wins"):
+        """
+        Parses a list of strings like ``["-verbose 2", "-pik"]``.
+
+        Each entry is split into the option and its value at the first
+        whitespace.
+        """
+        command = cls(conflicts)
+        for entry in options:
+            parts = str(entry).strip().split(None, 1)
+            if parts:
+                command.add(parts[0], parts[1] if len(parts) > 1 else None)
+        return command
+
+    def to_list(self):
+        """Returns the options as a list of strings, in order"""
+        return [option if value is None else f"{option} {value}" for option, value in self._options.values()]
+
+    def render(self, executable=None):
+        """Returns the canonical command line string"""
+        return " ".join(([executable] if executable else []) + self.to_list())
+
+    def digest(self, executable=None):
+        """Returns a SHA-256 hex digest of the canonical command line"""
+        return hashlib.sha256(self.render(executable).encode()).hexdigest()
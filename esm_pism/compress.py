@@ -0,0 +1,205 @@
+"""
+Compression and rechunking of PISM output files after a run.
+
+PISM writes its restart, time series and extra files uncompressed, with a
+layout made for writing one record at a time. :func:`compress_file` rewrites
+such a file as NetCDF4 with zlib and shuffle, using chunks which are
+contiguous along time (so that reading a time series of one point, or a block
+of records, touches few chunks). Floating point variables may additionally be
+bit-rounded, keeping only as many mantissa bits as requested, which makes them
+compress much better.
+
+The new file is written next to the original and verified against it, and only
+then replaces the original atomically. A failure at any point leaves the
+original untouched.
+"""
+import os
+import shutil
+
+from loguru import logger
+
+from .cache import tmp_path
+from .instrument import pool_map
+from .netcdf import copy_dataset, open_dataset
+from .subset import find_time_dimension
+
+DEFAULT_CHUNK_BYTES = 4 * 1024 ** 2
+
+
+def chunk_sizes(shape, dimensions, time_dim, itemsize, target_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Chooses chunk sizes which are contiguous along time.
+
+    The time dimension is kept whole, and the other dimensions are halved
+    (largest first) until a chunk is at most ``target_bytes``. Only if a
+    single record is still too large is the time dimension split, too.
+
+    Returns
+    -------
+    chunks : list of int or None
+        ``None`` for scalar variables, which are stored contiguously
+    """
+    if not shape:
+        return None
+    chunks = [max(size, 1) for size in shape]
+    time_axis = dimensions.index(time_dim) if time_dim in dimensions else None
+
+    def nbytes():
+        total = itemsize
+        for size in chunks:
+            total *= size
+        return total
+
+    while nbytes() > target_bytes:
+        spatial = [axis for axis in range(len(chunks)) if axis != time_axis and chunks[axis] > 1]
+        if spatial:
+            axis = max(spatial, key=lambda axis: chunks[axis])
+        elif time_axis is not None and chunks[time_axis] > 1:
+            axis = time_axis
+        else:
+            break
+        chunks[axis] = (chunks[axis] + 1) // 2
+    return chunks
+
+
+def is_compressed(path):
+    """Whether all non-scalar variables of ``path`` are already compressed"""
+    with open_dataset(path, "r") as nc:
+        if not nc.data_model.startswith("NETCDF4"):
+            return False
+        return all(var.filters().get("zlib") for var in nc.variables.values() if var.ndim > 0)
+
+
+def _blocks(var, time_dim, chunks):
+    """Yields index tuples covering ``var`` in blocks of whole chunks along time"""
+    if var.ndim == 0 or time_dim not in var.dimensions:
+        yield Ellipsis
+        return
+    axis = var.dimensions.index(time_dim)
+    step = chunks[axis] if chunks else 1
+    for start in range(0, var.shape[axis], step):
+        index = [slice(None)] * var.ndim
+        index[axis] = slice(start, min(start + step, var.shape[axis]))
+        yield tuple(index)
+
+
+def _verify(source, target, rounded_bits):
+    """
+    Compares all variables of ``target`` with ``source``.
+
+    Returns
+    -------
+    error : str or None
+        The first difference found, or ``None``
+    """
+    import numpy as np
+
+    with open_dataset(source, "r") as src, open_dataset(target, "r") as dst:
+        time_dim = find_time_dimension(src)
+        for name, var in src.variables.items():
+            if name not in dst.variables or dst.variables[name].shape != var.shape:
+                return f"{name} differs in shape"
+            out = dst.variables[name]
+            var.set_auto_maskandscale(False)
+            out.set_auto_maskandscale(False)
+            chunks = out.chunking() if out.chunking() != "contiguous" else None
+            for index in _blocks(var, time_dim, chunks):
+                original = np.asarray(var[index])
+                written = np.asarray(out[index])
+                if name in rounded_bits:
+                    # Bit-rounding to n bits changes values by at most
+                    # 2**-(n+1) relative; allow for twice that:
+                    tolerance = 2.0 ** -rounded_bits[name] * np.abs(original)
+                    finite = np.isfinite(original)
+                    if not np.all(np.abs(written - original)[finite] <= tolerance[finite]):
+                        return f"{name} differs by more than bit-rounding allows"
+                elif not np.array_equal(original, written, equal_nan=original.dtype.kind == "f"):
+                    return f"{name} differs"
+    return None
+
+
+def compress_file(path, complevel=4, bitround=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Compresses and rechunks a NetCDF file in place.
+
+    Parameters
+    ----------
+    path : str
+        The file to compress
+    complevel : int
+        zlib compression level, 1 to 9
+    bitround : dict, optional
+        Maps variable names to the number of mantissa bits to keep
+    chunk_bytes : int
+        Target size of an uncompressed chunk
+
+    Returns
+    -------
+    sizes : tuple of int
+        The size of the file before and after; equal if the file was already
+        compressed
+    """
+    size_before = os.path.getsize(path)
+    if is_compressed(path):
+        logger.debug(f"{path} is already compressed")
+        return size_before, size_before
+    bitround = bitround or {}
+    rounded_bits = {}
+    tmp_file = tmp_path(path)
+    try:
+        with open_dataset(path, "r") as src, open_dataset(tmp_file, "w", format="NETCDF4") as dst:
+            time_dim = find_time_dimension(src)
+
+            def variable_kwargs(name, var):
+                chunks = chunk_sizes(var.shape, var.dimensions, time_dim, var.dtype.itemsize, chunk_bytes)
+                if not chunks:
+                    return {}
+                kwargs = {"zlib": True, "complevel": complevel, "shuffle": True, "chunksizes": chunks}
+                if name in bitround and var.dtype.kind == "f":
+                    kwargs.update(significant_digits=bitround[name], quantize_mode="BitRound")
+                    rounded_bits[name] = bitround[name]
+                return kwargs
+
+            copy_dataset(src, dst, time_dim, variable_kwargs=variable_kwargs)
+        error = _verify(path, tmp_file, rounded_bits)
+        if error:
+            raise ValueError(f"Verification of the compressed copy of {path} failed: {error}")
+        shutil.copymode(path, tmp_file)
+        os.replace(tmp_file, path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return size_before, os.path.getsize(path)
+
+
+def _compress_job(job):
+    """Runs :func:`compress_file` in a worker, returning an error message instead of raising"""
+    path, kwargs = job
+    try:
+        return compress_file(path, **kwargs), None
+    except Exception as e:
+        return None, f"Unable to compress {path}: {e}"
+
+
+def compress_files(jobs, max_workers=4):
+    """
+    Compresses several files in a process pool.
+
+    Parameters
+    ----------
+    jobs : list of tuple
+        ``(path, kwargs)`` for :func:`compress_file`
+    max_workers : int
+        Number of processes
+
+    Returns
+    -------
+    results : list of tuple
+        ``(sizes, error)`` for each job; ``sizes`` is ``None`` if it failed
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if len(jobs) > 1 and max_workers > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+            return pool_map(pool, _compress_job, jobs)
+    return [_compress_job(job) for job in jobs]
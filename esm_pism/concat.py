@@ -0,0 +1,190 @@
+"""
+Consolidation of the per-chunk output files into one growing time series.
+
+Every chunk of an experiment writes its own ``ts_file`` and ``extra_file``.
+:func:`append_chunk` appends the records of one such file to a consolidated
+file along its unlimited time dimension, one record at a time, so neither the
+consolidated file nor earlier chunks are ever read back.
+
+Next to the consolidated file, a small JSON index (``<file>.index.json``)
+records which records and model years each chunk covers, so readers can go
+straight to a time window (see :func:`find_records`). The index is also what
+makes appending safe to repeat: a chunk which is already in the index is not
+appended again, and new records are always written right after the last
+indexed record, so records left over from an interrupted append are simply
+overwritten. An empty index is written before the consolidated file is
+created, so a file left over from an interrupted first append is recreated.
+"""
+import os
+
+from loguru import logger
+
+from .cache import file_stat_key, read_json, write_json
+from .compress import DEFAULT_CHUNK_BYTES, chunk_sizes
+from .netcdf import copy_dataset, copy_values, open_dataset
+from .subset import find_time_dimension, time_to_year
+
+CONCAT_VERSION = 1
+INDEX_SUFFIX = ".index.json"
+# Upper bound on the records in one chunk of a time-dependent variable:
+MAX_RECORDS_PER_CHUNK = 1024
+
+
+def index_path(target):
+    """Returns the path of the index of the consolidated file ``target``"""
+    return f"{target}{INDEX_SUFFIX}"
+
+
+def read_index(target):
+    """
+    Reads the index of ``target``.
+
+    Returns
+    -------
+    index : dict
+        With ``records`` (the number of valid records in ``target``),
+        ``units`` and ``calendar`` of the time axis, and ``chunks``, a list
+        with one entry per appended chunk
+    """
+    index = read_json(index_path(target))
+    if not index or index.get("version") != CONCAT_VERSION:
+        return {"version": CONCAT_VERSION, "records": 0, "units": None, "calendar": None, "chunks": []}
+    return index
+
+
+def records_per_chunk(shape, dimensions, time_dim, itemsize, target_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Chooses how many records one chunk of a consolidated variable holds.
+
+    Large fields get one record per chunk, as records are appended one at a
+    time. Time series and small fields share a chunk between many records
+    (up to :data:`MAX_RECORDS_PER_CHUNK`), instead of one tiny chunk each.
+    """
+    record_bytes = itemsize
+    for dim, size in zip(dimensions, shape):
+        if dim != time_dim:
+            record_bytes *= max(size, 1)
+    return int(max(1, min(MAX_RECORDS_PER_CHUNK, target_bytes // record_bytes)))
+
+
+def _create_target(src, target, time_dim):
+    """Creates the consolidated file with the structure of ``src`` and no records"""
+    with open_dataset(target, "w", format="NETCDF4") as dst:
+
+        def variable_kwargs(name, var):
+            if time_dim not in var.dimensions:
+                return {}
+            shape = [len(src.dimensions[dim]) for dim in var.dimensions]
+            records = records_per_chunk(shape, var.dimensions, time_dim, var.dtype.itemsize)
+            shape = [records if dim == time_dim else size for dim, size in zip(var.dimensions, shape)]
+            return {
+                "zlib": True,
+                "shuffle": True,
+                "chunksizes": chunk_sizes(shape, var.dimensions, time_dim, var.dtype.itemsize),
+            }
+
+        # Records are only added by append_chunk:
+        copy_dataset(src, dst, time_dim, dimensions={time_dim: None}, variable_kwargs=variable_kwargs, records=[])
+
+
+def append_chunk(source, target, chunk):
+    """
+    Appends the records of ``source`` to the consolidated file ``target``.
+
+    Records which are not later than the last record of ``target`` (e.g. the
+    record at the boundary between two chunks) are skipped.
+
+    Parameters
+    ----------
+    source : str
+        The output file of one chunk
+    target : str
+        The consolidated file, created if needed
+    chunk : str or int
+        Identifies the chunk, e.g. ``general.run_number``
+
+    Returns
+    -------
+    entry : dict or None
+        The index entry of the chunk, or ``None`` if it was already appended
+    """
+    index = read_index(target)
+    source_key = file_stat_key(source)
+    for entry in index["chunks"]:
+        if entry["chunk"] == chunk:
+            if entry["source"] != source_key:
+                raise ValueError(f"Chunk {chunk} was already appended to {target} from a different file")
+            logger.debug(f"Chunk {chunk} is already part of {target}")
+            return None
+    last_time = index["chunks"][-1]["last_time"] if index["chunks"] else None
+    with open_dataset(source, "r") as src:
+        time_dim = find_time_dimension(src)
+        if time_dim is None or time_dim not in src.variables:
+            raise ValueError(f"{source} has no time axis")
+        time = src.variables[time_dim]
+        units = getattr(time, "units", "years since 0-1-1")
+        calendar = getattr(time, "calendar", "standard")
+        if index["units"] not in [None, units] or index["calendar"] not in [None, calendar]:
+            raise ValueError(
+                f"The time axis of {source} ({units}, {calendar}) does not match that of {target} "
+                f"({index['units']}, {index['calendar']})"
+            )
+        times = [float(t) for t in time[:]]
+        new_records = [i for i, t in enumerate(times) if last_time is None or t > last_time]
+        if not index["chunks"]:
+            # The empty index is written before the target is created, so a
+            # target with an empty index is left over from an interrupted
+            # first append and can be created again:
+            if os.path.exists(target) and read_json(index_path(target)) != index:
+                raise ValueError(f"{target} exists, but has no index {index_path(target)}; remove it first")
+            write_json(index_path(target), index)
+            _create_target(src, target, time_dim)
+        with open_dataset(target, "a") as dst:
+            for name, var in src.variables.items():
+                if time_dim not in var.dimensions:
+                    continue
+                if name not in dst.variables:
+                    raise ValueError(f"{target} has no variable {name}, which is in {source}")
+                copy_values(var, dst.variables[name], time_dim, new_records, start=index["records"])
+    entry = {
+        "chunk": chunk,
+        "source": source_key,
+        "first_record": index["records"],
+        "last_record": index["records"] + len(new_records) - 1,
+    }
+    if new_records:
+        first_time, entry["last_time"] = times[new_records[0]], times[new_records[-1]]
+        entry["start_year"] = time_to_year(first_time, units, calendar)
+        entry["end_year"] = time_to_year(entry["last_time"], units, calendar)
+    else:
+        entry.update(last_time=last_time, start_year=None, end_year=None)
+    index["chunks"].append(entry)
+    index.update(records=index["records"] + len(new_records), units=units, calendar=calendar)
+    write_json(index_path(target), index)
+    return entry
+
+
+def find_records(index, start_year, end_year):
+    """
+    Finds the records of a consolidated file overlapping a window of years.
+
+    Parameters
+    ----------
+    index : dict
+        See :func:`read_index`
+    start_year, end_year : float
+        The window
+
+    Returns
+    -------
+    records : tuple of int or None
+        ``(first, last)`` (inclusive), or ``None`` if no chunk overlaps
+    """
+    chunks = [
+        entry
+        for entry in index["chunks"]
+        if entry["start_year"] is not None and entry["start_year"] <= end_year and entry["end_year"] >= start_year
+    ]
+    if not chunks:
+        return None
+    return chunks[0]["first_record"], chunks[-1]["last_record"]
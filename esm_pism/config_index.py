@@ -0,0 +1,196 @@
+"""
+Persistent index of the valid keys of a ``pism_config.nc`` file.
+
+The index holds, for every PISM configuration parameter, its default value,
+type and command line option. It is stored as JSON in the cache directory (see :mod:`esm_pism.cache`)
+together with the path, size, modification time and content hash of the
+config file it was built from. As long as the config file is unchanged,
+checking override keys is a dictionary lookup and NetCDF is never touched.
+"""
+import os
+
+from loguru import logger
+
+from .cache import content_hash, file_stat_key, get_cache_dir, path_digest, read_json, write_json
+from .overrides import read_config_attrs
+
+INDEX_VERSION = 3
+
+# Attribute suffixes PISM uses to describe a parameter, rather than to set one:
+METADATA_SUFFIXES = ["_doc", "_type", "_units", "_option", "_choices", "_valid_min", "_valid_max"]
+
+TRUE_FLAG_VALUES = ["yes", "true", "on"]
+FALSE_FLAG_VALUES = ["no", "false", "off"]
+
+_memo = {}
+
+
+def _to_json_value(value):
+    """Converts NetCDF attribute values (numpy scalars) to plain Python"""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value
+
+
+def build_config_index(config_file):
+    """
+    Builds the index of a ``pism_config.nc`` file from its attributes.
+
+    Parameters
+    ----------
+    config_file : str
+        Path to a ``pism_config.nc`` file
+
+    Returns
+    -------
+    parameters : dict
+        Maps each parameter name to a dict with ``default`` and ``type``,
+        and ``option`` if the parameter has a short command line option
+    """
+    attrs = read_config_attrs(config_file)
+    parameters = {}
+    for key, value in attrs.items():
+        if any(key.endswith(suffix) and key[: -len(suffix)] in attrs for suffix in METADATA_SUFFIXES):
+            continue
+        param_type = attrs.get(f"{key}_type")
+        if param_type is None:
+            param_type = "string" if isinstance(value, str) else "number"
+        parameters[key] = {"default": _to_json_value(value), "type": str(param_type)}
+        if f"{key}_choices" in attrs:
+            parameters[key]["choices"] = str(attrs[f"{key}_choices"]).split(",")
+        if f"{key}_option" in attrs:
+            parameters[key]["option"] = str(attrs[f"{key}_option"]).lstrip("-")
+    return parameters
+
+
+def build_option_index(parameters):
+    """
+    Maps every command line option PISM accepts for its parameters to the
+    parameter name.
+
+    Each parameter can be set with its full name (``-atmosphere.given.period``)
+    and, if it has one, with its short option (``-atmosphere_given_period``).
+    Flags can also be switched off with ``-no_`` in front of either name
+    (``-no_subgl_basal_melt``).
+
+    Parameters
+    ----------
+    parameters : dict
+        See :func:`build_config_index`
+
+    Returns
+    -------
+    options : dict
+        Maps option names (without leading dashes) to parameter names
+    """
+    options = {key: key for key in parameters}
+    for key, spec in parameters.items():
+        if spec.get("option"):
+            options[spec["option"]] = key
+    for option, key in list(options.items()):
+        if parameters[key]["type"] in ["flag", "boolean"]:
+            options[f"no_{option}"] = key
+    return options
+
+
+def load_config_index(config_file, cache_dir=None):
+    """
+    Returns the index of ``config_file``, using the on-disk cache if possible.
+
+    A cached index is reused if the path, size and modification time still
+    match. If only the modification time changed (e.g. the file was touched
+    or copied), the content hash decides whether the index is rebuilt.
+
+    Parameters
+    ----------
+    config_file : str
+        Path to a ``pism_config.nc`` file
+    cache_dir : str, optional
+        Where to keep the index. Without one, the index is only memoized for
+        this process.
+
+    Returns
+    -------
+    index : dict
+        The ``parameters`` (see :func:`build_config_index`) and ``options``
+        (see :func:`build_option_index`) together with the ``path``, ``size``,
+        ``mtime_ns`` and ``content_hash`` of the file
+    """
+    stat_key = file_stat_key(config_file)
+    memo_key = tuple(stat_key.values())
+    if memo_key in _memo:
+        return _memo[memo_key]
+
+    cache_file = None
+    cached = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, f"{path_digest(config_file)}.json")
+        cached = read_json(cache_file)
+        if cached and cached.get("version") != INDEX_VERSION:
+            cached = None
+    if cached and all(cached.get(key) == value for key, value in stat_key.items()):
+        logger.debug(f"Using cached PISM config index for {config_file}")
+        _memo[memo_key] = cached
+        return cached
+
+    file_hash = content_hash(config_file)
+    if cached and cached.get("content_hash") == file_hash:
+        logger.debug(f"PISM config {config_file} was touched, but is unchanged")
+        parameters = cached["parameters"]
+    else:
+        logger.debug(f"Building PISM config index for {config_file}")
+        parameters = build_config_index(config_file)
+    index = dict(
+        stat_key,
+        version=INDEX_VERSION,
+        content_hash=file_hash,
+        parameters=parameters,
+        options=build_option_index(parameters),
+    )
+    if cache_file:
+        write_json(cache_file, index)
+    _memo[memo_key] = index
+    return index
+
+
+def check_value_type(key, value, parameters):
+    """
+    Checks that ``value`` is acceptable for the PISM parameter ``key``.
+
+    Parameters
+    ----------
+    key : str
+        The PISM configuration parameter
+    value :
+        The value from the YAML config
+    parameters : dict
+        The ``parameters`` of the config index, see :func:`load_config_index`
+
+    Returns
+    -------
+    error : str or None
+        A description of the problem, or ``None`` if the value is fine
+    """
+    spec = parameters[key]
+    param_type = spec["type"]
+    if isinstance(value, (list, dict)):
+        return f"{key} expects a single {param_type}, not {value!r}"
+    if param_type in ["number", "integer"]:
+        # Strings would end up as text attributes, which PISM refuses to read
+        # as numbers:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f"{key} expects a {param_type}, not {value!r}"
+        if param_type == "integer" and not float(value).is_integer():
+            return f"{key} expects an integer, not {value!r}"
+    elif param_type in ["flag", "boolean"]:
+        if not isinstance(value, bool) and str(value).lower() not in TRUE_FLAG_VALUES + FALSE_FLAG_VALUES:
+            return f"{key} expects one of yes/no/true/false, not {value!r}"
+    elif param_type == "keyword" and "choices" in spec:
+        if str(value) not in spec["choices"]:
+            return f"{key} expects one of {','.join(spec['choices'])}, not {value!r}"
+    return None
+
+
+def get_config_index(pism_config, config_file):
+    """Loads the index of ``config_file`` using the cache configured for this experiment"""
+    return load_config_index(config_file, get_cache_dir(pism_config, "config_index"))
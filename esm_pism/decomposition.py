@@ -0,0 +1,151 @@
+"""
+Planning of the MPI domain decomposition of PISM.
+
+PISM splits its horizontal grid of ``Mx`` by ``My`` points into ``Nx`` by
+``Ny`` blocks, one per MPI rank. By default, PETSc chooses the split without
+knowing the shape of the grid, which for elongated or large grids can give
+thin blocks with a lot of halo exchange relative to the work of each rank.
+
+The planner uses a simple cost model for one time step of one rank: the
+points of its block (work), plus the points of its halo (communication,
+weighted by ``halo_weight``), plus a term growing with the logarithm of the
+number of ranks for global reductions (weighted by ``reduction_weight``). It
+only needs the grid size, which is read from the header of the input file.
+"""
+import math
+
+from .netcdf import open_dataset
+
+X_DIMENSIONS = ["x", "lon", "longitude"]
+Y_DIMENSIONS = ["y", "lat", "latitude"]
+
+# Relative cost of exchanging a halo point, compared to computing a point:
+HALO_WEIGHT = 4.0
+# Relative cost of a global reduction per doubling of the number of ranks,
+# in points:
+REDUCTION_WEIGHT = 2000.0
+HALO_WIDTH = 2
+# PETSc needs blocks at least as wide as the stencil:
+MIN_BLOCK_SIZE = 3
+# When fewer ranks may be used, every rank count this close below the
+# available ranks is tried; further below, only a few counts around every
+# RANK_SEARCH_RATIO-th step, so large allocations are planned quickly:
+NEAR_RANKS = 64
+RANK_SEARCH_RATIO = 1.1
+RANK_SEARCH_WINDOW = 4
+
+
+def read_grid_shape(path):
+    """
+    Reads the number of grid points along x and y from the header of ``path``.
+
+    Returns
+    -------
+    shape : tuple of int or None
+        ``(Mx, My)``, or ``None`` if the file has no recognizable grid
+    """
+    with open_dataset(path, "r") as nc:
+        x_dim = next((name for name in X_DIMENSIONS if name in nc.dimensions), None)
+        y_dim = next((name for name in Y_DIMENSIONS if name in nc.dimensions), None)
+        if not x_dim or not y_dim:
+            return None
+        return len(nc.dimensions[x_dim]), len(nc.dimensions[y_dim])
+
+
+def rank_cost(Mx, My, Nx, Ny, halo_weight=HALO_WEIGHT, reduction_weight=REDUCTION_WEIGHT):
+    """
+    Estimates the cost of one time step on the busiest rank, in grid points.
+
+    Returns
+    -------
+    cost : float
+        ``math.inf`` if the blocks would be too small
+    """
+    mx = math.ceil(Mx / Nx)
+    my = math.ceil(My / Ny)
+    if mx < MIN_BLOCK_SIZE or my < MIN_BLOCK_SIZE:
+        return math.inf
+    work = mx * my
+    # Blocks on the domain boundary have fewer neighbours; ignore that:
+    halo = 2 * HALO_WIDTH * ((mx if Ny > 1 else 0) + (my if Nx > 1 else 0))
+    return work + halo_weight * halo + reduction_weight * math.log2(Nx * Ny)
+
+
+def plan_layout(Mx, My, ranks, **weights):
+    """
+    Chooses the split of ``ranks`` into ``Nx`` by ``Ny`` with the lowest cost.
+
+    Returns
+    -------
+    layout : tuple or None
+        ``(Nx, Ny, cost)``, or ``None`` if no split gives large enough blocks
+    """
+    best = None
+    for Nx in _divisors(ranks):
+        Ny = ranks // Nx
+        cost = rank_cost(Mx, My, Nx, Ny, **weights)
+        if cost < math.inf and (best is None or cost < best[2]):
+            best = (Nx, Ny, cost)
+    return best
+
+
+def _divisors(n):
+    """Returns the divisors of ``n`` in ascending order"""
+    small = [d for d in range(1, math.isqrt(n) + 1) if n % d == 0]
+    return small + [n // d for d in reversed(small) if d * d != n]
+
+
+def candidate_ranks(max_ranks):
+    """
+    Lists the rank counts worth trying when up to ``max_ranks`` may be used.
+
+    All counts down to :data:`NEAR_RANKS` below ``max_ranks`` are tried.
+    Further below, the cost changes slowly with the number of ranks, so only
+    :data:`RANK_SEARCH_WINDOW` consecutive counts (one of which splits well)
+    every :data:`RANK_SEARCH_RATIO`-th step are, which keeps the number of
+    candidates logarithmic in ``max_ranks``.
+
+    Returns
+    -------
+    ranks : list of int
+        In ascending order
+    """
+    candidates = set(range(max(1, max_ranks - NEAR_RANKS + 1), max_ranks + 1))
+    point = float(max_ranks - NEAR_RANKS)
+    while point >= 1:
+        start = int(point)
+        candidates.update(range(max(1, start - RANK_SEARCH_WINDOW + 1), start + 1))
+        point /= RANK_SEARCH_RATIO
+    return sorted(candidates)
+
+
+def plan_decomposition(Mx, My, max_ranks, choose_ranks=False, **weights):
+    """
+    Plans the decomposition of an ``Mx`` by ``My`` grid.
+
+    Parameters
+    ----------
+    Mx, My : int
+        Grid points along x and y
+    max_ranks : int
+        The number of MPI ranks available
+    choose_ranks : bool
+        Whether fewer ranks may be used, if the model predicts they are not
+        slower (e.g. for small grids, or rank counts which are prime); see
+        :func:`candidate_ranks` for the counts which are tried
+    **weights :
+        ``halo_weight`` and ``reduction_weight`` of :func:`rank_cost`
+
+    Returns
+    -------
+    layout : tuple or None
+        ``(Nx, Ny)``, or ``None`` if no layout is possible
+    """
+    candidates = candidate_ranks(max_ranks) if choose_ranks else [max_ranks]
+    best = None
+    for ranks in candidates:
+        layout = plan_layout(Mx, My, ranks, **weights)
+        # On equal cost, prefer fewer ranks:
+        if layout and (best is None or layout[2] < best[2]):
+            best = layout
+    return best[:2] if best else None
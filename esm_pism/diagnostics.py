@@ -0,0 +1,255 @@
+"""
+Reduction of the extra files of each chunk to compact diagnostics.
+
+Monitoring an experiment usually needs a few numbers per output time (ice
+volume, grounded area, the mass balance of each drainage basin), not the 2D
+fields of the ``extra_file``. :func:`reduce_file` computes such reductions
+while streaming the extra file one record at a time, with the records split
+among worker processes, and :func:`append_diagnostics` appends the results to
+a small time series file covering the whole experiment.
+
+A diagnostic is described by a dictionary:
+
+``variable``
+    The field to reduce; without it, every cell counts as 1 (e.g. for areas)
+``reduction``
+    One of :data:`REDUCTIONS`, default ``sum``
+``area_weighted``
+    Multiply by the cell area (for ``sum``) or weight by it (for ``mean``)
+``where``
+    Maps variables to the values a cell must have to be included, e.g.
+    ``{"mask": [2]}`` for grounded ice
+``by_basin``
+    Also reduce every basin of the basin mask separately
+``scale``, ``units``
+    Factor applied to the result, and the units of the scaled result
+"""
+import os
+
+from loguru import logger
+
+from .instrument import pool_map
+from .netcdf import open_dataset
+from .subset import find_time_dimension
+
+REDUCTIONS = ["sum", "mean", "min", "max"]
+
+
+def check_spec(name, spec):
+    """
+    Returns a description of what is wrong with the diagnostic ``spec``, or
+    ``None`` if it is valid.
+    """
+    if spec.get("reduction", "sum") not in REDUCTIONS:
+        return f"Diagnostic {name}: unknown reduction {spec['reduction']}, use one of {', '.join(REDUCTIONS)}"
+    if not spec.get("variable") and spec.get("reduction", "sum") != "sum":
+        return f"Diagnostic {name}: {spec['reduction']} needs a variable"
+    return None
+
+
+def cell_area(nc):
+    """
+    Returns the area of every grid cell of ``nc``, from its ``cell_area``
+    variable or else from its ``x`` and ``y`` axes.
+    """
+    import numpy as np
+
+    if "cell_area" in nc.variables:
+        return np.ma.filled(np.squeeze(nc.variables["cell_area"][...]), 0.0).astype("f8")
+    x, y = (np.asarray(nc.variables[name][:], "f8") for name in ["x", "y"])
+    return np.full((len(y), len(x)), abs(float(x[1] - x[0]) * float(y[1] - y[0])))
+
+
+def read_basins(path, variable):
+    """Reads a basin mask as integers, with 0 for cells outside of all basins"""
+    import numpy as np
+
+    with open_dataset(path, "r") as nc:
+        basins = np.ma.filled(np.ma.asarray(nc.variables[variable][...]), 0)
+    return np.squeeze(basins).astype("i8")
+
+
+def _basin_ids(basins):
+    import numpy as np
+
+    return [int(basin) for basin in np.unique(basins) if basin > 0] if basins is not None else []
+
+
+def _reduce(values, weights, selected, reduction):
+    import numpy as np
+
+    if reduction == "sum":
+        return float(np.sum(values[selected] * weights[selected]))
+    if reduction == "mean":
+        total = np.sum(weights[selected])
+        return float(np.sum(values[selected] * weights[selected]) / total) if total else np.nan
+    return float(getattr(np, reduction)(values[selected])) if selected.any() else np.nan
+
+
+def reduce_record(fields, specs, area, basins=None, basin_ids=None):
+    """
+    Computes all diagnostics of one record.
+
+    Parameters
+    ----------
+    fields : dict
+        Maps variable names to 2D arrays (masked cells are excluded)
+    specs : dict
+        Maps diagnostic names to their description, see the module
+    area : numpy.ndarray
+        Cell areas, see :func:`cell_area`
+    basins : numpy.ndarray, optional
+        Basin mask, see :func:`read_basins`
+    basin_ids : list of int, optional
+        The basins in ``basins``, to avoid searching them for every record
+
+    Returns
+    -------
+    results : dict
+        Maps diagnostic names to values; per-basin results are named
+        ``<name>_basin_<id>``
+    """
+    import numpy as np
+
+    if basin_ids is None:
+        basin_ids = _basin_ids(basins)
+    results = {}
+    for name, spec in specs.items():
+        reduction = spec.get("reduction", "sum")
+        values = np.ones(area.shape)
+        if spec.get("variable"):
+            values = np.ma.filled(np.ma.asarray(fields[spec["variable"]], dtype="f8"), np.nan)
+        valid = np.isfinite(values)
+        for variable, accepted in spec.get("where", {}).items():
+            field = np.ma.asarray(fields[variable])
+            valid &= np.isin(field.filled(0), accepted) & ~np.ma.getmaskarray(field)
+        weights = area if spec.get("area_weighted") else np.ones(area.shape)
+        scale = spec.get("scale", 1.0)
+        results[name] = _reduce(values, weights, valid, reduction) * scale
+        if not spec.get("by_basin") or not basin_ids:
+            continue
+        if reduction in ["sum", "mean"]:
+            # All basins in one pass:
+            labels = np.where(valid, basins, 0).ravel()
+            products = np.where(valid, values * weights, 0.0).ravel()
+            sums = np.bincount(labels, weights=products, minlength=max(basin_ids) + 1)
+            totals = np.bincount(labels, weights=np.where(valid, weights, 0.0).ravel(), minlength=max(basin_ids) + 1)
+            for basin in basin_ids:
+                if reduction == "sum":
+                    result = sums[basin]
+                else:
+                    result = sums[basin] / totals[basin] if totals[basin] else np.nan
+                results[f"{name}_basin_{basin}"] = float(result) * scale
+        else:
+            for basin in basin_ids:
+                results[f"{name}_basin_{basin}"] = _reduce(values, weights, valid & (basins == basin), reduction) * scale
+    return results
+
+
+def _reduce_block(job):
+    """Reduces records ``first`` to ``last`` (exclusive) of a file. Runs in a worker process."""
+    import numpy as np
+
+    path, specs, basins, first, last = job
+    variables = {spec["variable"] for spec in specs.values() if spec.get("variable")}
+    variables |= {variable for spec in specs.values() for variable in spec.get("where", {})}
+    rows = []
+    with open_dataset(path, "r") as nc:
+        time_dim = find_time_dimension(nc)
+        area = cell_area(nc)
+        basin_ids = _basin_ids(basins)
+        for record in range(first, last):
+            fields = {}
+            for variable in variables:
+                var = nc.variables[variable]
+                index = tuple(record if dim == time_dim else slice(None) for dim in var.dimensions)
+                fields[variable] = np.ma.squeeze(var[index])
+            rows.append(reduce_record(fields, specs, area, basins, basin_ids))
+    return rows
+
+
+def reduce_file(path, specs, basins=None, max_workers=4):
+    """
+    Computes the diagnostics of every record of ``path``.
+
+    Parameters
+    ----------
+    path : str
+        An extra file
+    specs : dict
+        Maps diagnostic names to their description, see the module
+    basins : numpy.ndarray, optional
+        Basin mask on the grid of ``path``, see :func:`read_basins`
+    max_workers : int
+        Number of processes
+
+    Returns
+    -------
+    times : numpy.ndarray
+        The time axis of ``path``
+    time_attrs : dict
+        ``units`` and ``calendar`` of the time axis
+    rows : list of dict
+        The results of :func:`reduce_record`, one per record
+    """
+    import numpy as np
+
+    with open_dataset(path, "r") as nc:
+        time_dim = find_time_dimension(nc)
+        time = nc.variables[time_dim]
+        times = np.asarray(time[:], "f8")
+        time_attrs = {key: getattr(time, key) for key in ["units", "calendar"] if hasattr(time, key)}
+    blocks = max(1, min(max_workers, len(times)))
+    bounds = np.linspace(0, len(times), blocks + 1).astype(int)
+    jobs = [(path, specs, basins, first, last) for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+    if len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+            blocks = pool_map(pool, _reduce_block, jobs)
+    else:
+        blocks = [_reduce_block(job) for job in jobs]
+    return times, time_attrs, [row for block in blocks for row in block]
+
+
+def append_diagnostics(target, times, time_attrs, rows, specs):
+    """
+    Appends diagnostics to the time series file ``target``.
+
+    Records at or before the last time already in ``target`` are skipped, so
+    appending the same chunk again changes nothing. Diagnostics which are new
+    in ``specs`` are added, with missing values for earlier records.
+
+    Returns
+    -------
+    appended : int
+        The number of new records
+    """
+    import numpy as np
+
+    exists = os.path.exists(target)
+    with open_dataset(target, "a" if exists else "w", format="NETCDF4") as nc:
+        if not exists:
+            nc.createDimension("time", None)
+            time = nc.createVariable("time", "f8", ("time",))
+            time.setncatts(time_attrs)
+        time = nc.variables["time"]
+        if exists and time_attrs.get("units") != getattr(time, "units", None):
+            raise ValueError(f"The time units of {target} differ from {time_attrs.get('units')}")
+        last_time = time[-1] if len(time) else -np.inf
+        new = [(t, row) for t, row in zip(times, rows) if t > last_time]
+        offset = len(time)
+        for column in sorted({column for row in rows for column in row}):
+            if column not in nc.variables:
+                var = nc.createVariable(column, "f8", ("time",), fill_value=np.nan)
+                spec = specs.get(column) or specs.get(column.rsplit("_basin_", 1)[0], {})
+                for key in ["units", "reduction"]:
+                    if key in spec:
+                        var.setncattr(key, spec[key])
+        for i, (t, row) in enumerate(new):
+            for column, value in row.items():
+                nc.variables[column][offset + i] = value
+            # Written last, so an interrupted record is written again next time:
+            time[offset + i] = t
+    logger.debug(f"Appended {len(new)} records to {target}")
+    return len(new)
@@ -0,0 +1,168 @@
+"""
+Expansion of an experiment into an ensemble of parameter variations.
+
+Sensitivity ensembles often consist of hundreds of members which only differ
+in a few ``kv_pairs`` or ``overrides_kv_pairs``. Rather than running the whole
+plugin chain for every member, the members are derived from the command
+assembled for the experiment itself: each member gets that command with its
+own values, and its own overrides file. The overrides files are written in a
+process pool through the overrides store, so members with identical overrides
+share one file.
+
+The members are described in a manifest (``ensemble_manifest.json``), and
+their commands are also listed one per line in ``commands.txt``, so that task
+``i`` of a job array can simply run line ``i + 1``.
+
+An ensemble is specified by a grid of values (every combination is a member)
+or by ranges to sample from (Latin hypercube sampling). Parameters are named
+by their section and key, e.g. ``kv_pairs.sia_e`` or
+``overrides_kv_pairs.stress_balance.sia.enhancement_factor``.
+"""
+import itertools
+import os
+import random
+
+from .instrument import pool_map
+from .overrides import to_netcdf_attrs, write_overrides_file
+from .store import fetch, store_key
+
+SECTIONS = ["kv_pairs", "overrides_kv_pairs"]
+MANIFEST_FILE = "ensemble_manifest.json"
+COMMANDS_FILE = "commands.txt"
+
+# Options naming files, which are made unique per member:
+OUTPUT_OPTIONS = ["o", "ts_file", "extra_file"]
+
+
+def split_parameter(name):
+    """
+    Splits ``kv_pairs.sia_e`` into the section and key.
+
+    Raises
+    ------
+    ValueError
+        If the section is not one of :data:`SECTIONS`
+    """
+    section, _, key = str(name).partition(".")
+    if section not in SECTIONS or not key:
+        raise ValueError(f"Ensemble parameter {name} must start with one of {', '.join(SECTIONS)}")
+    return section, key
+
+
+def latin_hypercube(ranges, samples, seed=0):
+    """
+    Draws ``samples`` points from ``ranges`` by Latin hypercube sampling.
+
+    Parameters
+    ----------
+    ranges : dict
+        Maps parameter names to ``[minimum, maximum]``
+    samples : int
+        The number of points
+    seed : int
+        Seed of the random numbers, so the ensemble can be reproduced
+
+    Returns
+    -------
+    points : list of dict
+    """
+    rng = random.Random(seed)
+    columns = {}
+    for name, (low, high) in sorted(ranges.items()):
+        strata = list(range(samples))
+        rng.shuffle(strata)
+        columns[name] = [low + (high - low) * (stratum + rng.random()) / samples for stratum in strata]
+    return [{name: values[i] for name, values in columns.items()} for i in range(samples)]
+
+
+def expand_members(spec):
+    """
+    Lists the parameter values of all members of an ensemble.
+
+    Parameters
+    ----------
+    spec : dict
+        Either ``grid`` (parameter names to lists of values), or ``ranges``
+        (parameter names to ``[minimum, maximum]``) with ``samples`` and
+        optionally ``seed``
+
+    Returns
+    -------
+    members : list of dict
+        Maps parameter names to values, for each member
+    """
+    if spec.get("grid"):
+        names = sorted(spec["grid"])
+        for name in names:
+            split_parameter(name)
+        return [dict(zip(names, values)) for values in itertools.product(*(spec["grid"][name] for name in names))]
+    if spec.get("ranges"):
+        for name in spec["ranges"]:
+            split_parameter(name)
+        return latin_hypercube(spec["ranges"], int(spec["samples"]), spec.get("seed", 0))
+    raise ValueError("An ensemble needs either a grid or ranges and samples")
+
+
+def member_sections(parameters):
+    """Groups the parameter values of a member by section"""
+    sections = {section: {} for section in SECTIONS}
+    for name, value in parameters.items():
+        section, key = split_parameter(name)
+        sections[section][key] = value
+    return sections
+
+
+def write_member_overrides(job):
+    """
+    Writes the overrides file of one member, through the store if one is
+    given. Runs in a worker process.
+
+    Parameters
+    ----------
+    job : tuple
+        ``(target, attrs, store_dir, template_hash, max_bytes)``
+
+    Returns
+    -------
+    reused : bool
+        Whether an existing file was reused
+    """
+    target, attrs, store_dir, template_hash, max_bytes = job
+    if not store_dir:
+        write_overrides_file(target, attrs)
+        return False
+    return fetch(
+        store_dir,
+        store_key(overrides=to_netcdf_attrs(attrs), template_hash=template_hash),
+        target,
+        lambda path: write_overrides_file(path, attrs),
+        max_bytes=max_bytes,
+    )
+
+
+def write_all_overrides(jobs, max_workers=8):
+    """
+    Writes the overrides files of many members in a process pool.
+
+    Returns
+    -------
+    reused : list of bool
+        See :func:`write_member_overrides`
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if len(jobs) > 1 and max_workers > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+            return pool_map(pool, write_member_overrides, jobs, chunksize=max(1, len(jobs) // (4 * max_workers)))
+    return [write_member_overrides(job) for job in jobs]
+
+
+def member_id(index):
+    """Returns the name of member ``index``"""
+    return f"member_{index:04d}"
+
+
+def output_name(path, member):
+    """Prefixes the base name of an output file with the member name"""
+    directory, name = os.path.split(str(path))
+    return os.path.join(directory, f"{member}_{name}")
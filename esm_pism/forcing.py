@@ -0,0 +1,124 @@
+"""
+Preparation of the coupler files of one chunk.
+
+Coupler files are rechunked, subset to the years of the chunk and regridded to
+the model grid (each only if switched on in the PISM section), and the results
+are kept in stores in the cache directory. The same steps run for the current
+chunk in ``pism_set_couplers`` and, ahead of time, for the next chunk in the
+staging process (see :mod:`esm_pism.staging`), so they only depend on the
+``general`` and PISM sections passed in.
+"""
+import os
+
+from loguru import logger
+
+from .cache import file_stat_key, get_cache_dir
+from .rechunk import rechunk_to
+from .regrid import read_grid, regrid_to
+from .store import publish, store_key
+from .subset import needed_years, plan_subset, write_subset
+
+
+def kv_list_to_dict_of_dicts(kv_list):
+    new_dict = {}
+    for item in kv_list:
+        if not isinstance(item, dict):
+            raise TypeError("Something in one of your kv_pairs is not correct. These should be lists or dictionaries!")
+        else:
+            new_dict.update(item)
+    return new_dict
+
+
+def coupler_period(coupler_key_value):
+    """Returns the period and reference year of periodic forcing, if any"""
+    period = reference_year = None
+    if isinstance(coupler_key_value, list):
+        coupler_key_value = kv_list_to_dict_of_dicts(coupler_key_value)
+    for key, value in (coupler_key_value or {}).items():
+        if key.endswith("_period"):
+            period = float(value)
+        elif key.endswith("_reference_year"):
+            reference_year = float(value)
+    return period, reference_year
+
+
+def model_input_file(config, pism_key):
+    """
+    Returns the file one PISM instance starts from, also once it has been
+    linked into the work directory instead of being copied there.
+    """
+    return config[pism_key].get("input_sources", {}).get("input") or config[pism_key].get(
+        "linked_sources", {}
+    ).get("input")
+
+
+def forcing_window(coupler_key_value, config, pism_key):
+    """Returns the years of forcing the chunk needs, see :func:`esm_pism.subset.needed_years`"""
+    period, reference_year = coupler_period(coupler_key_value)
+    return needed_years(
+        float(config[pism_key]["current_year"]),
+        float(config["general"]["nyear"]),
+        period,
+        reference_year or 0,
+    )
+
+
+def subset_forcing_file(file_path, coupler_key_value, config, pism_key):
+    """Replaces a forcing file by one holding only the records this chunk needs"""
+    start_year, end_year = forcing_window(coupler_key_value, config, pism_key)
+    records = plan_subset(file_path, start_year, end_year)
+    store_dir = get_cache_dir(config[pism_key], "forcing_subsets")
+    if records is None or not store_dir:
+        return file_path
+    subset_file, reused = publish(
+        store_dir,
+        store_key(source=file_stat_key(file_path), records=records),
+        lambda path: write_subset(file_path, path, *records),
+        name=os.path.basename(file_path),
+        max_bytes=config[pism_key].get("subset_forcing_max_gb", 100) * 1024 ** 3,
+    )
+    logger.info(
+        f"Using records {records[0]} to {records[1]} of {file_path} "
+        f"({'reused' if reused else 'new'} subset {subset_file})"
+    )
+    return subset_file
+
+
+def regrid_forcing_file(file_path, config, pism_key):
+    """Replaces a forcing file by one on the grid of the input file"""
+    model_input = model_input_file(config, pism_key)
+    target_grid = read_grid(model_input) if model_input and os.path.exists(model_input) else None
+    store_dir = get_cache_dir(config[pism_key], "forcing_regridded")
+    if not target_grid or not store_dir:
+        logger.warning(f"Not regridding {file_path}, the grid of the input file is unknown")
+        return file_path
+    return regrid_to(
+        file_path,
+        target_grid,
+        store_dir,
+        max_bytes=config[pism_key].get("regrid_forcing_max_gb", 100) * 1024 ** 3,
+    )
+
+
+def rechunk_forcing_file(file_path, config, pism_key):
+    """Replaces a forcing file by one with a chunk per time record, if needed"""
+    store_dir = get_cache_dir(config[pism_key], "forcing_rechunked")
+    if not store_dir:
+        return file_path
+    return rechunk_to(
+        file_path,
+        store_dir,
+        complevel=config[pism_key].get("rechunk_forcing_complevel", 1),
+        max_bytes=config[pism_key].get("rechunk_forcing_max_gb", 100) * 1024 ** 3,
+    )
+
+
+def prepare_forcing_file(file_path, coupler_key_value, config, pism_key):
+    """Rechunks, subsets and regrids a coupler file, as switched on for ``pism_key``"""
+    if config[pism_key].get("rechunk_forcing"):
+        file_path = rechunk_forcing_file(file_path, config, pism_key)
+    if config[pism_key].get("subset_forcing"):
+        file_path = subset_forcing_file(file_path, coupler_key_value, config, pism_key)
+    if config[pism_key].get("regrid_forcing"):
+        file_path = regrid_forcing_file(file_path, config, pism_key)
+    return file_path
@@ -0,0 +1,242 @@
+"""
+Metadata index of forcing files.
+
+For each forcing file, the index records the time axis (bounds, units and
+calendar), the variables with their dimensions, and a fingerprint of the
+horizontal grid. It is built once per file and kept in the cache directory
+(see :mod:`esm_pism.cache`) rather than next to the file, since forcing files
+often live in read-only project directories. The index is only rebuilt when
+the size or modification time of the file changes, so checking that forcing
+covers a chunk and matches the model grid does not open any NetCDF file.
+"""
+import hashlib
+import os
+import re
+
+from loguru import logger
+
+from .cache import file_stat_key, path_digest, read_json, write_json
+from .netcdf import open_dataset
+from .subset import find_time_dimension, year_to_time
+
+INDEX_VERSION = 1
+
+X_NAMES = ["x", "lon", "longitude"]
+Y_NAMES = ["y", "lat", "latitude"]
+
+_memo = {}
+
+
+def _axis_summary(values):
+    """Summarizes a coordinate axis"""
+    values = [float(v) for v in values]
+    step = (values[-1] - values[0]) / (len(values) - 1) if len(values) > 1 else None
+    return {"size": len(values), "min": min(values), "max": max(values), "step": step}
+
+
+def grid_fingerprint(x, y):
+    """
+    Returns a digest of the horizontal grid defined by ``x`` and ``y``.
+
+    Coordinates are rounded to millimetres, so files written with different
+    precision still compare equal.
+    """
+    digest = hashlib.sha256()
+    for axis in [x, y]:
+        digest.update(",".join(f"{float(v):.3f}" for v in axis).encode())
+        digest.update(b";")
+    return digest.hexdigest()
+
+
+def build_forcing_index(path):
+    """
+    Reads the metadata of a forcing file.
+
+    Parameters
+    ----------
+    path : str
+        The forcing file
+
+    Returns
+    -------
+    index : dict
+        With ``variables`` (name to dimensions), ``time`` (``units``,
+        ``calendar``, ``min``, ``max``, ``size``; or ``None``) and ``grid``
+        (``x``, ``y`` summaries and ``fingerprint``; or ``None``)
+    """
+    with open_dataset(path, "r") as nc:
+        variables = {name: list(var.dimensions) for name, var in nc.variables.items()}
+        time = None
+        time_dim = find_time_dimension(nc)
+        if time_dim in nc.variables and len(nc.dimensions[time_dim]) > 0:
+            time_var = nc.variables[time_dim]
+            bounds_name = getattr(time_var, "bounds", None)
+            if bounds_name in nc.variables:
+                times = nc.variables[bounds_name][:]
+            else:
+                times = time_var[:]
+            time = {
+                "units": getattr(time_var, "units", "years since 0-1-1"),
+                "calendar": getattr(time_var, "calendar", "standard"),
+                "min": float(times.min()),
+                "max": float(times.max()),
+                "size": len(nc.dimensions[time_dim]),
+            }
+        grid = None
+        x_name = next((name for name in X_NAMES if name in nc.variables), None)
+        y_name = next((name for name in Y_NAMES if name in nc.variables), None)
+        if x_name and y_name:
+            x = nc.variables[x_name][:]
+            y = nc.variables[y_name][:]
+            grid = {
+                "x": _axis_summary(x),
+                "y": _axis_summary(y),
+                "units": getattr(nc.variables[x_name], "units", None),
+                "fingerprint": grid_fingerprint(x, y),
+            }
+    return {"variables": variables, "time": time, "grid": grid}
+
+
+def load_forcing_index(path, cache_dir=None):
+    """
+    Returns the index of ``path``, rebuilding it only if the file changed.
+
+    Parameters
+    ----------
+    path : str
+        The forcing file
+    cache_dir : str, optional
+        Where to keep the index. Without one, the index is only memoized for
+        this process.
+
+    Returns
+    -------
+    index : dict
+        See :func:`build_forcing_index`
+    """
+    stat_key = file_stat_key(path)
+    memo_key = tuple(stat_key.values())
+    if memo_key in _memo:
+        return _memo[memo_key]
+    cache_file = os.path.join(cache_dir, f"{path_digest(path)}.json") if cache_dir else None
+    cached = read_json(cache_file) if cache_file else None
+    if cached and cached.get("version") == INDEX_VERSION and all(
+        cached.get(key) == value for key, value in stat_key.items()
+    ):
+        index = cached
+    else:
+        logger.debug(f"Indexing forcing file {path}")
+        index = dict(stat_key, version=INDEX_VERSION, **build_forcing_index(path))
+        if cache_file:
+            write_json(cache_file, index)
+    _memo[memo_key] = index
+    return index
+
+
+def check_time_coverage(index, start_year, end_year):
+    """
+    Checks that a forcing file covers the model years given.
+
+    Returns
+    -------
+    error : str or None
+        A description of the problem, or ``None`` if the years are covered
+        (or the file has no time axis)
+    """
+    time = index.get("time")
+    if not time:
+        return None
+    start = year_to_time(start_year, time["units"], time["calendar"])
+    end = year_to_time(end_year, time["units"], time["calendar"])
+    if start < time["min"] or end > time["max"]:
+        return (
+            f"{index['path']} does not cover the years {start_year} to {end_year}: "
+            f"its time axis only spans {time['min']} to {time['max']} {time['units']}"
+        )
+    return None
+
+
+def parse_resolution(resolution):
+    """Converts a resolution like ``"16km"`` into metres, or ``None``"""
+    match = re.fullmatch(r"\s*([\d.]+)\s*(km|m)\s*", str(resolution))
+    if not match:
+        return None
+    return float(match.group(1)) * (1000.0 if match.group(2) == "km" else 1.0)
+
+
+def check_grid(index, resolution=None, reference_fingerprint=None, shape=None):
+    """
+    Checks that a forcing file is on the model grid.
+
+    Parameters
+    ----------
+    index : dict
+        See :func:`load_forcing_index`
+    resolution : str, optional
+        The model resolution, e.g. ``"16km"``
+    reference_fingerprint : str, optional
+        The grid fingerprint of the model's input file
+    shape : tuple of int, optional
+        ``(Mx, My)`` of the model grid, for when there is no file on the
+        model grid to compare with (e.g. when bootstrapping)
+
+    Returns
+    -------
+    error : str or None
+        A description of the problem, or ``None`` if the grid matches (or the
+        file has no recognizable grid)
+    """
+    grid = index.get("grid")
+    if not grid:
+        return None
+    spacing = parse_resolution(resolution) if resolution else None
+    if spacing and grid.get("units") in [None, "m", "meters", "metre", "metres"]:
+        for axis in ["x", "y"]:
+            step = grid[axis]["step"]
+            if step is not None and abs(abs(step) - spacing) > 1e-3 * spacing:
+                return (
+                    f"{index['path']} has a grid spacing of {abs(step)} m along {axis}, "
+                    f"but the model resolution is {resolution}"
+                )
+    if reference_fingerprint and grid["fingerprint"] != reference_fingerprint:
+        return (
+            f"{index['path']} is on a {grid['x']['size']}x{grid['y']['size']} grid "
+            "which does not match the grid of the input file"
+        )
+    if shape and (grid["x"]["size"], grid["y"]["size"]) != tuple(shape):
+        return (
+            f"{index['path']} is on a {grid['x']['size']}x{grid['y']['size']} grid, "
+            f"but the model grid has {shape[0]}x{shape[1]} points"
+        )
+    return None
+
+
+def check_domain(index, x_extent, y_extent):
+    """
+    Checks that a forcing file covers the model domain.
+
+    Parameters
+    ----------
+    index : dict
+        See :func:`load_forcing_index`
+    x_extent, y_extent : tuple of float
+        The smallest and largest model coordinates along each axis
+
+    Returns
+    -------
+    error : str or None
+        A description of the problem, or ``None`` if the domain is covered
+        (or the file has no recognizable grid)
+    """
+    grid = index.get("grid")
+    if not grid:
+        return None
+    for axis, (low, high) in zip(["x", "y"], [x_extent, y_extent]):
+        # The cells of the file reach half a step beyond its coordinates:
+        margin = abs(grid[axis]["step"] or 0) / 2 + 1e-3
+        if grid[axis]["min"] - margin > low or grid[axis]["max"] + margin < high:
+            return (
+                f"{index['path']} covers {axis} from {grid[axis]['min']} to {grid[axis]['max']}, "
+                f"but the model domain spans {low} to {high}"
+            )
+    return None
@@ -0,0 +1,91 @@
+"""
+Handing read-only input files to PISM without copying them.
+
+esm_runscripts copies every registered file into the run directory and again
+into the work directory. For multi-GB forcing and restart files, which PISM
+only reads, this is avoidable traffic. Such files can instead be placed in the
+work directory directly, as a hard link (the file stays intact even if the
+source is later removed, but needs the same filesystem) or as a symbolic link
+(works across filesystems, but the source must stay in place until the run is
+finished).
+
+A hard link is only attempted if source and target are on the same
+filesystem; otherwise, and if linking fails for any other reason, the file is
+copied. Targets are always replaced atomically.
+"""
+import os
+import shutil
+
+from .cache import tmp_path
+from .instrument import record_file
+
+LINK_MODES = ["copy", "hardlink", "symlink"]
+
+
+def _existing_parent(path):
+    """Returns ``path`` or its closest existing ancestor"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def same_filesystem(source, target):
+    """Checks whether ``source`` and the (future) file ``target`` share a filesystem"""
+    try:
+        return os.stat(source).st_dev == os.stat(_existing_parent(os.path.dirname(target))).st_dev
+    except OSError:
+        return False
+
+
+def place_file(source, target, mode):
+    """
+    Places ``source`` at ``target``.
+
+    Parameters
+    ----------
+    source : str
+        The input file
+    target : str
+        Where PISM expects the file
+    mode : str
+        One of :data:`LINK_MODES`
+
+    Returns
+    -------
+    mode : str
+        The mode which was actually used, ``"copy"`` if linking was not possible
+
+    Raises
+    ------
+    ValueError
+        If ``mode`` is unknown
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode {mode}, use one of {', '.join(LINK_MODES)}")
+    record_file(target)
+    source = os.path.abspath(source)
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return mode
+    tmp_target = tmp_path(target)
+    try:
+        if mode == "hardlink" and not same_filesystem(source, target):
+            mode = "copy"
+        try:
+            if mode == "hardlink":
+                os.link(source, tmp_target)
+            elif mode == "symlink":
+                os.symlink(source, tmp_target)
+        except OSError:
+            mode = "copy"
+        if mode == "copy":
+            shutil.copy2(source, tmp_target)
+        os.replace(tmp_target, target)
+    finally:
+        if os.path.lexists(tmp_target):
+            os.remove(tmp_target)
+    return mode
@@ -0,0 +1,277 @@
+"""
+Timing and resource instrumentation of the plugin entry points.
+
+Every entry point in :mod:`esm_pism.plugin` is wrapped with
+:func:`instrumented`. When instrumentation is switched on, either with
+``instrument: True`` in a PISM section of the experiment config or by setting
+the ``ESM_PISM_INSTRUMENT`` environment variable, one JSON record per call is
+appended to ``esm_pism_metrics.jsonl`` in the log directory of the run. A
+record holds:
+
+* ``wall``: wall clock time in seconds
+* ``cpu`` and ``cpu_children``: CPU time of this process and of worker
+  processes which finished during the call, in seconds
+* ``max_rss_kib`` and ``rss_growth_kib``: the peak resident set size of the
+  process, and how much of it was reached during the call
+* ``netcdf_bytes_read`` and ``netcdf_bytes_written``: bytes moved by the
+  NetCDF library in this process and its worker processes (Linux only, else
+  ``None``)
+* ``netcdf_files`` and ``files_touched``: the number of distinct NetCDF files
+  opened, and of all files opened or written by the plugin
+
+Work handed to a process pool is counted if it is run with :func:`pool_map`,
+which collects the file activity of each call in the worker and adds it to the
+record of the entry point.
+
+The records are single lines, so the files of many chunks can simply be
+concatenated for analysis. When instrumentation is off, the only overhead is
+checking the config and environment.
+"""
+import functools
+import json
+import os
+import platform
+import socket
+import threading
+import time
+
+from loguru import logger
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+INSTRUMENT_ENV = "ESM_PISM_INSTRUMENT"
+METRICS_FILE = "esm_pism_metrics.jsonl"
+PROC_IO = "/proc/self/io"
+
+_lock = threading.Lock()
+_current = None
+
+
+class Recorder:
+    """Collects the file activity during one entry point call"""
+
+    def __init__(self):
+        self.files = set()
+        self.netcdf_files = set()
+        self.netcdf_bytes_read = 0
+        self.netcdf_bytes_written = 0
+        self.io_available = True
+
+    def add_file(self, path):
+        with _lock:
+            self.files.add(os.path.abspath(path))
+
+    def add_netcdf(self, path, bytes_read, bytes_written):
+        with _lock:
+            self.files.add(os.path.abspath(path))
+            self.netcdf_files.add(os.path.abspath(path))
+            if bytes_read is None or bytes_written is None:
+                self.io_available = False
+                return
+            self.netcdf_bytes_read += bytes_read
+            self.netcdf_bytes_written += bytes_written
+
+    def activity(self):
+        """Returns the collected file activity, e.g. to send it from a worker process"""
+        with _lock:
+            return {
+                "files": set(self.files),
+                "netcdf_files": set(self.netcdf_files),
+                "netcdf_bytes_read": self.netcdf_bytes_read,
+                "netcdf_bytes_written": self.netcdf_bytes_written,
+                "io_available": self.io_available,
+            }
+
+    def merge(self, activity):
+        """Adds the file activity of a worker process, see :meth:`activity`"""
+        with _lock:
+            self.files |= activity["files"]
+            self.netcdf_files |= activity["netcdf_files"]
+            self.netcdf_bytes_read += activity["netcdf_bytes_read"]
+            self.netcdf_bytes_written += activity["netcdf_bytes_written"]
+            self.io_available = self.io_available and activity["io_available"]
+
+
+class _WorkerCall:
+    """Calls ``func`` in a worker process and returns its result with the file activity of the call"""
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args):
+        global _current
+        recorder = Recorder()
+        _current = recorder
+        try:
+            result = self.func(*args)
+        finally:
+            _current = None
+        return result, recorder.activity()
+
+
+def read_proc_io():
+    """Returns the I/O counters of this process, or ``None`` if unavailable"""
+    try:
+        with open(PROC_IO, "r") as f:
+            return {key: int(value) for key, value in (line.split(":") for line in f)}
+    except (OSError, ValueError):
+        return None
+
+
+def record_file(path):
+    """Counts ``path`` as touched by the running entry point, if instrumented"""
+    recorder = _current
+    if recorder is not None:
+        recorder.add_file(path)
+
+
+def record_netcdf(path, bytes_read=None, bytes_written=None):
+    """
+    Counts a NetCDF access and the bytes it moved, if instrumented. Without
+    byte counts, the I/O of this call is reported as unknown.
+    """
+    recorder = _current
+    if recorder is not None:
+        recorder.add_netcdf(path, bytes_read, bytes_written)
+
+
+def pool_map(pool, func, *iterables, **kwargs):
+    """
+    Like ``pool.map`` for a process pool, but counts the files the workers
+    touch towards the running entry point, if instrumented.
+
+    Returns
+    -------
+    results : list
+        The results of ``func``, in the order of ``iterables``
+    """
+    recorder = _current
+    if recorder is None:
+        return list(pool.map(func, *iterables, **kwargs))
+    results = []
+    for result, activity in pool.map(_WorkerCall(func), *iterables, **kwargs):
+        recorder.merge(activity)
+        results.append(result)
+    return results
+
+
+def is_active():
+    """Whether an instrumented call is currently running"""
+    return _current is not None
+
+
+def is_enabled(config):
+    """
+    Whether instrumentation is switched on for this experiment.
+
+    Parameters
+    ----------
+    config : dict
+        The entire exp config
+    """
+    if os.environ.get(INSTRUMENT_ENV, "").lower() not in ["", "0", "no", "false", "off"]:
+        return True
+    return any(
+        section.get("instrument")
+        for key, section in config.items()
+        if (key == "pism" or key.startswith("pism_")) and isinstance(section, dict)
+    )
+
+
+def get_log_dir(config):
+    """Returns the log directory of the run, or ``None`` if it is unknown"""
+    general = config.get("general", {})
+    return general.get("thisrun_log_dir") or general.get("experiment_log_dir")
+
+
+def _max_rss_kib():
+    if resource is None:
+        return None
+    # Linux reports KiB, macOS bytes:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss // 1024 if platform.system() == "Darwin" else max_rss
+
+
+def _children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def write_record(config, record):
+    """
+    Appends one metrics record to the log directory of the run.
+
+    Failures are only logged, instrumentation must never stop a run.
+    """
+    log_dir = get_log_dir(config)
+    if not log_dir:
+        logger.warning("No log directory in general.thisrun_log_dir, not writing metrics")
+        return
+    try:
+        os.makedirs(log_dir, exist_ok=True)
+        # A single write of one line, so records of concurrent processes do
+        # not interleave:
+        with open(os.path.join(log_dir, METRICS_FILE), "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+    except OSError as e:
+        logger.warning(f"Unable to write metrics to {log_dir}: {e}")
+
+
+def instrumented(func):
+    """
+    Records the resources used by an entry point ``func(config)``.
+
+    The wrapped function is called unchanged when instrumentation is off.
+    A record is also written if the call fails, with ``status: "error"``.
+    """
+
+    @functools.wraps(func)
+    def wrapper(config):
+        global _current
+        if _current is not None or not is_enabled(config):
+            return func(config)
+        recorder = Recorder()
+        max_rss_before = _max_rss_kib()
+        cpu_children_before = _children_cpu()
+        cpu_before = time.process_time()
+        start = time.time()
+        wall_before = time.perf_counter()
+        status = "error"
+        _current = recorder
+        try:
+            result = func(config)
+            status = "ok"
+            return result
+        finally:
+            _current = None
+            max_rss = _max_rss_kib()
+            general = config.get("general", {})
+            write_record(
+                config,
+                {
+                    "step": func.__name__,
+                    "status": status,
+                    "expid": general.get("expid"),
+                    "run_number": general.get("run_number"),
+                    "current_date": str(general.get("current_date")) if "current_date" in general else None,
+                    "host": socket.gethostname(),
+                    "pid": os.getpid(),
+                    "start": start,
+                    "wall": time.perf_counter() - wall_before,
+                    "cpu": time.process_time() - cpu_before,
+                    "cpu_children": _children_cpu() - cpu_children_before,
+                    "max_rss_kib": max_rss,
+                    "rss_growth_kib": None if max_rss is None else max_rss - max_rss_before,
+                    "netcdf_bytes_read": recorder.netcdf_bytes_read if recorder.io_available else None,
+                    "netcdf_bytes_written": recorder.netcdf_bytes_written if recorder.io_available else None,
+                    "netcdf_files": len(recorder.netcdf_files),
+                    "files_touched": len(recorder.files),
+                },
+            )
+
+    return wrapper
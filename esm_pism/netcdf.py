@@ -0,0 +1,186 @@
+"""
+Thread-safe access to NetCDF files.
+
+The NetCDF-C library (and HDF5 below it) is not thread-safe, and netCDF4
+releases the GIL while calling into it. Every NetCDF file used by the plugin is
+therefore opened through :func:`open_dataset`, which holds a process-wide lock
+until the file is closed. Work which only touches the file system (``stat``,
+hashing, copying) still runs concurrently; for parallel NetCDF reads, use a
+process pool instead of threads.
+
+``netCDF4`` is only imported when a file is actually opened, so that the
+plugin entry points which never touch NetCDF stay cheap to load.
+
+While an entry point is instrumented (see :mod:`esm_pism.instrument`), the
+bytes read and written while a file is open are attributed to that file. This
+is exact since the lock is held, apart from plain file I/O in other threads.
+
+:func:`copy_dataset` writes a copy of an open file, one block of records at a
+time, for the modules which subset, rechunk, compress, regrid or otherwise
+rewrite files.
+"""
+import contextlib
+import threading
+
+from .instrument import is_active, read_proc_io, record_netcdf
+
+NETCDF_LOCK = threading.RLock()
+
+# How many files the current thread has open, so that the bytes moved while
+# several files are open together (e.g. copying) are only counted once:
+_open_files = threading.local()
+
+
+@contextlib.contextmanager
+def open_dataset(path, mode="r", **kwargs):
+    """
+    Opens a NetCDF file while holding :data:`NETCDF_LOCK`.
+
+    Parameters
+    ----------
+    path : str
+        The file to open
+    mode : str
+        ``"r"``, ``"w"``, ``"a"``, as for :class:`netCDF4.Dataset`
+    **kwargs :
+        Passed on to :class:`netCDF4.Dataset`, e.g. ``format``
+
+    Yields
+    ------
+    nc : netCDF4.Dataset
+    """
+    import netCDF4
+
+    with NETCDF_LOCK:
+        depth = getattr(_open_files, "depth", 0)
+        instrumented = is_active()
+        io_before = read_proc_io() if instrumented and depth == 0 else None
+        _open_files.depth = depth + 1
+        try:
+            with netCDF4.Dataset(path, mode, **kwargs) as nc:
+                yield nc
+        finally:
+            _open_files.depth = depth
+            if instrumented and depth > 0:
+                # Counted with the file which was opened first:
+                record_netcdf(path, 0, 0)
+            elif instrumented:
+                # After closing, since buffered data is only written then:
+                io_after = read_proc_io()
+                if io_before is not None and io_after is not None:
+                    record_netcdf(
+                        path,
+                        io_after["rchar"] - io_before["rchar"],
+                        io_after["wchar"] - io_before["wchar"],
+                    )
+                else:
+                    record_netcdf(path)
+
+
+def record_blocks(records, step):
+    """
+    Groups record numbers into runs of at most ``step`` consecutive records.
+
+    Yields
+    ------
+    block : tuple of int
+        ``(start, stop)`` of one run, as for a slice
+    """
+    first = last = None
+    for record in records:
+        if first is not None and (record != last + 1 or last + 1 - first == step):
+            yield first, last + 1
+            first = None
+        if first is None:
+            first = record
+        last = record
+    if first is not None:
+        yield first, last + 1
+
+
+def copy_values(var, out, time_dim=None, records=None, start=0, transform=None):
+    """
+    Copies the values of ``var`` to ``out``, in blocks of whole chunks of
+    ``out`` along ``time_dim``, so only a few records are in memory at once.
+
+    Parameters
+    ----------
+    var, out : netCDF4.Variable
+        The source and target variable
+    time_dim : str, optional
+        The record dimension; variables without it are copied at once
+    records : sequence of int, optional
+        The records of ``var`` to copy, by default all
+    start : int
+        The record of ``out`` the first copied record is written to
+    transform : callable, optional
+        Called with the (masked) values of each block; returns the values to
+        write. Without it, the raw values are copied, without masking and
+        scaling.
+    """
+    if transform is None:
+        var.set_auto_maskandscale(False)
+        out.set_auto_maskandscale(False)
+    if var.ndim == 0 or time_dim not in var.dimensions:
+        values = var[...]
+        out[...] = transform(values) if transform else values
+        return
+    axis = var.dimensions.index(time_dim)
+    chunking = out.chunking()
+    step = chunking[axis] if isinstance(chunking, list) else 1
+    for first, stop in record_blocks(range(var.shape[axis]) if records is None else records, step):
+        src_index = [slice(None)] * var.ndim
+        dst_index = [slice(None)] * var.ndim
+        src_index[axis] = slice(first, stop)
+        dst_index[axis] = slice(start, start + stop - first)
+        values = var[tuple(src_index)]
+        out[tuple(dst_index)] = transform(values) if transform else values
+        start += stop - first
+
+
+def copy_dataset(src, dst, time_dim=None, dimensions=None, variable_kwargs=None, records=None, transforms=None):
+    """
+    Copies the attributes, dimensions and variables of ``src`` to ``dst``.
+
+    Parameters
+    ----------
+    src, dst : netCDF4.Dataset
+        The open source and (new) target file
+    time_dim : str, optional
+        The record dimension, see :func:`copy_values`
+    dimensions : dict, optional
+        Sizes of dimensions which change (``None`` for unlimited); all other
+        dimensions keep their size, and stay unlimited if they are
+    variable_kwargs : callable, optional
+        Called with the name and the variable of each variable of ``src``;
+        returns further arguments of ``createVariable`` (e.g. ``zlib``,
+        ``chunksizes`` or ``fill_value``), or ``None`` to leave the variable
+        out
+    records : sequence of int, optional
+        The records along ``time_dim`` to copy, by default all
+    transforms : dict, optional
+        Maps variable names to a function of the values of one block, see
+        :func:`copy_values`
+
+    Returns
+    -------
+    variables : dict
+        Maps the names of the copied variables to those in ``dst``
+    """
+    dimensions = dimensions or {}
+    transforms = transforms or {}
+    dst.setncatts(src.__dict__)
+    for name, dim in src.dimensions.items():
+        size = dimensions[name] if name in dimensions else None if dim.isunlimited() else len(dim)
+        dst.createDimension(name, size)
+    copied = {}
+    for name, var in src.variables.items():
+        kwargs = variable_kwargs(name, var) if variable_kwargs else {}
+        if kwargs is None:
+            continue
+        kwargs = dict({"fill_value": var.__dict__.get("_FillValue")}, **kwargs)
+        out = dst.createVariable(name, var.datatype, var.dimensions, **kwargs)
+        out.setncatts({k: v for k, v in var.__dict__.items() if k != "_FillValue"})
+        copy_values(var, out, time_dim, records, transform=transforms.get(name))
+        copied[name] = out
+    return copied
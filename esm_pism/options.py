@@ -0,0 +1,97 @@
+"""
+Validation of PISM command line options before a job is submitted.
+
+PISM only reports options it did not use at the very end of a run (with
+``-options_left``), after the job has waited in the queue and run on many
+cores. The options collected by the plugin are therefore checked against the
+option index of the ``pism_config.nc`` file (see
+:func:`esm_pism.config_index.build_option_index`), which is kept in the cache
+directory for each PISM installation. Every check is a dictionary lookup;
+close matches are only searched for options which are unknown.
+"""
+import difflib
+
+# Options PISM reads directly rather than through its configuration database,
+# and options the plugin itself adds to the command:
+COMMAND_OPTIONS = [
+    "i",
+    "bootstrap",
+    "o",
+    "o_size",
+    "Nx",
+    "Ny",
+    "ys",
+    "ye",
+    "y",
+    "ts_file",
+    "ts_vars",
+    "ts_times",
+    "extra_file",
+    "extra_vars",
+    "extra_times",
+    "options_left",
+    "config",
+    "config_override",
+    "pism_override",
+    "atmosphere",
+    "surface",
+    "ocean",
+    "verbose",
+    "help",
+    "version",
+    "list_diagnostics",
+    # Shortcuts for several parameters at once:
+    "pik",
+    "test_climate_models",
+]
+
+# Options with these prefixes are handled by PETSc:
+PETSC_PREFIXES = [
+    "log_",
+    "info",
+    "malloc",
+    "memory_",
+    "on_error_",
+    "options_",
+    "ksp_",
+    "pc_",
+    "snes_",
+    "mat_",
+    "vec_",
+    "da_",
+    "fp_trap",
+]
+
+
+def check_options(options, option_index, known_options=()):
+    """
+    Checks that PISM knows every option in ``options``.
+
+    Parameters
+    ----------
+    options : list of str
+        Option names, with or without leading dashes
+    option_index : dict
+        The ``options`` of the config index, see
+        :func:`esm_pism.config_index.load_config_index`
+    known_options : list of str
+        Further options to accept, e.g. from a PISM version newer than the
+        config file
+
+    Returns
+    -------
+    errors : list of str
+        One description (with suggestions, if any) per unknown option
+    """
+    accepted = set(COMMAND_OPTIONS) | {option.lstrip("-") for option in known_options}
+    errors = []
+    for option in options:
+        name = option.lstrip("-")
+        if name in option_index or name in accepted or name.startswith(tuple(PETSC_PREFIXES)):
+            continue
+        suggestions = difflib.get_close_matches(name, list(option_index) + list(accepted), n=3)
+        message = f"Unknown PISM option: -{name}"
+        if suggestions:
+            message += f" (did you mean {' or '.join(f'-{suggestion}' for suggestion in suggestions)}?)"
+        errors.append(message)
+    return errors
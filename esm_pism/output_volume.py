@@ -0,0 +1,153 @@
+"""
+Estimates of the output PISM writes during a chunk.
+
+The time series (``-ts_file``), extra (``-extra_file``) and final (``-o``)
+files are estimated from the grid size in the header of the input file, the
+dimensionality of each requested variable, and the output times. This allows
+checking a configuration against budgets for the bytes written and the number
+of write events before the job is submitted, and proposing a coarser output
+cadence which fits.
+
+The estimate assumes uncompressed double precision output, so it is an upper
+bound for most setups.
+"""
+import math
+
+from .netcdf import open_dataset
+
+BYTES_PER_VALUE = 8
+DEFAULT_MZ = 31
+
+# Variables with a vertical (ice) dimension; all other extra variables are
+# assumed to be 2D fields:
+VARIABLES_3D = [
+    "age",
+    "enthalpy",
+    "liqfrac",
+    "temp",
+    "temp_pa",
+    "uvel",
+    "vvel",
+    "wvel",
+    "wvel_rel",
+    "strain_heating",
+    "tauxz",
+    "tauyz",
+    "cts",
+]
+
+# Rough number of 3D and 2D fields in the -o file, per -o_size:
+O_SIZE_FIELDS = {
+    "none": (0, 0),
+    "small": (2, 10),
+    "medium": (2, 25),
+    "big_2d": (2, 60),
+    "big": (12, 60),
+}
+
+# Length of the intervals of PISM's keyword output times, in years:
+KEYWORD_INTERVALS = {
+    "hourly": 1 / 8760,
+    "daily": 1 / 365,
+    "monthly": 1 / 12,
+    "yearly": 1.0,
+}
+
+NICE_STEPS = [1, 2, 5]
+
+
+def read_vertical_levels(path):
+    """Returns the number of ice levels in ``path``, or ``None``"""
+    with open_dataset(path, "r") as nc:
+        return len(nc.dimensions["z"]) if "z" in nc.dimensions else None
+
+
+def count_records(times, start_year, nyear):
+    """
+    Counts the records written for PISM output times during a chunk.
+
+    Parameters
+    ----------
+    times : str
+        As for ``-extra_times``/``-ts_times``: a keyword (``yearly``, ...),
+        ``begin:step:end`` in years, or a comma-separated list of years
+    start_year, nyear : float
+        The chunk
+
+    Returns
+    -------
+    records : int
+    """
+    times = str(times).strip()
+    end_year = start_year + nyear
+    if times in KEYWORD_INTERVALS:
+        return math.ceil(nyear / KEYWORD_INTERVALS[times])
+    if ":" in times:
+        begin, step, end = (float(part) for part in times.split(":"))
+        first = max(begin, begin + math.ceil((start_year - begin) / step) * step)
+        last = min(end, end_year)
+        return max(int(math.floor((last - first) / step + 1e-9)) + 1, 0) if last >= first else 0
+    years = [float(year) for year in times.split(",") if year.strip()]
+    return sum(start_year <= year <= end_year for year in years)
+
+
+def estimate_output(Mx, My, Mz, nyear, start_year, ex_vars, ex_times, ts_vars, ts_times, o_size="medium"):
+    """
+    Estimates the output of one chunk.
+
+    Returns
+    -------
+    estimate : dict
+        ``ex_bytes``, ``ts_bytes``, ``o_bytes`` and ``bytes`` (the total),
+        ``ex_records``, ``ts_records`` and ``writes`` (the number of write
+        events)
+    """
+    field_2d = Mx * My * BYTES_PER_VALUE
+    ex_record = sum(field_2d * (Mz if var in VARIABLES_3D else 1) for var in ex_vars)
+    ex_records = count_records(ex_times, start_year, nyear) if ex_vars else 0
+    ts_records = count_records(ts_times, start_year, nyear) if ts_vars else 0
+    fields_3d, fields_2d = O_SIZE_FIELDS.get(o_size, O_SIZE_FIELDS["medium"])
+    estimate = {
+        "ex_bytes": ex_record * ex_records,
+        "ts_bytes": len(ts_vars) * BYTES_PER_VALUE * ts_records,
+        "o_bytes": field_2d * (fields_3d * Mz + fields_2d),
+        "ex_records": ex_records,
+        "ts_records": ts_records,
+    }
+    estimate["bytes"] = estimate["ex_bytes"] + estimate["ts_bytes"] + estimate["o_bytes"]
+    estimate["writes"] = ex_records + ts_records + 1
+    return estimate
+
+
+def _nice_step(step):
+    """Rounds a step in years up to 1, 2 or 5 times a power of ten"""
+    magnitude = 10 ** math.floor(math.log10(step))
+    return next(nice * magnitude for nice in NICE_STEPS + [10] if nice * magnitude >= step - 1e-9)
+
+
+def propose_cadence(ex_times, start_year, nyear, records):
+    """
+    Proposes ``-extra_times`` which write at most ``records`` records per chunk.
+
+    Returns
+    -------
+    times : str or None
+        In the form ``begin:step:end``, or ``None`` if not even one record fits
+    """
+    if records < 1:
+        return None
+    current = count_records(ex_times, start_year, nyear)
+    if current <= records:
+        return str(ex_times)
+    step = _nice_step(nyear / records)
+    # Keep the begin and end of an existing range:
+    if ":" in str(ex_times):
+        begin, _, end = str(ex_times).split(":")
+    else:
+        begin, end = start_year, start_year + nyear
+    begin, end = float(begin), float(end)
+    proposal = f"{begin:g}:{step:g}:{end:g}"
+    while count_records(proposal, start_year, nyear) > records:
+        step = _nice_step(step * 1.01)
+        proposal = f"{begin:g}:{step:g}:{end:g}"
+    return proposal
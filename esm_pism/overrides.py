@@ -0,0 +1,92 @@
+"""
+Reading and writing of PISM configuration and overrides files.
+
+PISM keeps its entire configuration as attributes of a single scalar variable,
+``pism_config``. To generate a ``pism_overrides.nc`` file, only that attribute
+table is needed: these helpers read the header of the template file and write a
+minimal file holding just the ``pism_config`` variable, without loading or
+rewriting anything else in the template.
+"""
+import numbers
+import os
+
+from .cache import tmp_path
+from .netcdf import open_dataset
+
+PISM_CONFIG_VARIABLE = "pism_config"
+
+
+def read_config_attrs(config_file):
+    """
+    Reads the attribute table of the ``pism_config`` variable.
+
+    Only the file header is touched; no variable data is read.
+
+    Parameters
+    ----------
+    config_file : str
+        Path to a ``pism_config.nc`` file
+
+    Returns
+    -------
+    attrs : dict
+        All attributes of the ``pism_config`` variable
+    """
+    with open_dataset(config_file, "r") as nc:
+        return dict(nc.variables[PISM_CONFIG_VARIABLE].__dict__)
+
+
+def _to_netcdf_attr(value):
+    """Converts a YAML value into something PISM understands as an attribute"""
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, numbers.Real):
+        # PISM stores all numeric parameters as doubles:
+        return float(value)
+    return str(value)
+
+
+def to_netcdf_attrs(attrs):
+    """
+    Converts YAML values into the attributes written to an overrides file.
+
+    Values which PISM reads the same (e.g. ``5`` and ``5.0``, or ``True`` and
+    ``"yes"``) are converted to the same attribute, so this is also what
+    identifies an overrides file in a store.
+    """
+    return {key: _to_netcdf_attr(value) for key, value in attrs.items()}
+
+
+def write_overrides_file(overrides_file, attrs, data_model="NETCDF3_CLASSIC"):
+    """
+    Writes a minimal PISM overrides file.
+
+    The file contains only the scalar ``pism_config`` variable carrying
+    ``attrs``. It is written to a temporary name next to ``overrides_file``
+    and moved into place, so readers never see a half-written file.
+
+    Parameters
+    ----------
+    overrides_file : str
+        Where to write the overrides file
+    attrs : dict
+        Configuration keys and values to store
+    data_model : str
+        NetCDF format to write
+
+    Returns
+    -------
+    overrides_file : str
+        The path which was written
+    """
+    tmp_file = tmp_path(overrides_file)
+    try:
+        with open_dataset(tmp_file, "w", format=data_model) as nc:
+            var = nc.createVariable(PISM_CONFIG_VARIABLE, "b")
+            var.setncatts(to_netcdf_attrs(attrs))
+        os.replace(tmp_file, overrides_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return overrides_file
+
@@ -1,38 +1,332 @@
 import os
+import re
+import shlex
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 from loguru import logger
-import xarray as xr
+
+from .bootstrap import bootstrap, cached_state, is_bootstrap_option, is_run_option, state_key
+from .cache import content_fingerprint, get_cache_dir, write_json
+from .command import CommandConflictError, PismCommand
+from .compress import compress_files
+from .concat import append_chunk
+from .config_index import check_value_type, get_config_index
+from .ensemble import (
+    COMMANDS_FILE,
+    MANIFEST_FILE,
+    OUTPUT_OPTIONS,
+    expand_members,
+    member_id,
+    member_sections,
+    output_name,
+    write_all_overrides,
+)
+from .diagnostics import append_diagnostics, check_spec, read_basins, reduce_file
+from .decomposition import plan_decomposition, read_grid_shape
+from .handoff import LINK_MODES, place_file
+from .forcing import (
+    coupler_period,
+    forcing_window,
+    kv_list_to_dict_of_dicts,
+    model_input_file,
+    prepare_forcing_file,
+    regrid_forcing_file,
+)
+from .forcing_index import check_domain, check_grid, check_time_coverage, load_forcing_index
+from .instrument import instrumented, pool_map
+from .options import check_options
+from .output_volume import DEFAULT_MZ, estimate_output, propose_cadence, read_vertical_levels
+from .overrides import to_netcdf_attrs, write_overrides_file
+from .preflight import check_files
+from .staging import chunk_dir, read_staged, remove_old_chunks, settings_key, start_staging
+from .store import fetch, link_or_copy, store_key
+from .synthesis import synthesize_chunk
+from .throughput import (
+    append_history,
+    choose_nyear,
+    measure_chunk,
+    parse_compute_time,
+    read_history,
+    recent_rates,
+)
 
 VALID_PISM_COUPLERS = ["ocean", "surface", "atmosphere"]
 
-def _kv_list_to_dict_of_dicts(kv_list):
-    new_dict = {}
-    for item in kv_list:
-        if not isinstance(item, dict):
-            raise TypeError("Something in one of your kv_pairs is not correct. These should be lists or dictionaries!")
+
+def _pism_keys(config):
+    """
+    Finds the sections of all PISM instances in the experiment config.
+
+    Setups with several ice sheets (e.g. both hemispheres) use one section per
+    instance, such as ``pism_nh`` and ``pism_sh``. These take precedence over a
+    plain ``pism`` section, which is used otherwise.
+    """
+    instance_keys = [
+        key for key in config if key.startswith("pism_") and isinstance(config[key], dict)
+    ]
+    return instance_keys or ["pism"]
+
+
+def _run_instance(func, config, pism_key):
+    """Calls ``func`` for one PISM instance in a worker process and returns its section"""
+    func(config, pism_key)
+    return config[pism_key]
+
+
+def _for_each_instance(config, func, parallel=False):
+    """
+    Calls ``func(config, pism_key)`` for every PISM instance.
+
+    With ``parallel``, the instances are handled concurrently in a process
+    pool, so the time taken follows the slowest instance rather than the sum
+    of all of them. Processes are used since the NetCDF library is not
+    thread-safe, so that :func:`esm_pism.netcdf.open_dataset` serializes all
+    NetCDF access within one process. ``func`` then only gets the ``general``
+    section and the section of its instance, and only its changes to the
+    latter are kept.
+    """
+    pism_keys = _pism_keys(config)
+    # The debugger needs the terminal of this process:
+    debugging = any(config[pism_key].get("debug_override_file_generation") for pism_key in pism_keys)
+    try:
+        if parallel and len(pism_keys) > 1 and not debugging:
+            with ProcessPoolExecutor(max_workers=len(pism_keys)) as pool:
+                sections = pool_map(
+                    pool,
+                    _run_instance,
+                    [func] * len(pism_keys),
+                    [{"general": config["general"], pism_key: config[pism_key]} for pism_key in pism_keys],
+                    pism_keys,
+                )
+            for pism_key, section in zip(pism_keys, sections):
+                config[pism_key].clear()
+                config[pism_key].update(section)
         else:
-            new_dict.update(item)
-    return new_dict
+            for pism_key in pism_keys:
+                func(config, pism_key)
+    except CommandConflictError as e:
+        logger.error(e)
+        logger.error("Remove one of them, or set command_conflicts: last_wins")
+        sys.exit(1)
+    return config
 
-@logger.catch
-def _add_files(coupler_files, config):
-    """Adds files to a specific coupler"""
 
-    # LA: add dual hemipshere option
-    if "pism_nh" in config:
-        pism_key = "pism_nh"
-    elif "pism_sh" in config:
-        pism_key = "pism_sh"
+def _get_command(config, pism_key):
+    """Returns the command line options collected so far for one PISM instance"""
+    return PismCommand.from_list(
+        config[pism_key].get("pism_command_line_opts", []),
+        config[pism_key].get("command_conflicts", "last_wins"),
+    )
+
+
+def _set_command(command, config, pism_key):
+    """Stores the command line options of one PISM instance in the config"""
+    config[pism_key]["pism_command_line_opts"] = command.to_list()
+
+
+def _model_domain(config, pism_key):
+    """
+    Returns what coupler files are compared with: the grid fingerprint of the
+    input file, ``(Mx, My)`` of the model grid and its extents along x and y,
+    each ``None`` if unknown.
+
+    When bootstrapping, the model grid is set by ``-Mx``, ``-My``,
+    ``-x_range`` and ``-y_range``, and the input file only provides the
+    extents they leave out, so its grid fingerprint does not apply.
+    """
+    command = _get_command(config, pism_key)
+    input_file = model_input_file(config, pism_key)
+    grid = None
+    if input_file and os.path.exists(input_file):
+        grid = load_forcing_index(input_file, get_cache_dir(config[pism_key], "forcing_index")).get("grid")
+    extents = [(grid[axis]["min"], grid[axis]["max"]) if grid else None for axis in ["x", "y"]]
+    if "bootstrap" not in command:
+        return (grid["fingerprint"] if grid else None), None, extents
+    for axis, option in enumerate(["x_range", "y_range"]):
+        try:
+            low, high = (float(value) for value in str(command.get(option)).split(","))
+        except ValueError:
+            continue
+        extents[axis] = (min(low, high), max(low, high))
+    shape = None
+    if command.get("Mx") and command.get("My"):
+        shape = int(command.get("Mx")), int(command.get("My"))
+    return None, shape, extents
+
+
+def _check_coupler_files(coupler_dict, config, pism_key):
+    """
+    Checks that the coupler files cover this chunk and the model domain and
+    are on the model grid, using the forcing index so that unchanged files are
+    not opened again.
+    """
+    cache_dir = get_cache_dir(config[pism_key], "forcing_index")
+    reference_fingerprint, shape, (x_extent, y_extent) = _model_domain(config, pism_key)
+    start_year = float(config[pism_key]["current_year"])
+    end_year = start_year + float(config["general"]["nyear"])
+    errors = []
+    for coupler_spec in coupler_dict.values():
+        for coupler_model_opts in coupler_spec.values():
+            if not coupler_model_opts or "files" not in coupler_model_opts:
+                continue
+            period, _ = coupler_period(coupler_model_opts.get("kv_pairs"))
+            for file_path in coupler_model_opts["files"].values():
+                if isinstance(file_path, dict):
+                    # Synthesized for exactly this chunk:
+                    continue
+                try:
+                    index = load_forcing_index(file_path, cache_dir)
+                except OSError as e:
+                    errors.append(f"Unable to read forcing file {file_path}: {e}")
+                    continue
+                if not period:
+                    errors.append(check_time_coverage(index, start_year, end_year))
+                if x_extent and y_extent:
+                    errors.append(check_domain(index, x_extent, y_extent))
+                if not config[pism_key].get("regrid_forcing"):
+                    errors.append(
+                        check_grid(index, config[pism_key].get("resolution"), reference_fingerprint, shape)
+                    )
+    errors = [error for error in errors if error]
+    if errors:
+        for error in errors:
+            logger.error(error)
+        sys.exit(1)
+
+
+def _synthesize_forcing_file(file_tag, spec, config, pism_key):
+    """Generates the forcing of this chunk from a climatology, anomalies and an index"""
+    store_dir = get_cache_dir(config[pism_key], "forcing_synthesized")
+    if not store_dir:
+        logger.error(f"Unable to synthesize the forcing for {file_tag} without a cache directory")
+        sys.exit(1)
+    start_year = float(config[pism_key]["current_year"])
+    try:
+        return synthesize_chunk(
+            spec,
+            start_year,
+            start_year + float(config["general"]["nyear"]),
+            store_dir,
+            spec.get("name") or f"{file_tag}.nc",
+            max_bytes=config[pism_key].get("synthesize_forcing_max_gb", 100) * 1024 ** 3,
+        )
+    except (KeyError, OSError, ValueError) as e:
+        logger.error(f"Unable to synthesize the forcing for {file_tag}: {e}")
+        sys.exit(1)
+
+
+def _staging_root(config, pism_key):
+    """Returns the directory where forcing of future chunks is staged"""
+    return config[pism_key].get("staging_dir") or get_cache_dir(config[pism_key], "staging")
+
+
+def _staged_forcing_file(file_tag, file_path, coupler_key_value, config, pism_key):
+    """Returns the file staged for this chunk in place of ``file_path``, if any"""
+    stage_root = _staging_root(config, pism_key)
+    if not stage_root:
+        return None
+    directory = chunk_dir(
+        stage_root, config["general"].get("expid", "pism"), pism_key, config[pism_key]["current_year"]
+    )
+    return read_staged(
+        directory,
+        file_tag,
+        file_path,
+        settings_key(config, pism_key),
+        window=forcing_window(coupler_key_value, config, pism_key),
+        period=coupler_period(coupler_key_value),
+    )
+
+
+def _link_mode(file_tag, config, pism_key):
+    """Returns how the read-only input ``file_tag`` is placed in the work directory"""
+    mode = config[pism_key].get("link_files", {}).get(file_tag, config[pism_key].get("link_inputs", "copy"))
+    if mode not in LINK_MODES:
+        logger.error(f"Unknown link mode {mode} for {file_tag}, use one of {', '.join(LINK_MODES)}")
+        sys.exit(1)
+    return mode
+
+
+def _hand_off(file_tag, file_path, name, config, pism_key):
+    """
+    Places a read-only input in the work directory directly, unless it is to
+    be copied by esm_runscripts. Returns whether the file was placed.
+    """
+    mode = _link_mode(file_tag, config, pism_key)
+    if mode == "copy":
+        return False
+    target = os.path.join(config[pism_key]["thisrun_work_dir"], name)
+    used = place_file(file_path, target, mode)
+    if used != mode:
+        logger.warning(f"Could not {mode} {file_path} to {target}, copied it instead")
     else:
-        pism_key = "pism"
+        logger.info(f"Placed {file_path} in the work directory as a {mode}")
+    if "linked_sources" not in config[pism_key]:
+        config[pism_key]["linked_sources"] = {}
+    config[pism_key]["linked_sources"][file_tag] = file_path
+    return True
+
 
+def _prepare_forcing_file(file_tag, file_path, synthesized, coupler_key_value, config, pism_key):
+    """Returns the version of a coupler file to use for this chunk"""
+    if synthesized:
+        if config[pism_key].get("regrid_forcing"):
+            return regrid_forcing_file(file_path, config, pism_key)
+        return file_path
+    staged = None
+    if config[pism_key].get("prefetch_forcing"):
+        staged = _staged_forcing_file(file_tag, file_path, coupler_key_value, config, pism_key)
+    if staged:
+        logger.info(f"Using {staged}, staged during the previous chunk, for {file_path}")
+        return staged
+    return prepare_forcing_file(file_path, coupler_key_value, config, pism_key)
+
+
+def _forcing_file(file_tag, source, coupler_key_value, config, pism_key):
+    """
+    Returns the coupler file to use for this chunk, linked into the forcing
+    directory of the run if it was generated in a store. Store entries may be
+    evicted by other experiments at any time, the links in the run directory
+    are unaffected.
+    """
+    # Generated for this chunk only, and with one record per chunk:
+    synthesized = isinstance(source, dict)
+    for attempt in range(2):
+        file_path = source
+        if synthesized:
+            file_path = _synthesize_forcing_file(file_tag, source, config, pism_key)
+        file_path = _prepare_forcing_file(file_tag, file_path, synthesized, coupler_key_value, config, pism_key)
+        forcing_dir = config[pism_key].get("thisrun_forcing_dir")
+        if file_path == source or not forcing_dir:
+            return file_path
+        os.makedirs(forcing_dir, exist_ok=True)
+        try:
+            return link_or_copy(file_path, os.path.join(forcing_dir, os.path.basename(file_path)))
+        except FileNotFoundError:
+            if attempt:
+                raise
+            logger.warning(f"{file_path} was evicted from its store in the meantime, generating it again")
+
+
+def _add_files(coupler_files, config, pism_key, coupler_key_value=None):
+    """Adds files to a specific coupler"""
     command_line_args = []
-    for file_tag, file_path in coupler_files.items():
-        command_line_args.append(f"-{file_tag} {os.path.basename(file_path)}")
+    for file_tag, source in coupler_files.items():
+        file_path = source
         for needed_dict in ["forcing_files", "forcing_sources", "forcing_in_work"]:
             if needed_dict not in config[pism_key]:
                 config[pism_key][needed_dict] = {}
+        # Stop rather than run without the forcing:
+        try:
+            file_path = _forcing_file(file_tag, source, coupler_key_value, config, pism_key)
+            command_line_args.append(f"-{file_tag} {os.path.basename(file_path)}")
+            placed = _hand_off(file_tag, file_path, os.path.basename(file_path), config, pism_key)
+        except (KeyError, OSError, ValueError) as e:
+            logger.error(f"Unable to prepare the forcing file {file_path} for -{file_tag}: {e}")
+            sys.exit(1)
+        if placed:
+            continue
         config[pism_key]["forcing_files"][file_tag] = file_tag
         config[pism_key]["forcing_sources"][file_tag] = file_path
         config[pism_key]["forcing_in_work"][file_tag] = os.path.basename(file_path)
@@ -43,7 +337,7 @@ def _add_files(coupler_files, config):
 def _add_kv(coupler_key_value, config):
     """Adds kv pairs for a coupler"""
     if isinstance(coupler_key_value, list):
-        coupler_key_value = _kv_list_to_dict_of_dicts(coupler_key_value)
+        coupler_key_value = kv_list_to_dict_of_dicts(coupler_key_value)
     return [
         f"{key} {value}" if key.startswith("-") else f"-{key} {value}"
         for key, value in coupler_key_value.items()
@@ -56,31 +350,10 @@ def _add_flags(coupler_flags, config):
     return [f"{flag}" if flag.startswith("-") else f"-{flag}" for flag in coupler_flags]
 
 
-@logger.catch
-def pism_set_couplers(config):
-    """
-
-    Parameters
-    ----------
-    config : dict
-        The entire exp config
-
-    Returns
-    -------
-    config : dict
-        The entire exp config
-    """
-    
-    # LA: add dual hemipshere option
-    if "pism_nh" in config:
-        pism_key = "pism_nh"
-    elif "pism_sh" in config:
-        pism_key = "pism_sh"
-    else:
-        pism_key = "pism"
-    
+def _pism_set_couplers(config, pism_key):
+    """Sets up the couplers of one PISM instance"""
     coupler_dict = config[pism_key].get("couplers", {})
-    pism_command_line_opts = config[pism_key].get("pism_command_line_opts", [])
+    command = _get_command(config, pism_key)
     command_line_additions = []
     for coupler_type, coupler_spec in coupler_dict.items():
         chosen_couplers = []
@@ -94,7 +367,10 @@ def pism_set_couplers(config):
             if coupler_model_opts:  # Not empty:
                 if "files" in coupler_model_opts:
                     command_line_args_files_additions = _add_files(
-                        coupler_model_opts["files"], config
+                        coupler_model_opts["files"],
+                        config,
+                        pism_key,
+                        coupler_model_opts.get("kv_pairs"),
                     )
                     if command_line_args_files_additions:
                         command_line_additions += command_line_args_files_additions
@@ -111,15 +387,17 @@ def pism_set_couplers(config):
                     if command_line_args_flags_additions:
                         command_line_additions += command_line_args_flags_additions
         command_line_additions.append(f"-{coupler_type} " + ",".join(chosen_couplers))
-    config[pism_key]["pism_command_line_opts"] = (
-        pism_command_line_opts + command_line_additions
-    )
+    if config[pism_key].get("check_forcing"):
+        _check_coupler_files(coupler_dict, config, pism_key)
+    _set_command(command.extend(command_line_additions), config, pism_key)
     return config
 
 
 @logger.catch
-def pism_set_kv_pairs(config):
+@instrumented
+def pism_set_couplers(config):
     """
+    Sets up the couplers (with their files, key-value pairs and flags).
 
     Parameters
     ----------
@@ -131,32 +409,93 @@ def pism_set_kv_pairs(config):
     config : dict
         The entire exp config
     """
+    return _for_each_instance(config, _pism_set_couplers, parallel=True)
 
-    
-    # LA: add dual hemipshere option
-    if "pism_nh" in config:
-        pism_key = "pism_nh"
-    elif "pism_sh" in config:
-        pism_key = "pism_sh"
-    else:
-        pism_key = "pism"
-    
+
+@logger.catch
+@instrumented
+def pism_check_forcing_files(config):
+    """
+    Checks all registered forcing files before the job is submitted.
+
+    Every file in ``forcing_sources`` (e.g. registered by
+    ``pism_set_couplers``) or linked into the work directory (see
+    ``link_inputs``) must exist, be readable and open as a NetCDF file,
+    and must not be truncated. The files are checked concurrently, using
+    ``preflight_workers`` (default 8) threads, or processes if there are many
+    files to check (see :data:`esm_pism.preflight.PROCESS_POOL_MIN_FILES`).
+    Files which passed are
+    remembered in the cache directory, and are not checked again until their
+    size or modification time changes. All problems are reported together.
+
+    Parameters
+    ----------
+    config : dict
+        The entire exp config
+
+    Returns
+    -------
+    config : dict
+        The entire exp config
+    """
+    errors = {}
+    for pism_key in _pism_keys(config):
+        errors.update(
+            check_files(
+                list(config[pism_key].get("forcing_sources", {}).values())
+                + list(config[pism_key].get("linked_sources", {}).values()),
+                get_cache_dir(config[pism_key], "preflight"),
+                config[pism_key].get("preflight_workers", 8),
+            )
+        )
+    if errors:
+        logger.error(f"{len(errors)} forcing file(s) failed the pre-flight check:")
+        for error in errors.values():
+            logger.error(error)
+        sys.exit(1)
+    return config
+
+
+def _pism_set_kv_pairs(config, pism_key):
+    """Adds the key-value pairs of one PISM instance"""
     kv_pairs = config[pism_key].get("kv_pairs", {})
     if isinstance(kv_pairs, list):
-        kv_pairs = _kv_list_to_dict_of_dicts(kv_pairs)
-    pism_command_line_opts = config[pism_key].get("pism_command_line_opts", [])
+        kv_pairs = kv_list_to_dict_of_dicts(kv_pairs)
+    _set_command(_get_command(config, pism_key).add_kv_pairs(kv_pairs), config, pism_key)
+    return config
 
-    pism_command_line_opts += [
-        f"{key} {value}" if key.startswith("-") else f"-{key} {value}"
-        for key, value in kv_pairs.items()
-    ]
-    config[pism_key]["pism_command_line_opts"] = pism_command_line_opts
+
+@logger.catch
+@instrumented
+def pism_set_kv_pairs(config):
+    """
+    Adds ``kv_pairs`` to the PISM command line options.
+
+    Parameters
+    ----------
+    config : dict
+        The entire exp config
+
+    Returns
+    -------
+    config : dict
+        The entire exp config
+    """
+    return _for_each_instance(config, _pism_set_kv_pairs)
+
+
+def _pism_set_flags(config, pism_key):
+    """Adds the flags of one PISM instance"""
+    flags = config[pism_key].get("flags", [])
+    _set_command(_get_command(config, pism_key).add_flags(flags), config, pism_key)
     return config
 
 
 @logger.catch
+@instrumented
 def pism_set_flags(config):
     """
+    Adds ``flags`` to the PISM command line options.
 
     Parameters
     ----------
@@ -168,33 +507,119 @@ def pism_set_flags(config):
     config : dict
         The entire exp config
     """
-    
-    # LA: add dual hemipshere option
-    if "pism_nh" in config:
-        pism_key = "pism_nh"
-    elif "pism_sh" in config:
-        pism_key = "pism_sh"
+    return _for_each_instance(config, _pism_set_flags)
+
+
+def _pism_config_file(config, pism_key):
+    """Returns the ``pism_config.nc`` file of one PISM instance"""
+    return config[pism_key].get("config_file") or config[pism_key]["model_dir"] + "./share/pism/pism_config.nc"
+
+
+def _check_overrides(overrides_kv_pairs, parameters):
+    """
+    Checks overrides against the ``parameters`` of the config index.
+
+    Returns
+    -------
+    attrs : dict
+        The valid overrides
+    errors : list of str
+        One description per invalid override
+    """
+    attrs = {}
+    errors = []
+    for key, value in overrides_kv_pairs.items():
+        logger.debug(f"Overrides file: {key} {value}")
+        if key not in parameters:
+            errors.append(f"Unknown PISM configuration key: {key}")
+            continue
+        type_error = check_value_type(key, value, parameters)
+        if type_error:
+            errors.append(f"Bad value for PISM configuration key: {type_error}")
+            continue
+        attrs[key] = value
+    return attrs, errors
+
+
+def _pism_override_file(config, pism_key):
+    """Generates the overrides file of one PISM instance"""
+    if config[pism_key].get("debug_override_file_generation"):
+        import pdb; pdb.set_trace()
+    pism_config_location = _pism_config_file(config, pism_key)
+    pism_overrides_location = config[pism_key].get("overrides_file")
+    if not pism_overrides_location:
+        try:
+            pism_config_index = get_config_index(config[pism_key], pism_config_location)
+        except FileNotFoundError:
+            logger.error("Unable to open the default PISM config file, sorry!")
+            logger.error("Was looking here:")
+            logger.error(pism_config_location)
+            sys.exit(1)
+        overrides_kv_pairs = config[pism_key].get("overrides_kv_pairs", {})
+        if isinstance(overrides_kv_pairs, list):
+            overrides_kv_pairs = kv_list_to_dict_of_dicts(overrides_kv_pairs)
+        new_attrs, errors = _check_overrides(overrides_kv_pairs, pism_config_index["parameters"])
+        for key, value in new_attrs.items():
+            logger.info(f"The pism_overrides.nc file will contain {key}: {value}")
+        if errors:
+            for error in errors:
+                logger.error(error)
+            sys.exit(1)
+        new_pism_overrides = config[pism_key]["thisrun_config_dir"] + "/pism_overrides.nc"
+        store_dir = (
+            get_cache_dir(config[pism_key], "overrides_store")
+            if config[pism_key].get("overrides_store", True)
+            else None
+        )
+        if store_dir:
+            reused = fetch(
+                store_dir,
+                store_key(
+                    overrides=to_netcdf_attrs(new_attrs),
+                    template_hash=pism_config_index["content_hash"],
+                ),
+                new_pism_overrides,
+                lambda path: write_overrides_file(path, new_attrs),
+                max_bytes=config[pism_key].get("overrides_store_max_mb", 64) * 1024 ** 2,
+            )
+            if reused:
+                logger.info("Reusing an identical pism_overrides.nc file from the store!")
+            else:
+                logger.info("Writing a new pism_overrides.nc file!")
+        else:
+            logger.info("Writing a new pism_overrides.nc file!")
+            write_overrides_file(new_pism_overrides, new_attrs)
     else:
-        pism_key = "pism"
-    
-    flags = config[pism_key].get("flags", [])
-    pism_command_line_opts = config[pism_key].get("pism_command_line_opts", [])
-    pism_command_line_opts += [
-        f"{flag}" if flag.startswith("-") else f"-{flag}" for flag in flags
-    ]
-    config[pism_key]["pism_command_line_opts"] = pism_command_line_opts
+        logger.info(f"Using specified pism_overrides {pism_overrides_location}")
+    pism_overrides_source = pism_overrides_location or new_pism_overrides
+    if not _hand_off(
+        "pism_overrides", pism_overrides_source, os.path.basename(pism_overrides_source), config, pism_key
+    ):
+        for needed_dict in ["config_files", "config_sources", "config_in_work"]:
+            if needed_dict not in config[pism_key]:
+                config[pism_key][needed_dict] = {}
+        config[pism_key]["config_files"]["pism_overrides"] = "pism_overrides"
+        config[pism_key]["config_sources"]["pism_overrides"] = pism_overrides_source
+        config[pism_key]["config_in_work"]["pism_overrides"] = os.path.basename(pism_overrides_source)
+    command = _get_command(config, pism_key).add("pism_override", os.path.basename(pism_overrides_source))
+    _set_command(command, config, pism_key)
     return config
 
 
 @logger.catch
+@instrumented
 def pism_override_file(config):
     """
     Generates a PISM Overrides file.
 
     Opens the ``pism_config.nc`` file in your YAML (see below), or uses the
     default found in the model directory under ``share/pism/pism_config.nc``.
-    This is used to determine which override keys are valid. A new file is
-    written which is used during your simulation.
+    This is used to determine which override keys are valid, and whether the
+    values you give have the right type. The valid keys are kept in an index
+    in the cache directory (``pism.cache_dir``), so the config file is only
+    read again when it changes. Only the attribute table of the
+    ``pism_config`` variable is read, and the new file which is used during
+    your simulation holds just that variable with your chosen attributes.
 
     Alternatively, you can provide an override file to use, in which case that
     one will be used rather than generating a new one.
@@ -220,6 +645,12 @@ def pism_override_file(config):
             pism:
                 overrides_file: "/some/path/to/an/overrides/file.nc"
 
+    Generated overrides files are kept in a store in the cache directory,
+    indexed by their content. When the same overrides and template are
+    requested again, the stored file is linked into the run instead of being
+    written anew. The store can be switched off with ``overrides_store:
+    False``, and is limited to ``overrides_store_max_mb`` (default 64) MB.
+
     Parameters
     ----------
     config : dict
@@ -230,70 +661,317 @@ def pism_override_file(config):
     config : dict
         The entire exp config
     """
-    
-    # LA: add dual hemipshere option
-    if "pism_nh" in config:
-        pism_key = "pism_nh"
-    elif "pism_sh" in config:
-        pism_key = "pism_sh"
-    else:
-        pism_key = "pism"
-    
-    if config[pism_key].get("debug_override_file_generation"):
-        import pdb; pdb.set_trace()
-    pism_config_location = (
-        config[pism_key].get("config_file")
-        or config[pism_key]["model_dir"] + "./share/pism/pism_config.nc"
+    return _for_each_instance(config, _pism_override_file, parallel=True)
+
+
+def _model_grid_shape(command, input_file):
+    """
+    Returns the ``(Mx, My)`` of the model grid: from ``-Mx`` and ``-My``, which
+    set the grid when bootstrapping, or else from the header of the input file.
+    """
+    shape = None
+    if not (command.get("Mx") and command.get("My")):
+        try:
+            shape = read_grid_shape(input_file)
+        except OSError:
+            shape = None
+        if not shape:
+            return None
+    return int(command.get("Mx") or shape[0]), int(command.get("My") or shape[1])
+
+
+def _plan_decomposition(command, config, pism_key):
+    """Adds -Nx and -Ny for the model grid to the command of one PISM instance"""
+    if "Nx" in command or "Ny" in command:
+        logger.info("Using the -Nx and -Ny given in the config")
+        return
+    nproc = config[pism_key].get("nproc")
+    input_file = model_input_file(config, pism_key) or config[pism_key]["input_targets"]["input"]
+    shape = _model_grid_shape(command, input_file)
+    if not nproc or not shape:
+        logger.warning(f"Cannot plan the decomposition without nproc and the grid of {input_file}")
+        return
+    layout = plan_decomposition(
+        *shape,
+        int(nproc),
+        choose_ranks=config[pism_key].get("plan_ranks", False),
+        **config[pism_key].get("decomposition_weights", {}),
     )
-    pism_overrides_location = config[pism_key].get("overrides_file")
-    if not pism_overrides_location:
+    if not layout:
+        logger.warning(f"The {shape[0]}x{shape[1]} grid is too small for {nproc} ranks")
+        return
+    Nx, Ny = layout
+    logger.info(f"Splitting the {shape[0]}x{shape[1]} grid into {Nx}x{Ny} blocks")
+    if Nx * Ny != int(nproc):
+        logger.info(f"Using {Nx * Ny} of the {nproc} MPI ranks")
+        config[pism_key]["nproc"] = Nx * Ny
+    command.add("Nx", Nx)
+    command.add("Ny", Ny)
+
+
+def _check_output_volume(command, config, pism_key):
+    """Checks the estimated output of one PISM instance against the budgets"""
+    input_file = model_input_file(config, pism_key) or config[pism_key]["input_targets"]["input"]
+    shape = _model_grid_shape(command, input_file)
+    Mz = command.get("Mz")
+    if shape and not Mz:
         try:
-            pism_standard_config = xr.open_dataset(pism_config_location)
-        except FileNotFoundError:
-            logger.error("Unable to open the default PISM config file, sorry!")
-            logger.error("Was looking here:")
-            logger.error(pism_config_location)
-            sys.exit(1)
-        new_attrs = {}
-        overrides_kv_pairs = config[pism_key].get("overrides_kv_pairs", {})
-        if isinstance(overrides_kv_pairs, list):
-            overrides_kv_pairs = _kv_list_to_dict_of_dicts(overrides_kv_pairs)
-        for key, value in overrides_kv_pairs.items():
-            logger.debug(f"Overrides file: {key} {value}")
-            if key in pism_standard_config.pism_config.attrs:
-                new_attrs[key] = value
-                logger.info(f"The pism_overrides.nc file will contain {key}: {value}")
-            else:
-                logger.error(f"Unknown PISM configuration key: {key}")
-                sys.exit(1)
-        pism_standard_config.pism_config.attrs = new_attrs
-        logger.info("Writing a new pism_overrides.nc file!")
-        new_pism_overrides = config[pism_key]["thisrun_config_dir"] + "/pism_overrides.nc"
-        pism_standard_config.to_netcdf(new_pism_overrides)
-    else:
-        logger.info(f"Using specified pism_overrides {pism_overrides_location}")
-    for needed_dict in ["config_files", "config_sources", "config_in_work"]:
-        if needed_dict not in config[pism_key]:
-            config[pism_key][needed_dict] = {}
-    config[pism_key]["config_files"]["pism_overrides"] = "pism_overrides"
-    config[pism_key]["config_sources"]["pism_overrides"] = (
-        pism_overrides_location or new_pism_overrides
+            Mz = read_vertical_levels(input_file)
+        except OSError:
+            Mz = None
+    Mz = Mz or DEFAULT_MZ
+    if not shape:
+        logger.warning(f"Cannot estimate the output without the grid of {input_file}")
+        return
+    start_year = float(config[pism_key]["current_year"])
+    nyear = float(config["general"]["nyear"])
+    estimate = estimate_output(
+        *shape,
+        int(Mz),
+        nyear,
+        start_year,
+        config[pism_key]["ex_vars"],
+        config[pism_key]["ex_times"],
+        config[pism_key]["ts_vars"],
+        config[pism_key]["ts_times"],
+        config[pism_key]["outdata_size"],
     )
-    config[pism_key]["config_in_work"]["pism_overrides"] = os.path.basename(
-        config[pism_key]["config_sources"]["pism_overrides"]
+    config[pism_key]["output_estimate"] = estimate
+    logger.info(
+        f"PISM will write about {estimate['bytes'] / 1024 ** 3:.1f} GB in {estimate['writes']} writes this chunk"
     )
-    config[pism_key]["pism_command_line_opts"].append(
-        "-pism_override "
-        + os.path.basename(config[pism_key]["config_sources"]["pism_overrides"])
+    budget_gb = config[pism_key].get("output_budget_gb")
+    max_writes = config[pism_key].get("output_max_writes")
+    problems = []
+    allowed_records = estimate["ex_records"]
+    if budget_gb and estimate["bytes"] > budget_gb * 1024 ** 3:
+        problems.append(f"about {estimate['bytes'] / 1024 ** 3:.1f} GB exceed output_budget_gb ({budget_gb})")
+        if estimate["ex_records"]:
+            per_record = estimate["ex_bytes"] / estimate["ex_records"]
+            spare = budget_gb * 1024 ** 3 - estimate["o_bytes"] - estimate["ts_bytes"]
+            allowed_records = min(allowed_records, int(spare // per_record))
+    if max_writes and estimate["writes"] > max_writes:
+        problems.append(f"{estimate['writes']} writes exceed output_max_writes ({max_writes})")
+        allowed_records = min(allowed_records, max_writes - estimate["ts_records"] - 1)
+    if not problems:
+        return
+    proposal = propose_cadence(config[pism_key]["ex_times"], start_year, nyear, allowed_records)
+    action = config[pism_key].get("output_budget_action", "warn")
+    report = logger.error if action == "error" else logger.warning
+    for problem in problems:
+        report(f"The output of this chunk is too large: {problem}")
+    if proposal:
+        report(f"ex_times: \"{proposal}\" would fit")
+    else:
+        report("The ts_times or outdata_size alone exceed the budget")
+    if action == "error":
+        sys.exit(1)
+
+
+def _validation_action(config, pism_key):
+    """Returns what to do about unknown options: ``None``, ``"warn"`` or ``"error"``"""
+    action = config[pism_key].get("validate_options", "warn")
+    if action is False:
+        return None
+    if action is True:
+        return "warn"
+    if action not in ["warn", "error"]:
+        logger.error(f"Unknown validate_options: {action}, use warn, error or False")
+        sys.exit(1)
+    return action
+
+
+def _validate_options(command, config, pism_key):
+    """Warns about (or stops at) options of one PISM instance PISM does not know"""
+    action = _validation_action(config, pism_key)
+    try:
+        config_file = _pism_config_file(config, pism_key)
+        option_index = get_config_index(config[pism_key], config_file)["options"]
+    except (KeyError, OSError):
+        logger.warning("No PISM config file found, the command line options cannot be checked")
+        return
+    errors = check_options(command.names(), option_index, config[pism_key].get("known_options", []))
+    if not errors:
+        return
+    report = logger.error if action == "error" else logger.warning
+    for error in errors:
+        report(error)
+    report(f"These options are not in {config_file}. If they are valid, add them to known_options")
+    if action == "error":
+        sys.exit(1)
+
+
+def _hand_off_restart(config, pism_key):
+    """
+    Links the restart of the previous chunk (or the initial file) into the
+    work directory, instead of letting esm_runscripts copy it there.
+    """
+    input_file = config[pism_key].get("input_sources", {}).get("input")
+    if not input_file or not os.path.exists(input_file):
+        return
+    name = os.path.basename(config[pism_key]["input_targets"]["input"])
+    if not _hand_off("input", input_file, name, config, pism_key):
+        return
+    for needed_dict in ["input_files", "input_sources"]:
+        config[pism_key].get(needed_dict, {}).pop("input", None)
+    # The restart written by this chunk is the input of the next one, so it
+    # can be moved to the restart directory rather than copied:
+    file_movements = config[pism_key].setdefault("file_movements", {})
+    file_movements.setdefault("restart_out", {}).setdefault("all_directions", "move")
+
+
+def _option_file(name, value, config, pism_key):
+    """Returns where the file given to the option ``name`` is before it is placed in the work directory"""
+    for sources in ["forcing_sources", "linked_sources"]:
+        source = config[pism_key].get(sources, {}).get(name)
+        if source:
+            return source
+    return os.path.join(config[pism_key].get("thisrun_work_dir", ""), value)
+
+
+def _use_bootstrap_cache(command, config, pism_key):
+    """Replaces bootstrapping by starting from a cached bootstrapped state"""
+    input_file = config[pism_key].get("input_sources", {}).get("input")
+    if not input_file or not os.path.exists(input_file):
+        logger.warning("Not using the bootstrap cache, the input file is unknown")
+        return
+    store_dir = get_cache_dir(config[pism_key], "bootstrap_states")
+    if not store_dir:
+        return
+    # Couplers and physics options may fill in fields of the state, so
+    # everything but the output and the run length is passed on:
+    options = {name: command.get(name) for name in command.names() if not is_run_option(name)}
+    overrides_file = config[pism_key].get("config_sources", {}).get("pism_overrides") or config[pism_key].get(
+        "linked_sources", {}
+    ).get("pism_overrides")
+    if overrides_file:
+        options["pism_override"] = overrides_file
+    fingerprint_dir = get_cache_dir(config[pism_key], "fingerprints")
+    files = {}
+    for name, value in options.items():
+        if not (name.endswith("_file") or name == "pism_override") or value is None:
+            continue
+        options[name] = _option_file(name, value, config, pism_key)
+        if not os.path.exists(options[name]):
+            logger.warning(f"Not using the bootstrap cache, the file {options[name]} of -{name} is missing")
+            return
+        files[name] = content_fingerprint(options[name], fingerprint_dir)
+    key = state_key(
+        content_fingerprint(input_file, fingerprint_dir),
+        # Only the contents of the files matter, not where they are:
+        {name: value for name, value in options.items() if name not in files},
+        config[pism_key]["executable"],
+        config[pism_key].get("resolution"),
+        files=files,
+    )
+    option_list = [f"-{name}" if value is None else f"-{name} {value}" for name, value in options.items()]
+    launcher = config[pism_key].get("bootstrap_launcher") or []
+    if isinstance(launcher, str):
+        launcher = shlex.split(launcher)
+    timeout = config[pism_key].get("bootstrap_timeout_minutes", 60) * 60
+    state, reused = cached_state(
+        store_dir,
+        key,
+        lambda path: bootstrap(
+            config[pism_key]["executable"],
+            input_file,
+            option_list,
+            path,
+            launcher=launcher,
+            cwd=config[pism_key].get("thisrun_work_dir"),
+            log_file=os.path.join(os.path.dirname(path), "bootstrap.log"),
+        ),
+        timeout=timeout,
     )
+    if not state:
+        logger.warning("Bootstrapping in the run itself")
+        return
+    logger.info(f"Starting from the {'cached' if reused else 'newly'} bootstrapped state {state}")
+    for name in command.names():
+        if is_bootstrap_option(name):
+            command.remove(name)
+    config[pism_key]["input_sources"]["input"] = state
+    config[pism_key]["bootstrap_state"] = state
+
+
+def _pism_assemble_command(config, pism_key):
+    """Puts together the command of one PISM instance"""
+    command = PismCommand(config[pism_key].get("command_conflicts", "last_wins"))
+    command.add("i", os.path.basename(config[pism_key]["input_targets"]["input"]))
+    command.add("ys", config[pism_key]["current_year"])
+    command.add("y", config["general"]["nyear"])
+    command.extend(config[pism_key].get("pism_command_line_opts", []))
+    command.add("ts_file", config[pism_key]["outdata_sources"]["ts_file"])
+    command.add("ts_vars", ",".join(config[pism_key]["ts_vars"]))
+    command.add("ts_times", config[pism_key]["ts_times"])
+    command.add("extra_file", config[pism_key]["outdata_sources"]["ex_file"])
+    command.add("extra_vars", ",".join(config[pism_key]["ex_vars"]))
+    command.add("extra_times", config[pism_key]["ex_times"])
+    command.add("o", config[pism_key]["restart_out_sources"]["restart"])
+    command.add("o_size", config[pism_key]["outdata_size"])
+    # Before bootstrapping with the options:
+    if _validation_action(config, pism_key):
+        _validate_options(command, config, pism_key)
+    if config[pism_key].get("bootstrap_cache") and "bootstrap" in command:
+        _use_bootstrap_cache(command, config, pism_key)
+    _hand_off_restart(config, pism_key)
+    if config[pism_key].get("plan_decomposition"):
+        _plan_decomposition(command, config, pism_key)
+    if config[pism_key].get("output_budget_gb") or config[pism_key].get("output_max_writes"):
+        _check_output_volume(command, config, pism_key)
+    command.add("options_left")
+    command_to_run = command.render(config[pism_key]["executable"])
+
+    logger.critical("PISM will be run like this:")
+    logger.critical(command_to_run)
+    config[pism_key]["execution_command"] = command_to_run
+    # The options on their own, e.g. to derive the commands of ensemble members:
+    config[pism_key]["execution_command_opts"] = command.to_list()
+    # Identifies the command, e.g. for caching or job arrays:
+    config[pism_key]["execution_command_digest"] = command.digest(config[pism_key]["executable"])
+
     return config
 
 
 @logger.catch
+@instrumented
 def pism_assemble_command(config):
     """
     Puts together the final PISM command used to launch the model
 
+    Every option appears only once, in a fixed order, so the same
+    configuration always gives the same command. If an option is set twice
+    with different values, the last one wins (with a warning); set
+    ``command_conflicts: error`` to stop instead. A digest of the command is
+    stored in ``execution_command_digest``.
+
+    Every option is checked against the parameters and options listed in the
+    PISM config file (see ``pism_override_file``), and unknown options, e.g.
+    typos, are reported with suggestions for what was meant. With
+    ``validate_options: error``, they stop the experiment before it is
+    submitted. Options which PISM accepts but which are not in the config
+    file can be listed in ``known_options``; set ``validate_options: False``
+    to skip the check.
+
+    With ``plan_decomposition: True``, the ``-Nx`` and ``-Ny`` options are
+    chosen for the model grid (from ``-Mx`` and ``-My`` when bootstrapping,
+    else from the input file) and the ``nproc`` MPI ranks. With
+    ``plan_ranks: True`` as well, fewer ranks are used (and ``nproc`` is
+    changed) if they are expected to be as fast.
+
+    With ``bootstrap_cache: True``, a run with ``-bootstrap`` starts from a
+    cached bootstrapped state instead, which is shared by all runs with the
+    same options and input and forcing files. The first of them produces the
+    state by running PISM for zero years with all but the output and run
+    length options (prefixed by
+    ``bootstrap_launcher``, e.g. ``srun -n 4``), while concurrent runs wait
+    for it for up to ``bootstrap_timeout_minutes`` (default 60).
+
+    The bytes and number of writes of the output of the chunk are estimated
+    if ``output_budget_gb`` or ``output_max_writes`` is set. If the estimate
+    exceeds them, a coarser ``ex_times`` which fits is proposed, with a
+    warning or, with ``output_budget_action: error``, stopping the experiment.
+
     Parameters
     ----------
     config : dict
@@ -304,36 +982,591 @@ def pism_assemble_command(config):
     config : dict
         The entire exp config
     """
-    
-    # LA: add dual hemipshere option
-    if "pism_nh" in config:
-        pism_key = "pism_nh"
-    elif "pism_sh" in config:
-        pism_key = "pism_sh"
-    else:
-        pism_key = "pism"
-
-    command_to_run = (
-        config[pism_key]["executable"]
-        + " -i "
-        + os.path.basename(config[pism_key]["input_targets"]["input"])
-        + " -ys " + str(config[pism_key]['current_year'])
-        + " -y " + str(config['general']['nyear']) + " "
-        + " ".join(set(config[pism_key]["pism_command_line_opts"])) + " "
-        + " -ts_file " + str(config[pism_key]['outdata_sources']['ts_file']) + " "
-        + " -ts_vars "
-        + ",".join(config[pism_key]["ts_vars"]) + " "
-        + " -ts_times " + str(config[pism_key]['ts_times']) + " "
-        + " -extra_file " + str(config[pism_key]['outdata_sources']['ex_file']) + " "
-        + " -extra_vars "
-        + ",".join(config[pism_key]["ex_vars"]) + " "
-        + " -extra_times " + str(config[pism_key]['ex_times']) + " "
-        + " -o " + str(config[pism_key]['restart_out_sources']['restart']) + " "
-        + " -o_size " + str(config[pism_key]['outdata_size']) + " -options_left"
+    return _for_each_instance(config, _pism_assemble_command)
+
+
+def _output_files(config, pism_key):
+    """Returns the restart, time series and extra files of one PISM instance"""
+    files = {
+        "restart": config[pism_key].get("restart_out_sources", {}).get("restart"),
+        "ts_file": config[pism_key].get("outdata_sources", {}).get("ts_file"),
+        "ex_file": config[pism_key].get("outdata_sources", {}).get("ex_file"),
+    }
+    work_dir = config[pism_key].get("thisrun_work_dir", "")
+    return {kind: os.path.join(work_dir, path) for kind, path in files.items() if path}
+
+
+@logger.catch
+@instrumented
+def pism_compress_outputs(config):
+    """
+    Compresses and rechunks the output files of the run.
+
+    The restart, time series (``ts_file``) and extra (``ex_file``) files are
+    rewritten as NetCDF4 with zlib compression (level ``compress_level``,
+    default 4) and shuffling, in chunks which are contiguous along time. With
+    ``compress_bitround_bits``, the floating point variables in ``ex_vars``
+    only keep that many mantissa bits. Every file is verified against the
+    original before it replaces the original. The files are compressed in
+    ``compress_workers`` (default 4) processes. Files which are missing or
+    already compressed are skipped, and problems are logged without stopping
+    the experiment.
+
+    Parameters
+    ----------
+    config : dict
+        The entire exp config
+
+    Returns
+    -------
+    config : dict
+        The entire exp config
+    """
+    jobs = []
+    for pism_key in _pism_keys(config):
+        bits = config[pism_key].get("compress_bitround_bits")
+        for kind, path in _output_files(config, pism_key).items():
+            if not os.path.exists(path):
+                logger.warning(f"Not compressing {path}, it does not exist")
+                continue
+            bitround = {}
+            if bits and kind == "ex_file":
+                bitround = {var: int(bits) for var in config[pism_key].get("ex_vars", [])}
+            jobs.append(
+                (
+                    path,
+                    {
+                        "complevel": config[pism_key].get("compress_level", 4),
+                        "bitround": bitround,
+                        "chunk_bytes": config[pism_key].get("compress_chunk_mb", 4) * 1024 ** 2,
+                    },
+                )
+            )
+    workers = max(config[pism_key].get("compress_workers", 4) for pism_key in _pism_keys(config))
+    for (path, _), (sizes, error) in zip(jobs, compress_files(jobs, workers)):
+        if error:
+            logger.error(error)
+        else:
+            logger.info(f"Compressed {path} from {sizes[0] / 1024 ** 2:.1f} MB to {sizes[1] / 1024 ** 2:.1f} MB")
+    return config
+
+
+@logger.catch
+@instrumented
+def pism_concatenate_outputs(config):
+    """
+    Appends the time series and extra files of this chunk to consolidated
+    files covering the whole experiment.
+
+    For every PISM instance, the ``ts_file`` and ``ex_file`` of the chunk are
+    appended to ``<expid>_<instance>_ts_file.nc`` and
+    ``<expid>_<instance>_ex_file.nc`` in ``concatenate_dir`` (default: the
+    ``experiment_outdata_dir``). Only the records of this chunk are written;
+    earlier chunks are never read again. An index next to each file, ending in
+    ``.index.json``, lists the records and years of every chunk. Problems are
+    logged without stopping the experiment.
+
+    Parameters
+    ----------
+    config : dict
+        The entire exp config
+
+    Returns
+    -------
+    config : dict
+        The entire exp config
+    """
+    expid = config["general"].get("expid", "pism")
+    for pism_key in _pism_keys(config):
+        target_dir = config[pism_key].get("concatenate_dir") or config[pism_key]["experiment_outdata_dir"]
+        os.makedirs(target_dir, exist_ok=True)
+        chunk = config["general"].get("run_number", config[pism_key].get("current_year"))
+        for kind, path in _output_files(config, pism_key).items():
+            if kind == "restart":
+                continue
+            target = os.path.join(target_dir, f"{expid}_{pism_key}_{kind}.nc")
+            try:
+                entry = append_chunk(path, target, chunk)
+            except (OSError, ValueError) as e:
+                logger.error(f"Unable to append {path} to {target}: {e}")
+                continue
+            if entry:
+                logger.info(
+                    f"Appended records {entry['first_record']} to {entry['last_record']} of {target} from {path}"
+                )
+    return config
+
+
+@logger.catch
+@instrumented
+def pism_reduce_diagnostics(config):
+    """
+    Reduces the extra file of the chunk to a few numbers per output time.
+
+    The diagnostics are given in ``diagnostics``, e.g.::
+
+        pism:
+            diagnostics:
+                ice_volume:
+                    variable: thk
+                    area_weighted: True
+                    units: m3
+                grounded_area:
+                    area_weighted: True
+                    where:
+                        mask: [2]
+                    by_basin: True
+                mean_velocity:
+                    variable: velsurf_mag
+                    reduction: mean
+            diagnostics_basins:
+                file: /path/to/basins.nc
+                variable: basins
+
+    Every diagnostic is a ``reduction`` (``sum``, the default, ``mean``,
+    ``min`` or ``max``) of a ``variable`` of the extra file (or of the cell
+    count or area, without a variable), over the cells matching ``where``, and
+    with ``by_basin`` also for every basin of ``diagnostics_basins``. The
+    extra file is read one record at a time, in ``diagnostics_workers``
+    (default 4) processes, and the results are appended to
+    ``<expid>_<instance>_diagnostics.nc`` in ``diagnostics_dir`` (default: the
+    ``experiment_outdata_dir``). Problems are logged without stopping the
+    experiment.
+
+    Parameters
+    ----------
+    config : dict
+        The entire exp config
+
+    Returns
+    -------
+    config : dict
+        The entire exp config
+    """
+    expid = config["general"].get("expid", "pism")
+    for pism_key in _pism_keys(config):
+        specs = config[pism_key].get("diagnostics")
+        if not specs:
+            continue
+        errors = [error for error in (check_spec(name, spec) for name, spec in specs.items()) if error]
+        if errors:
+            for error in errors:
+                logger.error(error)
+            continue
+        path = _output_files(config, pism_key).get("ex_file")
+        if not path or not os.path.exists(path):
+            logger.warning(f"Not computing diagnostics of {pism_key}, there is no extra file")
+            continue
+        target_dir = config[pism_key].get("diagnostics_dir") or config[pism_key]["experiment_outdata_dir"]
+        target = os.path.join(target_dir, f"{expid}_{pism_key}_diagnostics.nc")
+        try:
+            basins = None
+            if config[pism_key].get("diagnostics_basins"):
+                basin_config = config[pism_key]["diagnostics_basins"]
+                basins = read_basins(basin_config["file"], basin_config.get("variable", "basins"))
+            times, time_attrs, rows = reduce_file(
+                path, specs, basins, config[pism_key].get("diagnostics_workers", 4)
+            )
+            os.makedirs(target_dir, exist_ok=True)
+            appended = append_diagnostics(target, times, time_attrs, rows, specs)
+        except (KeyError, OSError, ValueError) as e:
+            logger.error(f"Unable to compute the diagnostics of {path}: {e}")
+            continue
+        logger.info(f"Appended {appended} records of diagnostics to {target}")
+    return config
+
+
+# Settings of a PISM instance needed to stage its forcing in another process:
+STAGING_SETTINGS = [
+    "cache_dir",
+    "input_sources",
+    "linked_sources",
+    "rechunk_forcing",
+    "rechunk_forcing_complevel",
+    "rechunk_forcing_max_gb",
+    "subset_forcing",
+    "subset_forcing_max_gb",
+    "regrid_forcing",
+    "regrid_forcing_max_gb",
+]
+
+
+def _year(date):
+    """Returns the year of an esm_runscripts date (or its string), or ``None``"""
+    if date is None:
+        return None
+    if hasattr(date, "year"):
+        return float(date.year)
+    match = re.match(r"\s*(-?\d+)", str(date))
+    return float(match.group(1)) if match else None
+
+
+def _coupler_files(coupler_dict):
+    """Yields the file tag, path and ``kv_pairs`` of every coupler file"""
+    for coupler_spec in coupler_dict.values():
+        for coupler_model_opts in coupler_spec.values():
+            if not coupler_model_opts or "files" not in coupler_model_opts:
+                continue
+            for file_tag, file_path in coupler_model_opts["files"].items():
+                # Synthesized forcing is generated for each chunk instead:
+                if not isinstance(file_path, dict):
+                    yield file_tag, file_path, coupler_model_opts.get("kv_pairs")
+
+
+def _pism_prefetch_forcing(config, pism_key):
+    """Starts staging the forcing of the next chunk of one PISM instance"""
+    nyear = float(config["general"]["nyear"])
+    current_date, final_date = _year(config["general"].get("current_date")), _year(config["general"].get("final_date"))
+    if current_date is not None and final_date is not None and current_date + nyear >= final_date:
+        logger.info("This is the last chunk, there is no forcing to stage")
+        return
+    stage_root = _staging_root(config, pism_key)
+    if not stage_root:
+        return
+    expid = config["general"].get("expid", "pism")
+    current_year = float(config[pism_key]["current_year"])
+    next_year = current_year + nyear
+    remove_old_chunks(os.path.dirname(chunk_dir(stage_root, expid, pism_key, current_year)), current_year)
+    pism_config = {key: config[pism_key][key] for key in STAGING_SETTINGS if key in config[pism_key]}
+    pism_config["current_year"] = next_year
+    job = {
+        "config": {"general": {"nyear": nyear}, pism_key: pism_config},
+        "pism_key": pism_key,
+        "files": list(_coupler_files(config[pism_key].get("couplers", {}))),
+        "directory": chunk_dir(stage_root, expid, pism_key, next_year),
+        "settings": settings_key(config, pism_key),
+    }
+    if not job["files"]:
+        return
+    logger.info(f"Staging the forcing of the chunk starting in {next_year:g} in {job['directory']}")
+    start_staging(job, config[pism_key].get("prefetch_background", True))
+
+
+@logger.catch
+@instrumented
+def pism_prefetch_forcing(config):
+    """
+    Prepares the coupler files of the next chunk in the background.
+
+    For every PISM instance with ``prefetch_forcing: True``, the coupler files
+    of the chunk after this one (from ``current_year + general.nyear``) are
+    subset and regridded (if switched on), and copied to a staging directory,
+    by a separate process which keeps running while this chunk is queued and
+    runs. ``pism_set_couplers`` of the next chunk then uses the staged files
+    right away, provided the original files and settings did not change, and
+    otherwise prepares the files as usual. Nothing is staged after the last
+    chunk (``general.final_date``).
+
+    The staging directory is ``staging_dir``, or ``staging`` in the cache
+    directory. Set ``prefetch_background: False`` to stage in this process
+    instead.
+
+    Parameters
+    ----------
+    config : dict
+        The entire exp config
+
+    Returns
+    -------
+    config : dict
+        The entire exp config
+    """
+    for pism_key in _pism_keys(config):
+        if config[pism_key].get("prefetch_forcing"):
+            _pism_prefetch_forcing(config, pism_key)
+    return config
+
+
+def _pism_expand_ensemble(config, pism_key):
+    """Writes the commands and overrides files of the ensemble of one PISM instance"""
+    spec = config[pism_key].get("ensemble")
+    if not spec:
+        return config
+    if "execution_command_opts" not in config[pism_key]:
+        logger.error("pism_expand_ensemble has to run after pism_assemble_command")
+        sys.exit(1)
+    try:
+        members = expand_members(spec)
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f"Invalid ensemble specification: {e}")
+        sys.exit(1)
+    base_overrides = config[pism_key].get("overrides_kv_pairs", {})
+    if isinstance(base_overrides, list):
+        base_overrides = kv_list_to_dict_of_dicts(base_overrides)
+    uses_overrides = bool(base_overrides) or any(
+        member_sections(parameters)["overrides_kv_pairs"] for parameters in members
     )
+    if uses_overrides and config[pism_key].get("overrides_file"):
+        logger.error("Ensembles cannot vary overrides_kv_pairs together with an overrides_file")
+        sys.exit(1)
+    try:
+        # Loaded once and shared by all members:
+        pism_config_index = get_config_index(config[pism_key], _pism_config_file(config, pism_key))
+    except (KeyError, OSError):
+        if uses_overrides:
+            logger.error("Unable to open the PISM config file needed to check the overrides")
+            sys.exit(1)
+        pism_config_index = None
 
-    logger.critical("PISM will be run like this:")
-    logger.critical(command_to_run)
-    config[pism_key]["execution_command"] = command_to_run
+    errors = []
+    action = _validation_action(config, pism_key)
+    if pism_config_index and action:
+        kv_names = {key for parameters in members for key in member_sections(parameters)["kv_pairs"]}
+        option_errors = check_options(
+            sorted(kv_names), pism_config_index["options"], config[pism_key].get("known_options", [])
+        )
+        if action == "error":
+            errors += option_errors
+        else:
+            for error in option_errors:
+                logger.warning(error)
+    directory = spec.get("directory") or os.path.join(config[pism_key]["thisrun_config_dir"], "ensemble")
+    store_dir = (
+        get_cache_dir(config[pism_key], "overrides_store") if config[pism_key].get("overrides_store", True) else None
+    )
+    max_bytes = config[pism_key].get("overrides_store_max_mb", 64) * 1024 ** 2
+    executable = config[pism_key]["executable"]
+    conflicts = config[pism_key].get("command_conflicts", "last_wins")
+    jobs = []
+    manifest_members = []
+    for index, parameters in enumerate(members):
+        sections = member_sections(parameters)
+        name = member_id(index)
+        command = PismCommand.from_list(config[pism_key]["execution_command_opts"], conflicts)
+        for key, value in sections["kv_pairs"].items():
+            command.set(key, value)
+        for option in OUTPUT_OPTIONS:
+            if option in command:
+                command.set(option, output_name(command.get(option), name))
+        overrides_file = None
+        if uses_overrides:
+            attrs, member_errors = _check_overrides(
+                dict(base_overrides, **sections["overrides_kv_pairs"]), pism_config_index["parameters"]
+            )
+            errors += [f"{name}: {error}" for error in member_errors]
+            overrides_file = os.path.join(directory, name, "pism_overrides.nc")
+            jobs.append((overrides_file, attrs, store_dir, pism_config_index["content_hash"], max_bytes))
+            command.set("pism_override", overrides_file)
+        manifest_members.append(
+            {
+                "id": name,
+                "index": index,
+                "parameters": parameters,
+                "overrides_file": overrides_file,
+                "command": command.render(executable),
+                "digest": command.digest(executable),
+            }
+        )
+    if errors:
+        for error in errors:
+            logger.error(error)
+        sys.exit(1)
+
+    for job in jobs:
+        os.makedirs(os.path.dirname(job[0]), exist_ok=True)
+    os.makedirs(directory, exist_ok=True)
+    reused = write_all_overrides(jobs, config[pism_key].get("ensemble_workers", 8))
+    manifest_file = os.path.join(directory, MANIFEST_FILE)
+    write_json(
+        manifest_file,
+        {
+            "expid": config["general"].get("expid"),
+            "pism_key": pism_key,
+            "executable": executable,
+            "members": manifest_members,
+        },
+    )
+    with open(os.path.join(directory, COMMANDS_FILE), "w") as f:
+        f.writelines(f"{member['command']}\n" for member in manifest_members)
+    logger.info(
+        f"Prepared {len(members)} ensemble members in {directory} "
+        f"({sum(reused)} of {len(jobs)} overrides files reused)"
+    )
+    config[pism_key]["ensemble_manifest"] = manifest_file
+    return config
+
+
+@logger.catch
+@instrumented
+def pism_expand_ensemble(config):
+    """
+    Expands the experiment into an ensemble for a job array.
+
+    The ensemble is given in ``ensemble``, either as a grid of values, of
+    which every combination becomes a member::
 
+        pism:
+            ensemble:
+                grid:
+                    kv_pairs.sia_e: [1, 3, 5]
+                    overrides_kv_pairs.frontal_melt.given.period: [1, 2]
+
+    or as ranges from which ``samples`` members are drawn by Latin hypercube
+    sampling (reproducible with ``seed``)::
+
+        pism:
+            ensemble:
+                ranges:
+                    kv_pairs.sia_e: [1, 5]
+                samples: 100
+                seed: 42
+
+    Every member gets the command assembled by ``pism_assemble_command`` with
+    its own values, its own names for the output files (prefixed with the
+    member name), and its own overrides file. The overrides of all members are
+    checked against the PISM config index, which is loaded only once, and
+    written in ``ensemble_workers`` (default 8) processes. The members are
+    listed in ``ensemble_manifest.json`` in ``ensemble.directory`` (default:
+    ``ensemble`` in the config directory of the run), and their commands, one
+    per line, in ``commands.txt``.
+
+    Parameters
+    ----------
+    config : dict
+        The entire exp config
+
+    Returns
+    -------
+    config : dict
+        The entire exp config
+    """
+    return _for_each_instance(config, _pism_expand_ensemble)
+
+
+def _throughput_file(config, pism_key):
+    """Returns the throughput history of one PISM instance"""
+    if config[pism_key].get("throughput_file"):
+        return config[pism_key]["throughput_file"]
+    general = config["general"]
+    log_dir = general.get("experiment_log_dir") or general.get("experiment_dir") or "."
+    return os.path.join(log_dir, f"{general.get('expid', 'pism')}_{pism_key}_throughput.jsonl")
+
+
+def _pism_measure_throughput(config, pism_key):
+    """Records the throughput of the chunk of one PISM instance"""
+    files = _output_files(config, pism_key)
+    try:
+        measurement = measure_chunk(
+            ts_file=files.get("ts_file"),
+            restart_file=files.get("restart"),
+            log_file=config[pism_key].get("log_file"),
+            nproc=config[pism_key].get("nproc"),
+        )
+    except (OSError, ValueError) as e:
+        logger.error(f"Unable to measure the throughput of {pism_key}: {e}")
+        return config
+    if not measurement:
+        logger.warning(f"Unable to measure the throughput of {pism_key}, no run_stats or time axis found")
+        return config
+    general = config["general"]
+    record = dict(
+        measurement,
+        expid=general.get("expid"),
+        run_number=general.get("run_number"),
+        current_date=str(general.get("current_date")),
+        nyear=general.get("nyear"),
+        nproc=config[pism_key].get("nproc"),
+    )
+    history_file = _throughput_file(config, pism_key)
+    try:
+        append_history(history_file, record)
+    except OSError as e:
+        logger.error(f"Unable to write {history_file}: {e}")
+        return config
+    logger.info(f"{pism_key} ran at {measurement['years_per_hour']:.1f} model years per hour")
+    return config
+
+
+@logger.catch
+@instrumented
+def pism_measure_throughput(config):
+    """
+    Records how many model years per wall clock hour the chunk achieved.
+
+    Meant for the end of the compute recipe. The model years are taken from
+    the time axis of the ``ts_file`` (or, if set, from the time steps in the
+    PISM log ``log_file``), the wall clock hours from the ``run_stats`` which
+    PISM writes into its output. Every chunk appends one line of JSON to
+    ``<expid>_<instance>_throughput.jsonl`` in the log directory of the
+    experiment (or ``throughput_file``), which ``pism_adapt_nyear`` uses, and
+    which can be loaded with e.g. ``pandas.read_json(..., lines=True)`` for
+    capacity planning. Problems are logged without stopping the experiment.
+
+    Parameters
+    ----------
+    config : dict
+        The entire exp config
+
+    Returns
+    -------
+    config : dict
+        The entire exp config
+    """
+    return _for_each_instance(config, _pism_measure_throughput)
+
+
+@logger.catch
+@instrumented
+def pism_adapt_nyear(config):
+    """
+    Chooses the length of the chunk from the measured throughput.
+
+    With ``adaptive_nyear: True``, ``general.nyear`` is set so that the chunk
+    fills ``general.compute_time``, based on the median throughput of the last
+    ``adaptive_nyear_window`` (default 5) chunks recorded by
+    ``pism_measure_throughput``. A fraction ``adaptive_nyear_margin`` (default
+    0.1) of the wall time is kept free, and ``adaptive_nyear_overhead_minutes``
+    (default 0) are reserved for reading input and writing output. The length
+    is a multiple of ``adaptive_nyear_step`` (default 1), between
+    ``adaptive_nyear_min`` (default 1) and ``adaptive_nyear_max``, and does
+    not go beyond ``general.final_date``. Without measurements, e.g. for the
+    first chunk, ``general.nyear`` is kept. With several PISM instances, the
+    slowest one decides.
+
+    The step has to run before esm_runscripts derives the dates of the chunk
+    from ``general.nyear``, i.e. early in the prepare recipe.
+
+    Parameters
+    ----------
+    config : dict
+        The entire exp config
+
+    Returns
+    -------
+    config : dict
+        The entire exp config
+    """
+    general = config["general"]
+    choices = []
+    for pism_key in _pism_keys(config):
+        if not config[pism_key].get("adaptive_nyear"):
+            continue
+        if not general.get("compute_time"):
+            logger.error("adaptive_nyear needs general.compute_time")
+            sys.exit(1)
+        rates = recent_rates(
+            read_history(_throughput_file(config, pism_key)), config[pism_key].get("adaptive_nyear_window", 5)
+        )
+        nyear = choose_nyear(
+            rates,
+            parse_compute_time(general["compute_time"]),
+            margin=config[pism_key].get("adaptive_nyear_margin", 0.1),
+            overhead_hours=config[pism_key].get("adaptive_nyear_overhead_minutes", 0) / 60,
+            step=config[pism_key].get("adaptive_nyear_step", 1),
+            min_nyear=config[pism_key].get("adaptive_nyear_min", 1),
+            max_nyear=config[pism_key].get("adaptive_nyear_max"),
+        )
+        if nyear is None:
+            logger.info(f"No throughput measured for {pism_key} yet, keeping nyear {general.get('nyear')}")
+        else:
+            choices.append(nyear)
+    if not choices:
+        return config
+    nyear = min(choices)
+    current_year, final_year = _year(general.get("current_date")), _year(general.get("final_date"))
+    if current_year is not None and final_year is not None and final_year > current_year:
+        nyear = min(nyear, final_year - current_year)
+    nyear = int(nyear) if float(nyear).is_integer() else nyear
+    logger.info(f"Setting nyear to {nyear} (was {general.get('nyear')}) from the measured throughput")
+    general["nyear"] = nyear
     return config
@@ -0,0 +1,138 @@
+"""
+Pre-flight checks of input files, before a job is submitted.
+
+A missing or truncated forcing file would otherwise only be noticed once the
+job has waited in the queue and PISM has started. Files which passed the check
+are remembered in the cache directory (see :mod:`esm_pism.cache`) together
+with their size and modification time, so unchanged files are not checked
+again for every chunk. Looking files up in the cache and checking new or
+changed files runs in a thread pool. Since the NetCDF library cannot be used
+from several threads at once, only the ``stat`` calls overlap there; when many
+files need checking, their NetCDF headers are read in a process pool instead,
+which only pays off once it saves more than starting the processes costs.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from loguru import logger
+
+from .cache import file_stat_key, path_digest, read_json, write_json
+from .instrument import pool_map
+from .netcdf import open_dataset
+
+PREFLIGHT_VERSION = 1
+# Fewer files than this are checked in threads, more in processes:
+PROCESS_POOL_MIN_FILES = 16
+
+
+def _minimum_classic_size(nc):
+    """
+    Computes a lower bound of the size of a classic (NetCDF3) file from its
+    header. NetCDF3 files which are shorter than this are truncated; NetCDF4
+    (HDF5) files already fail to open in that case.
+    """
+    numrecs = max((len(dim) for dim in nc.dimensions.values() if dim.isunlimited()), default=0)
+    size = 0
+    for var in nc.variables.values():
+        values_per_record = 1
+        is_record_var = False
+        for dim_name in var.dimensions:
+            dim = nc.dimensions[dim_name]
+            if dim.isunlimited():
+                is_record_var = True
+            else:
+                values_per_record *= len(dim)
+        nbytes = values_per_record * var.dtype.itemsize
+        # Variables are padded to 4-byte boundaries:
+        nbytes += -nbytes % 4
+        size += nbytes * numrecs if is_record_var else nbytes
+    return size
+
+
+def check_file(path):
+    """
+    Checks that ``path`` exists, is readable and is a usable NetCDF file.
+
+    Parameters
+    ----------
+    path : str
+        The file to check
+
+    Returns
+    -------
+    error : str or None
+        A description of the problem, or ``None`` if the file is fine
+    """
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return f"{path} does not exist"
+    except OSError as e:
+        return f"{path} cannot be accessed: {e}"
+    if size == 0:
+        return f"{path} is empty"
+    if not os.access(path, os.R_OK):
+        return f"{path} is not readable"
+    try:
+        with open_dataset(path, "r") as nc:
+            if nc.data_model.startswith("NETCDF3"):
+                minimum_size = _minimum_classic_size(nc)
+                if size < minimum_size:
+                    return f"{path} is truncated: {size} bytes, but needs at least {minimum_size}"
+    except OSError as e:
+        return f"{path} cannot be opened as NetCDF: {e}"
+    return None
+
+
+def _cache_entry(path, cache_dir):
+    """
+    Returns the cache file and stat key of ``path``, and whether the file
+    passed the check before and has not changed since.
+    """
+    try:
+        stat_key = file_stat_key(path)
+    except OSError:
+        return None, None, False
+    if not cache_dir:
+        return None, stat_key, False
+    cache_file = os.path.join(cache_dir, f"{path_digest(path)}.json")
+    return cache_file, stat_key, read_json(cache_file) == dict(stat_key, version=PREFLIGHT_VERSION)
+
+
+def check_files(paths, cache_dir=None, max_workers=8):
+    """
+    Checks many files concurrently.
+
+    Parameters
+    ----------
+    paths : list of str
+        The files to check
+    cache_dir : str, optional
+        Where to remember files which passed
+    max_workers : int
+        Number of threads or processes, see :data:`PROCESS_POOL_MIN_FILES`
+
+    Returns
+    -------
+    errors : dict
+        Maps each path with a problem to the description of that problem
+    """
+    paths = list(dict.fromkeys(paths))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        entries = dict(zip(paths, pool.map(lambda path: _cache_entry(path, cache_dir), paths)))
+        to_check = [path for path, (_, _, unchanged) in entries.items() if not unchanged]
+        logger.debug(f"{len(paths) - len(to_check)} of {len(paths)} files are unchanged since their last check")
+        if len(to_check) < PROCESS_POOL_MIN_FILES or max_workers <= 1:
+            results = list(pool.map(check_file, to_check))
+    if len(to_check) >= PROCESS_POOL_MIN_FILES and max_workers > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(to_check))) as pool:
+            results = pool_map(pool, check_file, to_check)
+    errors = {}
+    for path, error in zip(to_check, results):
+        cache_file, stat_key, _ = entries[path]
+        if error:
+            errors[path] = error
+        elif cache_file:
+            # Only successful checks are remembered; problems may get fixed.
+            write_json(cache_file, dict(stat_key, version=PREFLIGHT_VERSION))
+    return errors
@@ -0,0 +1,125 @@
+"""
+Rechunking of forcing files for PISM's per-record reads.
+
+The ``given`` and ``pico`` couplers read their forcing one time record at a
+time. Files from post-processing are often written with chunks spanning many
+records (and compressed), so that every record PISM reads decompresses many
+more. :func:`rechunk_to` detects such layouts and provides a copy with one
+record per chunk, i.e. chunks of ``(1, y, x)``.
+
+Converted files are kept in a store in the cache directory, keyed by a
+fingerprint of the contents of the original, so every file is converted once,
+no matter how many chunks and experiments use it, or under which path. The
+fingerprint itself is remembered per path, size and modification time, so the
+file is only hashed again when it changes.
+"""
+import os
+
+from loguru import logger
+
+from .cache import content_fingerprint
+from .netcdf import copy_dataset, open_dataset
+from .store import publish, store_key
+from .subset import find_time_dimension
+
+RECHUNK_VERSION = 1
+
+
+def record_chunks(shape, dimensions, time_dim):
+    """
+    Returns chunk sizes holding one record of a time-dependent variable.
+
+    Returns
+    -------
+    chunks : list of int or None
+        ``None`` for variables without the time dimension
+    """
+    if time_dim not in dimensions:
+        return None
+    return [1 if dim == time_dim else max(size, 1) for size, dim in zip(shape, dimensions)]
+
+
+def poorly_chunked(path):
+    """
+    Lists the variables of ``path`` whose chunks span several records.
+
+    Only fields (with time and at least two more dimensions) count; contiguous
+    variables, as in NetCDF3 files, are read one record at a time anyway.
+
+    Returns
+    -------
+    variables : list of str
+    """
+    poor = []
+    with open_dataset(path, "r") as nc:
+        time_dim = find_time_dimension(nc)
+        if time_dim is None or not nc.data_model.startswith("NETCDF4"):
+            return poor
+        for name, var in nc.variables.items():
+            if var.ndim < 3 or time_dim not in var.dimensions:
+                continue
+            chunking = var.chunking()
+            if chunking != "contiguous" and chunking[var.dimensions.index(time_dim)] > 1:
+                poor.append(name)
+    return poor
+
+
+def write_rechunked(source, target, complevel=1):
+    """
+    Copies ``source`` to ``target`` with one record per chunk.
+
+    Time-dependent variables are compressed with ``complevel`` (0 switches
+    compression off) and copied one record at a time; all other variables and
+    all attributes are copied unchanged.
+    """
+    with open_dataset(source, "r") as src, open_dataset(target, "w", format="NETCDF4") as dst:
+        time_dim = find_time_dimension(src)
+
+        def variable_kwargs(name, var):
+            chunks = record_chunks(var.shape, var.dimensions, time_dim)
+            if chunks and var.ndim > 1:
+                return {"chunksizes": chunks, "zlib": complevel > 0, "complevel": complevel or 1, "shuffle": True}
+            return {}
+
+        copy_dataset(src, dst, time_dim, variable_kwargs=variable_kwargs)
+    return target
+
+
+def rechunk_to(source, store_dir, complevel=1, max_bytes=None):
+    """
+    Returns a version of ``source`` with one record per chunk, from the store
+    if possible.
+
+    Parameters
+    ----------
+    source : str
+        The forcing file
+    store_dir : str
+        Store for the fingerprints and rechunked files
+    complevel : int
+        zlib compression level of the rechunked file
+    max_bytes : int, optional
+        Size limit of the store
+
+    Returns
+    -------
+    path : str
+        The rechunked file, or ``source`` itself if its layout is fine
+    """
+    poor = poorly_chunked(source)
+    if not poor:
+        return source
+    logger.debug(f"{source} has chunks spanning several records in: {', '.join(poor)}")
+    rechunked, reused = publish(
+        os.path.join(store_dir, "files"),
+        store_key(
+            content=content_fingerprint(source, os.path.join(store_dir, "fingerprints")),
+            complevel=complevel,
+            rechunk_version=RECHUNK_VERSION,
+        ),
+        lambda path: write_rechunked(source, path, complevel),
+        name=os.path.basename(source),
+        max_bytes=max_bytes,
+    )
+    logger.info(f"Using {'existing' if reused else 'new'} rechunked file {rechunked} for {source}")
+    return rechunked
@@ -0,0 +1,221 @@
+"""
+Bilinear regridding of forcing files to the model grid.
+
+Forcing files on a different (rectilinear) grid than the model, e.g. at a
+coarser resolution, are interpolated onto the grid of the input file. Source
+and target must use the same projection; only the grid points differ.
+
+Since both grids are rectilinear, the interpolation weights are separable:
+for each target ``x`` (and ``y``), the two neighbouring source points and a
+weight. They are computed once per pair of grids and kept in the cache
+directory, keyed by the fingerprints of both grids (see
+:func:`esm_pism.forcing_index.grid_fingerprint`), so every chunk and ensemble
+member using the same grids reuses them. Files are regridded one time slice at
+a time, so memory use is bounded by a single field.
+
+Target points outside of the source grid are set to the fill value.
+"""
+import os
+
+from loguru import logger
+
+from .cache import file_stat_key
+from .forcing_index import X_NAMES, Y_NAMES, grid_fingerprint
+from .netcdf import copy_dataset, open_dataset
+from .store import publish, store_key
+from .subset import find_time_dimension
+
+REGRID_VERSION = 1
+DEFAULT_FILL_VALUE = 9.96921e36
+
+_memo = {}
+
+
+def read_grid(path):
+    """
+    Reads the coordinate axes of ``path``.
+
+    Returns
+    -------
+    grid : tuple or None
+        ``(x_name, y_name, x, y)``, or ``None`` if there is no grid
+    """
+    import numpy as np
+
+    with open_dataset(path, "r") as nc:
+        x_name = next((name for name in X_NAMES if name in nc.variables), None)
+        y_name = next((name for name in Y_NAMES if name in nc.variables), None)
+        if not x_name or not y_name:
+            return None
+        return x_name, y_name, np.asarray(nc.variables[x_name][:], "f8"), np.asarray(nc.variables[y_name][:], "f8")
+
+
+def axis_weights(source, target):
+    """
+    Computes 1D linear interpolation weights from ``source`` to ``target``.
+
+    Parameters
+    ----------
+    source : numpy.ndarray
+        The source axis, increasing or decreasing
+    target : numpy.ndarray
+        The target axis
+
+    Returns
+    -------
+    weights : dict
+        ``lower`` and ``upper`` (indices into ``source``), ``weight`` (of
+        ``upper``) and ``outside`` (target points outside of ``source``)
+    """
+    import numpy as np
+
+    order = np.argsort(source)
+    sorted_source = source[order]
+    # Allow for rounding of the outermost coordinates:
+    tolerance = 1e-6 * (sorted_source[-1] - sorted_source[0])
+    index = np.clip(np.searchsorted(sorted_source, target) - 1, 0, len(source) - 2)
+    weight = (target - sorted_source[index]) / (sorted_source[index + 1] - sorted_source[index])
+    outside = (target < sorted_source[0] - tolerance) | (target > sorted_source[-1] + tolerance)
+    return {
+        "lower": order[index],
+        "upper": order[index + 1],
+        "weight": np.clip(weight, 0.0, 1.0),
+        "outside": outside,
+    }
+
+
+def _write_weights(path, source_grid, target_grid):
+    import numpy as np
+
+    weights = {}
+    for axis, source, target in [("x", source_grid[2], target_grid[2]), ("y", source_grid[3], target_grid[3])]:
+        for name, values in axis_weights(source, target).items():
+            weights[f"{axis}_{name}"] = values
+    with open(path, "wb") as f:
+        np.savez(f, **weights)
+
+
+def get_weights(source_grid, target_grid, store_dir):
+    """
+    Returns the weights from ``source_grid`` to ``target_grid`` (see
+    :func:`read_grid`), from the store if possible.
+
+    Returns
+    -------
+    weights : dict
+        The result of :func:`axis_weights` per axis, with keys prefixed by
+        ``x_`` and ``y_``
+    """
+    import numpy as np
+
+    key = store_key(
+        source=grid_fingerprint(source_grid[2], source_grid[3]),
+        target=grid_fingerprint(target_grid[2], target_grid[3]),
+        method="bilinear",
+        regrid_version=REGRID_VERSION,
+    )
+    if key not in _memo:
+        entry, reused = publish(
+            store_dir, key, lambda path: _write_weights(path, source_grid, target_grid), suffix=".npz"
+        )
+        logger.debug(f"{'Reusing' if reused else 'Computed'} regridding weights {entry}")
+        with np.load(entry) as weights:
+            _memo[key] = dict(weights)
+    return _memo[key]
+
+
+def interpolate(field, weights):
+    """
+    Interpolates a field with dimensions ``(..., y, x)``.
+
+    Masked and NaN values propagate to the target points they influence.
+    """
+    import numpy as np
+
+    field = np.ma.filled(np.ma.asarray(field, dtype="f8"), np.nan)
+    wx = weights["x_weight"]
+    wy = weights["y_weight"][:, None]
+    rows_lower = field[..., weights["y_lower"], :]
+    rows_upper = field[..., weights["y_upper"], :]
+    rows = rows_lower * (1 - wy) + rows_upper * wy
+    result = rows[..., weights["x_lower"]] * (1 - wx) + rows[..., weights["x_upper"]] * wx
+    result[..., weights["y_outside"], :] = np.nan
+    result[..., weights["x_outside"]] = np.nan
+    return result
+
+
+def regrid_file(source, target, source_grid, target_grid, weights):
+    """
+    Writes ``source`` interpolated onto ``target_grid`` to ``target``.
+
+    Variables whose last two dimensions are the grid dimensions are
+    interpolated a chunk of records at a time. The coordinate axes are replaced by
+    those of the target grid; all other variables are copied unchanged.
+    """
+    import numpy as np
+
+    x_name, y_name = source_grid[:2]
+    with open_dataset(source, "r") as src, open_dataset(target, "w", format="NETCDF4") as dst:
+        x_dim, y_dim = src.variables[x_name].dimensions[0], src.variables[y_name].dimensions[0]
+        regridded = [name for name, var in src.variables.items() if var.dimensions[-2:] == (y_dim, x_dim)]
+        transforms = {name: lambda values: np.ma.masked_invalid(interpolate(values, weights)) for name in regridded}
+        transforms.update({x_name: lambda values: target_grid[2], y_name: lambda values: target_grid[3]})
+
+        def variable_kwargs(name, var):
+            if name not in transforms and (x_dim in var.dimensions or y_dim in var.dimensions):
+                logger.warning(f"Not copying {name} from {source}, it cannot be regridded")
+                return None
+            kwargs = {"zlib": var.ndim > 1}
+            if name in regridded and "_FillValue" not in var.__dict__ and var.dtype.kind == "f":
+                kwargs["fill_value"] = DEFAULT_FILL_VALUE
+            return kwargs
+
+        copy_dataset(
+            src,
+            dst,
+            find_time_dimension(src),
+            dimensions={x_dim: len(target_grid[2]), y_dim: len(target_grid[3])},
+            variable_kwargs=variable_kwargs,
+            transforms=transforms,
+        )
+    return target
+
+
+def regrid_to(source, target_grid, store_dir, max_bytes=None):
+    """
+    Returns a version of ``source`` on ``target_grid``, from the store if possible.
+
+    Parameters
+    ----------
+    source : str
+        The forcing file
+    target_grid : tuple
+        See :func:`read_grid`
+    store_dir : str
+        Store for the weights and regridded files
+    max_bytes : int, optional
+        Size limit of the store
+
+    Returns
+    -------
+    path : str
+        The regridded file, or ``source`` itself if it has no grid or is
+        already on ``target_grid``
+    """
+    source_grid = read_grid(source)
+    if not source_grid:
+        return source
+    source_fingerprint = grid_fingerprint(source_grid[2], source_grid[3])
+    target_fingerprint = grid_fingerprint(target_grid[2], target_grid[3])
+    if source_fingerprint == target_fingerprint:
+        return source
+    weights = get_weights(source_grid, target_grid, os.path.join(store_dir, "weights"))
+    regridded, reused = publish(
+        os.path.join(store_dir, "files"),
+        store_key(source=file_stat_key(source), target=target_fingerprint, regrid_version=REGRID_VERSION),
+        lambda path: regrid_file(source, path, source_grid, target_grid, weights),
+        name=os.path.basename(source),
+        max_bytes=max_bytes,
+    )
+    logger.info(f"Using {'existing' if reused else 'new'} regridded file {regridded} for {source}")
+    return regridded
@@ -0,0 +1,193 @@
+"""
+Staging of the forcing files of the next chunk in the background.
+
+Preparing the coupler files of a chunk (subsetting, regridding and copying
+them from slow project file systems) otherwise happens right before the job
+of that chunk is submitted. :func:`start_staging` instead prepares the files
+of the *next* chunk in a detached process, while the current chunk waits in
+the queue and runs. The next chunk then only checks the staged files against
+the manifest written by the staging process and uses them directly.
+
+Staged files live in ``<staging dir>/<expid>/<instance>/<start year>/``, next
+to a ``manifest.json`` which is only written once all files of the chunk are
+complete. A staged file is only used if its source file is unchanged, the
+settings which determine its contents (e.g. ``subset_forcing``) and the period
+of its coupler are the same, and a subset still covers the years the chunk
+needs.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from loguru import logger
+
+from .cache import file_stat_key, get_cache_dir, read_json, write_json
+from .forcing import coupler_period, forcing_window, model_input_file, prepare_forcing_file
+from .forcing_index import load_forcing_index
+from .store import link_or_copy, store_key
+
+STAGING_VERSION = 3
+MANIFEST_FILE = "manifest.json"
+JOB_FILE = "job.json"
+LOG_FILE = "staging.log"
+
+
+def chunk_dir(stage_root, expid, pism_key, start_year):
+    """Returns the staging directory of the chunk starting in ``start_year``"""
+    return os.path.join(stage_root, str(expid), pism_key, f"{float(start_year):g}")
+
+
+def settings_key(config, pism_key):
+    """
+    Hashes the settings of a PISM instance which determine the contents of
+    staged files.
+
+    The input file only matters for regridding, and only through its grid:
+    the next chunk starts from the restart written by this one, which is on
+    the same grid.
+    """
+    pism_config = config[pism_key]
+    input_grid = None
+    input_file = model_input_file(config, pism_key)
+    if pism_config.get("regrid_forcing") and input_file and os.path.exists(input_file):
+        grid = load_forcing_index(input_file, get_cache_dir(pism_config, "forcing_index")).get("grid")
+        input_grid = grid["fingerprint"] if grid else None
+    return store_key(
+        rechunk_forcing=bool(pism_config.get("rechunk_forcing")),
+        subset_forcing=bool(pism_config.get("subset_forcing")),
+        regrid_forcing=bool(pism_config.get("regrid_forcing")),
+        input_grid=input_grid,
+        staging_version=STAGING_VERSION,
+    )
+
+
+def read_staged(directory, file_tag, file_path, settings, window=None, period=None):
+    """
+    Returns the staged version of a coupler file, if it can be used.
+
+    Parameters
+    ----------
+    directory : str
+        See :func:`chunk_dir`
+    file_tag : str
+        The coupler option of the file, e.g. ``atmosphere_given_file``
+    file_path : str
+        The original file
+    settings : str
+        See :func:`settings_key`
+    window : tuple of float, optional
+        The years of forcing the chunk needs, see
+        :func:`esm_pism.forcing.forcing_window`. Subset files have to cover
+        them, e.g. after the chunk length changed.
+    period : tuple of float, optional
+        The period and reference year of the coupler, see
+        :func:`esm_pism.forcing.coupler_period`
+
+    Returns
+    -------
+    path : str or None
+    """
+    manifest = read_json(os.path.join(directory, MANIFEST_FILE))
+    if not manifest or manifest.get("settings") != settings:
+        return None
+    entry = manifest["files"].get(file_tag)
+    if not entry:
+        return None
+    if entry.get("period") != list(period or (None, None)):
+        return None
+    staged_window = entry.get("window")
+    if staged_window and (window is None or staged_window[0] > window[0] or staged_window[1] < window[1]):
+        return None
+    try:
+        if entry["source"] != file_stat_key(file_path) or os.path.getsize(entry["path"]) != entry["size"]:
+            return None
+    except OSError:
+        return None
+    return entry["path"]
+
+
+def stage_chunk(job):
+    """
+    Prepares the coupler files of one chunk and writes its manifest.
+
+    Parameters
+    ----------
+    job : dict
+        ``config`` (the ``general`` and PISM sections, with ``current_year``
+        set to the start of the chunk), ``pism_key``, ``files`` (a list of
+        the file tag, path and coupler ``kv_pairs`` of each file), and
+        ``directory`` (see :func:`chunk_dir`)
+    """
+    config, pism_key, directory = job["config"], job["pism_key"], job["directory"]
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    for file_tag, file_path, coupler_key_value in job["files"]:
+        source = file_stat_key(file_path)
+        prepared = prepare_forcing_file(file_path, coupler_key_value, config, pism_key)
+        # One directory per file tag, as several tags may share a base name:
+        staged = os.path.join(directory, file_tag, os.path.basename(prepared))
+        os.makedirs(os.path.dirname(staged), exist_ok=True)
+        link_or_copy(prepared, staged)
+        files[file_tag] = {
+            "source": source,
+            "path": staged,
+            "size": os.path.getsize(staged),
+            # Only subsets depend on the years of the chunk:
+            "window": (
+                list(forcing_window(coupler_key_value, config, pism_key))
+                if config[pism_key].get("subset_forcing")
+                else None
+            ),
+            "period": list(coupler_period(coupler_key_value)),
+        }
+        logger.info(f"Staged {file_path} as {staged}")
+    write_json(
+        os.path.join(directory, MANIFEST_FILE),
+        {"version": STAGING_VERSION, "settings": job["settings"], "files": files},
+    )
+
+
+def start_staging(job, background=True):
+    """
+    Runs :func:`stage_chunk`, by default in a detached process which outlives
+    the current one. Its output goes to ``staging.log`` in the chunk directory.
+    """
+    directory = job["directory"]
+    os.makedirs(directory, exist_ok=True)
+    if not background:
+        stage_chunk(job)
+        return None
+    job_file = os.path.join(directory, JOB_FILE)
+    write_json(job_file, job)
+    with open(os.path.join(directory, LOG_FILE), "a") as log:
+        return subprocess.Popen(
+            [sys.executable, "-m", "esm_pism.staging", job_file],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+
+def remove_old_chunks(instance_dir, current_year):
+    """Removes the staging directories of chunks before ``current_year``"""
+    if not os.path.isdir(instance_dir):
+        return
+    for name in os.listdir(instance_dir):
+        try:
+            start_year = float(name)
+        except ValueError:
+            continue
+        if start_year < float(current_year):
+            shutil.rmtree(os.path.join(instance_dir, name), ignore_errors=True)
+
+
+def main():
+    with open(sys.argv[1]) as f:
+        stage_chunk(json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Content-addressed store of generated files.
+
+Files are stored under the hash of everything that determines their contents,
+so identical requests (e.g. the same ``overrides_kv_pairs`` for every chunk of
+an experiment, or for every member of an ensemble) can reuse a file which was
+already written, by linking it into the run directory instead of generating it
+again.
+
+Entries are published atomically, so several experiments can fill and use a
+store at the same time. The store is kept below a size limit by removing the
+least recently used entries.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+from loguru import logger
+
+from .cache import tmp_path
+from .instrument import record_file
+
+STORE_VERSION = 1
+
+
+def store_key(**inputs):
+    """
+    Hashes the inputs which determine the content of a stored file.
+
+    Parameters
+    ----------
+    **inputs :
+        JSON-serializable values; the order of dictionary keys is irrelevant.
+
+    Returns
+    -------
+    key : str
+        A hex digest
+    """
+    normalized = json.dumps(dict(inputs, store_version=STORE_VERSION), sort_keys=True, default=str)
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def link_or_copy(source, target):
+    """
+    Places ``source`` at ``target`` via a hard link, or a copy as fallback.
+
+    An existing ``target`` is replaced atomically.
+    """
+    record_file(target)
+    tmp_target = tmp_path(target)
+    try:
+        try:
+            os.link(source, tmp_target)
+        except OSError:
+            # E.g. a different filesystem:
+            shutil.copy2(source, tmp_target)
+        os.replace(tmp_target, target)
+    finally:
+        if os.path.lexists(tmp_target):
+            os.remove(tmp_target)
+    return target
+
+
+def _entry_path(store_dir, key, suffix, name):
+    if name:
+        # Keep a meaningful file name, e.g. for files referenced by base name:
+        return os.path.join(store_dir, key[:2], key, name)
+    return os.path.join(store_dir, key[:2], f"{key}{suffix}")
+
+
+def publish(store_dir, key, writer, suffix=".nc", name=None, max_bytes=None):
+    """
+    Returns the path of the entry stored under ``key``, creating it if needed.
+
+    Parameters
+    ----------
+    store_dir : str
+        Root directory of the store
+    key : str
+        See :func:`store_key`
+    writer : callable
+        Called with a path to generate the file if it is not stored yet
+    suffix : str
+        File name suffix of the entries
+    name : str, optional
+        File name of the entry, instead of the key and ``suffix``
+    max_bytes : int, optional
+        Size limit of the store, enforced after adding a new entry
+
+    Returns
+    -------
+    entry : str
+        Path of the stored file
+    reused : bool
+        Whether an existing entry was used
+    """
+    entry = _entry_path(store_dir, key, suffix, name)
+    try:
+        # Mark as recently used for eviction:
+        os.utime(entry)
+        logger.debug(f"Reusing stored file {entry}")
+        return entry, True
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp_entry = tmp_path(entry)
+    try:
+        writer(tmp_entry)
+        # Concurrent writers produce the same content, so whoever comes last
+        # simply wins:
+        os.replace(tmp_entry, entry)
+    finally:
+        if os.path.exists(tmp_entry):
+            os.remove(tmp_entry)
+    logger.debug(f"Stored new file {entry}")
+    if max_bytes is not None:
+        evict(store_dir, max_bytes, keep=entry)
+    return entry, False
+
+
+def fetch(store_dir, key, target, writer, suffix=".nc", max_bytes=None):
+    """
+    Places the file stored under ``key`` at ``target``, creating it if needed.
+
+    Parameters
+    ----------
+    store_dir : str
+        Root directory of the store
+    key : str
+        See :func:`store_key`
+    target : str
+        Where the file is needed
+    writer : callable
+        Called with a path to generate the file if it is not stored yet
+    suffix : str
+        File name suffix of the entries
+    max_bytes : int, optional
+        Size limit of the store, enforced after adding a new entry
+
+    Returns
+    -------
+    reused : bool
+        Whether an existing entry was used
+    """
+    entry, reused = publish(store_dir, key, writer, suffix=suffix, max_bytes=max_bytes)
+    try:
+        link_or_copy(entry, target)
+    except FileNotFoundError:
+        # Evicted by someone else in the meantime
+        tmp_target = tmp_path(target)
+        writer(tmp_target)
+        os.replace(tmp_target, target)
+    return reused
+
+
+def evict(store_dir, max_bytes, keep=None):
+    """
+    Removes the least recently used entries until the store fits ``max_bytes``.
+
+    Links which were already made into run directories are unaffected.
+
+    Parameters
+    ----------
+    store_dir : str
+        Root directory of the store
+    max_bytes : int
+        Size limit
+    keep : str, optional
+        An entry which must not be removed (e.g. the one just added)
+    """
+    entries = []
+    for dirpath, _, filenames in os.walk(store_dir):
+        for filename in filenames:
+            if filename.endswith(".tmp"):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            logger.debug(f"Evicted {path} from the store")
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,178 @@
+"""
+Temporal subsetting of forcing files to the years of one chunk.
+
+Transient forcing files often cover many thousands of years, while each chunk
+only needs ``general.nyear`` of them. The subsetter extracts the records of the
+chunk (including the records just before and after it, so PISM can
+interpolate at the chunk boundaries) into a new file. Data is copied one record at a time, so memory
+use is bounded by a single time slice, no matter how large the source is.
+
+For periodic forcing (``*_period`` kv_pairs of the coupler), PISM wraps the
+model time into one period starting at the ``*_reference_year``. In that case,
+the whole period is kept, since any part of it may be needed.
+"""
+import re
+
+from .netcdf import copy_dataset, open_dataset
+
+# Length of a year in days, per CF calendar:
+DAYS_PER_YEAR = {
+    "365_day": 365.0,
+    "noleap": 365.0,
+    "360_day": 360.0,
+    "366_day": 366.0,
+    "all_leap": 366.0,
+}
+DEFAULT_DAYS_PER_YEAR = 365.2425
+
+SECONDS_PER_UNIT = {
+    "second": 1.0,
+    "minute": 60.0,
+    "hour": 3600.0,
+    "day": 86400.0,
+}
+
+
+def find_time_dimension(nc):
+    """Returns the name of the time dimension of ``nc``, or ``None``"""
+    for name, dim in nc.dimensions.items():
+        if dim.isunlimited():
+            return name
+    if "time" in nc.dimensions:
+        return "time"
+    return None
+
+
+def year_to_time(year, units, calendar="standard"):
+    """
+    Converts a model year into a value on a CF time axis.
+
+    The conversion is approximate for calendars with leap years (and ignores
+    the month and day of the reference date), which is covered by keeping the
+    records just outside of a window.
+
+    Parameters
+    ----------
+    year : float
+        The model year
+    units : str
+        CF units of the time axis, e.g. ``"days since 1-1-1"``
+    calendar : str
+        CF calendar of the time axis
+
+    Returns
+    -------
+    time : float
+        The value on the time axis
+    """
+    match = re.match(r"\s*(\w+?)s?\s+since\s+(-?\d+)", units)
+    if not match:
+        raise ValueError(f"Unsupported time units: {units}")
+    unit, reference_year = match.group(1).lower(), int(match.group(2))
+    days_per_year = DAYS_PER_YEAR.get(str(calendar).lower(), DEFAULT_DAYS_PER_YEAR)
+    years = year - reference_year
+    if unit in ["year", "yr", "a"]:
+        return years
+    if unit == "month":
+        return years * 12
+    if unit in SECONDS_PER_UNIT:
+        return years * days_per_year * 86400.0 / SECONDS_PER_UNIT[unit]
+    raise ValueError(f"Unsupported time units: {units}")
+
+
+def time_to_year(time, units, calendar="standard"):
+    """Converts a value on a CF time axis into a model year, see :func:`year_to_time`"""
+    origin = year_to_time(0, units, calendar)
+    return (time - origin) / (year_to_time(1, units, calendar) - origin)
+
+
+def select_records(times, start, end):
+    """
+    Finds the records needed to cover ``[start, end]``.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        The (increasing) time axis
+    start, end : float
+        The window, in the units of ``times``
+
+    Returns
+    -------
+    first, last : int
+        Indices of the first and last needed record (inclusive)
+    """
+    import numpy as np
+
+    first = max(int(np.searchsorted(times, start, side="right")) - 1, 0)
+    last = min(int(np.searchsorted(times, end, side="left")), len(times) - 1)
+    return first, last
+
+
+def needed_years(start_year, nyear, period=None, reference_year=0):
+    """
+    Returns the model years a chunk needs from a forcing file.
+
+    Parameters
+    ----------
+    start_year : float
+        First year of the chunk
+    nyear : float
+        Length of the chunk in years
+    period : float, optional
+        Period of periodic forcing, in years
+    reference_year : float
+        Start of the period
+
+    Returns
+    -------
+    start, end : float
+        The years needed
+    """
+    if period:
+        return reference_year, reference_year + period
+    return start_year, start_year + nyear
+
+
+def write_subset(source, target, first, last):
+    """
+    Copies records ``first`` to ``last`` (inclusive) of ``source`` to ``target``.
+
+    All variables without a time dimension, and all attributes, are copied
+    unchanged. Time-dependent variables are copied a chunk of records at a
+    time, see :func:`esm_pism.netcdf.copy_values`.
+    """
+    with open_dataset(source, "r") as src, open_dataset(target, "w", format=src.data_model) as dst:
+        copy_dataset(src, dst, find_time_dimension(src), records=range(first, last + 1))
+    return target
+
+
+def plan_subset(source, start_year, end_year):
+    """
+    Determines which records of ``source`` cover the model years given.
+
+    Returns
+    -------
+    records : tuple of int or None
+        ``(first, last)``, or ``None`` if the file has no time axis or all of
+        its records are needed anyway
+    """
+    import numpy as np
+
+    with open_dataset(source, "r") as nc:
+        time_dim = find_time_dimension(nc)
+        if time_dim is None or time_dim not in nc.variables:
+            return None
+        time = nc.variables[time_dim]
+        times = time[:]
+        units = getattr(time, "units", "years since 0-1-1")
+        calendar = getattr(time, "calendar", "standard")
+    first, last = select_records(
+        np.asarray(times, dtype="f8"),
+        year_to_time(start_year, units, calendar),
+        year_to_time(end_year, units, calendar),
+    )
+    if first == 0 and last == len(times) - 1:
+        return None
+    return first, last
+
@@ -0,0 +1,267 @@
+"""
+Synthesis of transient forcing from a climatology, anomalies and an index.
+
+Transient forcing of long (e.g. glacial cycle) runs is often a combination of
+a few climate states, weighted by a scalar index over time:
+
+    forcing(t) = base + w_1(t) * anomaly_1 + ... + w_n(t) * anomaly_n
+
+Rather than keeping the precomputed forcing of the whole run, which can be
+hundreds of GB, :func:`synthesize_chunk` generates only the years of the
+current chunk from the small input files, one output record at a time.
+
+The base climatology and the anomalies have the same variables and grid, and
+either no time axis or the same number of records per year (e.g. 12 for a
+monthly climatology), which are repeated every generated year. The index is a
+NetCDF file with a time axis and one variable per anomaly, or a text file
+whose first column is the model year and the further columns are the weights.
+The weights are linearly interpolated in time.
+"""
+import contextlib
+import os
+
+from loguru import logger
+
+from .cache import file_stat_key
+from .netcdf import copy_dataset, open_dataset
+from .store import publish, store_key
+from .subset import find_time_dimension, time_to_year, year_to_time
+
+SYNTHESIS_VERSION = 1
+DEFAULT_TIME_UNITS = "days since 1-1-1"
+DEFAULT_CALENDAR = "365_day"
+
+
+def read_index(path, variables=None):
+    """
+    Reads the weights of the anomalies over time.
+
+    Parameters
+    ----------
+    path : str
+        NetCDF or text file, see the module
+    variables : list of str, optional
+        For NetCDF files, the variable holding the weights of each anomaly.
+        By default, all variables along the time axis, in order
+
+    Returns
+    -------
+    years : numpy.ndarray
+        Model years, increasing
+    weights : numpy.ndarray
+        One row per year, one column per anomaly
+    """
+    import numpy as np
+
+    if os.path.splitext(path)[1] not in [".nc", ".nc4", ".cdf"]:
+        table = np.loadtxt(path, ndmin=2)
+        years, weights = table[:, 0], table[:, 1:]
+    else:
+        with open_dataset(path, "r") as nc:
+            time_dim = find_time_dimension(nc)
+            if time_dim is None or time_dim not in nc.variables:
+                raise ValueError(f"The index {path} has no time axis")
+            time = nc.variables[time_dim]
+            years = time_to_year(
+                np.asarray(time[:], "f8"), time.units, getattr(time, "calendar", DEFAULT_CALENDAR)
+            )
+            if not variables:
+                bounds = getattr(time, "bounds", None)
+                variables = [
+                    name
+                    for name, var in nc.variables.items()
+                    if var.dimensions == (time_dim,) and name not in [time_dim, bounds]
+                ]
+            weights = np.stack([np.asarray(nc.variables[name][:], "f8") for name in variables], axis=1)
+    order = np.argsort(years)
+    return years[order], weights[order]
+
+
+def chunk_years(start_year, end_year, step=1):
+    """Returns the years generated for a chunk, from ``start_year`` up to and including ``end_year``"""
+    import numpy as np
+
+    return np.arange(start_year, end_year + step / 2, step)
+
+
+def weights_at(years, index_years, index_weights):
+    """
+    Interpolates the weights of every anomaly to ``years``.
+
+    Raises
+    ------
+    ValueError
+        If ``years`` are not covered by the index
+    """
+    import numpy as np
+
+    if years[0] < index_years[0] or years[-1] > index_years[-1]:
+        raise ValueError(
+            f"The index covers the years {index_years[0]:g} to {index_years[-1]:g}, "
+            f"but {years[0]:g} to {years[-1]:g} are needed"
+        )
+    return np.stack([np.interp(years, index_years, column) for column in index_weights.T], axis=1)
+
+
+def _year_fractions(nc, time_dim):
+    """Returns the position within the year of each record of a climatology"""
+    import numpy as np
+
+    if time_dim is None:
+        return np.zeros(1)
+    if time_dim not in nc.variables:
+        records = len(nc.dimensions[time_dim])
+        return np.arange(records) / records
+    time = nc.variables[time_dim]
+    years = time_to_year(np.asarray(time[:], "f8"), time.units, getattr(time, "calendar", DEFAULT_CALENDAR))
+    return years - np.floor(years)
+
+
+def write_synthesis(base, anomalies, weights, years, target, anomalies_are_states=False, variables=None):
+    """
+    Writes the forcing of ``years`` to ``target``.
+
+    Parameters
+    ----------
+    base : str
+        The base climatology
+    anomalies : list of str
+        The anomaly files, one per column of ``weights``
+    weights : numpy.ndarray
+        Weights of each anomaly (columns) for each year (rows)
+    years : numpy.ndarray
+        The generated years
+    target : str
+        The new file
+    anomalies_are_states : bool
+        Whether ``anomalies`` are full climate states, from which ``base`` is
+        subtracted
+    variables : list of str, optional
+        The fields to synthesize. By default, all floating point fields of
+        ``base`` (along its time axis, if it has one) which are in every
+        anomaly file; all other variables are copied from ``base``
+    """
+    import numpy as np
+
+    with contextlib.ExitStack() as stack:
+        src = stack.enter_context(open_dataset(base, "r"))
+        anomaly_ncs = [stack.enter_context(open_dataset(path, "r")) for path in anomalies]
+        dst = stack.enter_context(open_dataset(target, "w", format="NETCDF4"))
+        time_dim = find_time_dimension(src)
+        fractions = _year_fractions(src, time_dim)
+        src_time = src.variables.get(time_dim) if time_dim else None
+        units = getattr(src_time, "units", DEFAULT_TIME_UNITS)
+        calendar = getattr(src_time, "calendar", DEFAULT_CALENDAR)
+        out_time_dim = time_dim or "time"
+        if variables is None:
+            variables = [
+                name
+                for name, var in src.variables.items()
+                if var.ndim >= 2
+                and var.dtype.kind == "f"
+                and (time_dim is None or time_dim in var.dimensions)
+                and all(name in nc.variables for nc in anomaly_ncs)
+            ]
+
+        def variable_kwargs(name, var):
+            # Time-dependent variables (e.g. time bounds) do not apply to the
+            # generated axis; the synthesized fields are written below:
+            if name in variables or time_dim in var.dimensions:
+                return None
+            return {}
+
+        dimensions = {name: len(dim) for name, dim in src.dimensions.items()}
+        dimensions[out_time_dim] = None
+        copy_dataset(src, dst, dimensions=dimensions, variable_kwargs=variable_kwargs)
+        if out_time_dim not in dst.dimensions:
+            dst.createDimension(out_time_dim, None)
+        time = dst.createVariable(out_time_dim, "f8", (out_time_dim,))
+        time.setncatts({"units": units, "calendar": calendar, "axis": "T"})
+        time[:] = [year_to_time(year + fraction, units, calendar) for year in years for fraction in fractions]
+
+        for name in variables:
+            var = src.variables[name]
+            spatial = [dim for dim in var.dimensions if dim != time_dim]
+            shape = [len(src.dimensions[dim]) for dim in spatial]
+            out = dst.createVariable(
+                name,
+                var.datatype,
+                (out_time_dim, *spatial),
+                fill_value=var.__dict__.get("_FillValue"),
+                zlib=True,
+                chunksizes=[1] + shape,
+            )
+            out.setncatts({k: v for k, v in var.__dict__.items() if k != "_FillValue"})
+            # Shape (records per year, ...); the inputs are small:
+            records = len(fractions) if time_dim in var.dimensions else 1
+            base_values = np.ma.filled(np.ma.asarray(var[...], dtype="f8"), np.nan).reshape(records, *shape)
+            anomaly_values = []
+            for path, nc in zip(anomalies, anomaly_ncs):
+                if name not in nc.variables:
+                    raise ValueError(f"{name} is missing in the anomaly {path}")
+                values = np.ma.filled(np.ma.asarray(nc.variables[name][...], dtype="f8"), np.nan)
+                if values.size != base_values.size:
+                    raise ValueError(f"{name} in {path} does not match the shape of {base}")
+                values = values.reshape(base_values.shape)
+                anomaly_values.append(values - base_values if anomalies_are_states else values)
+            anomaly_values = np.stack(anomaly_values) if anomaly_values else np.zeros((0,) + base_values.shape)
+            record = 0
+            for year_weights in weights:
+                # All records of the year at once:
+                values = base_values + np.tensordot(year_weights, anomaly_values, axes=1)
+                for fraction_index in range(len(fractions)):
+                    out[record] = np.ma.masked_invalid(values[fraction_index % records])
+                    record += 1
+    return target
+
+
+def synthesize_chunk(spec, start_year, end_year, store_dir, name, max_bytes=None):
+    """
+    Returns the synthesized forcing of a chunk, from the store if possible.
+
+    Parameters
+    ----------
+    spec : dict
+        ``base``, ``anomalies`` (or ``states``), ``index``, and optionally
+        ``index_variables``, ``variables`` (see :func:`write_synthesis`) and
+        ``step`` (years between generated years, default 1)
+    start_year, end_year : float
+        The chunk
+    store_dir : str
+        Store for the generated files
+    name : str
+        File name of the generated file
+    max_bytes : int, optional
+        Size limit of the store
+
+    Returns
+    -------
+    path : str
+    """
+    states = "states" in spec
+    anomalies = list(spec["states"] if states else spec.get("anomalies", []))
+    step = float(spec.get("step", 1))
+    years = chunk_years(start_year, end_year, step)
+    index_years, index_weights = read_index(spec["index"], spec.get("index_variables"))
+    if index_weights.shape[1] != len(anomalies):
+        raise ValueError(f"The index has {index_weights.shape[1]} weights, but there are {len(anomalies)} anomalies")
+    weights = weights_at(years, index_years, index_weights)
+    key = store_key(
+        base=file_stat_key(spec["base"]),
+        anomalies=[file_stat_key(path) for path in anomalies],
+        states=states,
+        index=file_stat_key(spec["index"]),
+        index_variables=spec.get("index_variables"),
+        variables=spec.get("variables"),
+        years=[float(years[0]), float(years[-1]), step],
+        synthesis_version=SYNTHESIS_VERSION,
+    )
+    path, reused = publish(
+        store_dir,
+        key,
+        lambda path: write_synthesis(spec["base"], anomalies, weights, years, path, states, spec.get("variables")),
+        name=name,
+        max_bytes=max_bytes,
+    )
+    logger.info(f"Using {'existing' if reused else 'new'} synthesized forcing {path} for {start_year:g} to {end_year:g}")
+    return path
@@ -0,0 +1,194 @@
+"""
+Measured throughput of PISM and the chunk length it allows.
+
+After each chunk, the model years simulated and the wall clock hours used are
+read from the output of the chunk and appended to a history file (one line of
+JSON per chunk). The model years come from the time axis of the time series
+file, the wall clock hours from the ``run_stats`` variable PISM writes into
+its output files. If the time series file is missing, the model years are
+taken from the time step lines (``S  <year>: ...``) of the PISM log.
+
+From the recent history, :func:`choose_nyear` proposes the chunk length which
+fills the wall time of a job, less a safety margin.
+"""
+import json
+import math
+import os
+import re
+import statistics
+
+from loguru import logger
+
+from .netcdf import open_dataset
+from .subset import find_time_dimension, time_to_year
+
+# PISM's time step lines, e.g. "S 1234.500:     0.25000  ...":
+STEP_LINE = re.compile(r"^\s*[A-Za-z$]*\s+(-?\d+(?:\.\d+)?):\s")
+
+
+def parse_compute_time(compute_time):
+    """
+    Converts a wall time like ``"08:00:00"`` or ``"1-00:00:00"`` to hours.
+
+    Plain numbers are taken as minutes, as by SLURM.
+    """
+    text = str(compute_time).strip()
+    days = 0
+    if "-" in text:
+        days, text = text.split("-", 1)
+    parts = [float(part) for part in text.split(":")]
+    if len(parts) == 1:
+        hours = parts[0] / 60
+    else:
+        parts = ([0.0] * (3 - len(parts)) + parts)[-3:]
+        hours = parts[0] + parts[1] / 60 + parts[2] / 3600
+    return float(days) * 24 + hours
+
+
+def read_run_stats(path):
+    """Returns the attributes of PISM's ``run_stats`` variable in ``path``, if any"""
+    with open_dataset(path, "r") as nc:
+        if "run_stats" not in nc.variables:
+            return {}
+        return dict(nc.variables["run_stats"].__dict__)
+
+
+def read_model_years(path):
+    """Returns the model years covered by the time axis of ``path``, or ``None``"""
+    import numpy as np
+
+    with open_dataset(path, "r") as nc:
+        time_dim = find_time_dimension(nc)
+        if time_dim is None or time_dim not in nc.variables or len(nc.variables[time_dim]) < 2:
+            return None
+        time = nc.variables[time_dim]
+        calendar = getattr(time, "calendar", "standard")
+        bounds = nc.variables.get(getattr(time, "bounds", None))
+        if bounds is not None:
+            years = time_to_year(np.asarray([bounds[0, 0], bounds[-1, -1]], "f8"), time.units, calendar)
+            return float(years[-1] - years[0])
+        # Without bounds, every record stands for one interval of the axis:
+        years = time_to_year(np.asarray(time[[0, -1]], "f8"), time.units, calendar)
+        return float(years[-1] - years[0]) * len(time) / (len(time) - 1)
+
+
+def parse_log(path):
+    """Returns the model years between the first and last time step of a PISM log, or ``None``"""
+    first = last = None
+    with open(path, errors="replace") as f:
+        for line in f:
+            match = STEP_LINE.match(line)
+            if match:
+                year = float(match.group(1))
+                first = year if first is None else first
+                last = year
+    return None if first is None else last - first
+
+
+def measure_chunk(ts_file=None, restart_file=None, log_file=None, nproc=None):
+    """
+    Measures the throughput of a finished chunk.
+
+    Parameters
+    ----------
+    ts_file, restart_file, log_file : str, optional
+        Output of the chunk; missing files are skipped
+    nproc : int, optional
+        Number of MPI ranks, to derive the wall time from the processor hours
+        if PISM did not write the wall time
+
+    Returns
+    -------
+    measurement : dict or None
+        ``model_years``, ``wall_hours`` and ``years_per_hour``, or ``None`` if
+        either could not be determined
+    """
+    model_years = wall_hours = None
+    for path in [ts_file, restart_file]:
+        if not path or not os.path.exists(path):
+            continue
+        stats = read_run_stats(path)
+        if wall_hours is None and "wall_clock_hours" in stats:
+            wall_hours = float(stats["wall_clock_hours"])
+        elif wall_hours is None and "processor_hours" in stats and nproc:
+            wall_hours = float(stats["processor_hours"]) / nproc
+        if model_years is None and path == ts_file:
+            model_years = read_model_years(path)
+    if model_years is None and log_file and os.path.exists(log_file):
+        model_years = parse_log(log_file)
+    if not model_years or not wall_hours:
+        return None
+    return {"model_years": model_years, "wall_hours": wall_hours, "years_per_hour": model_years / wall_hours}
+
+
+def read_history(path):
+    """Reads all measurements from a history file, skipping broken lines"""
+    history = []
+    if not os.path.exists(path):
+        return history
+    with open(path) as f:
+        for line in f:
+            try:
+                history.append(json.loads(line))
+            except ValueError:
+                continue
+    return history
+
+
+def append_history(path, record):
+    """
+    Appends a measurement to a history file.
+
+    A chunk which was already recorded (e.g. after a resubmission) is
+    recorded again, and later measurements of a chunk replace earlier ones
+    when the history is used.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def recent_rates(history, window=5):
+    """Returns the throughput of the last ``window`` chunks, one value per chunk"""
+    by_chunk = {}
+    for record in history:
+        by_chunk[record.get("run_number", len(by_chunk))] = record["years_per_hour"]
+    return list(by_chunk.values())[-window:]
+
+
+def choose_nyear(rates, wall_hours, margin=0.1, overhead_hours=0.0, step=1, min_nyear=1, max_nyear=None):
+    """
+    Chooses the chunk length which fills the wall time of a job.
+
+    Parameters
+    ----------
+    rates : list of float
+        Recent model years per wall clock hour; the median is used, so a
+        single slow chunk does not shorten every following one
+    wall_hours : float
+        Wall time of a job
+    margin : float
+        Fraction of the wall time kept free
+    overhead_hours : float
+        Time spent outside of time stepping, e.g. reading input and writing
+        the restart
+    step : float
+        The chunk length is a multiple of this
+    min_nyear, max_nyear : float, optional
+        Bounds of the chunk length
+
+    Returns
+    -------
+    nyear : float or None
+        ``None`` if there are no measurements
+    """
+    if not rates:
+        return None
+    usable_hours = wall_hours * (1 - margin) - overhead_hours
+    nyear = math.floor(statistics.median(rates) * usable_hours / step) * step
+    if max_nyear:
+        nyear = min(nyear, max_nyear)
+    nyear = max(nyear, min_nyear)
+    if nyear == min_nyear and statistics.median(rates) * usable_hours < min_nyear:
+        logger.warning(f"Even {min_nyear} model years may not fit into {wall_hours:g} hours")
+    return nyear
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.bootstrap`."""
+
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from esm_pism import bootstrap, plugin
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+# Stands in for pismr: copies -i to -o and counts its calls.
+FAKE_PISM = """
+import shutil
+import sys
+
+args = sys.argv[1:]
+with open(args[0], "a") as f:
+    f.write(" ".join(args[1:]) + "\\n")
+shutil.copy(args[args.index("-i") + 1], args[args.index("-o") + 1])
+"""
+
+
+class TestBootstrap(unittest.TestCase):
+    """Tests for `esm_pism.bootstrap`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store_dir = os.path.join(self.tmpdir.name, "store")
+        self.spinup = os.path.join(self.tmpdir.name, "spinup.nc")
+        with open(self.spinup, "w") as f:
+            f.write("spinup")
+        self.fake_pism = os.path.join(self.tmpdir.name, "fake_pism.py")
+        with open(self.fake_pism, "w") as f:
+            f.write(FAKE_PISM)
+        self.calls = os.path.join(self.tmpdir.name, "calls.txt")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_is_bootstrap_option(self):
+        self.assertTrue(bootstrap.is_bootstrap_option("-Mx"))
+        self.assertTrue(bootstrap.is_bootstrap_option("bootstrapping.defaults.geothermal_flux"))
+        self.assertFalse(bootstrap.is_bootstrap_option("sia_e"))
+
+    def test_concurrent_runs_bootstrap_once(self):
+        built = []
+
+        def build(path):
+            built.append(path)
+            with open(path, "w") as f:
+                f.write("state")
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(bootstrap.cached_state(self.store_dir, "ab" * 32, build, poll=0.01))
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(built), 1)
+        self.assertEqual(len({state for state, _ in results}), 1)
+        self.assertEqual(sorted(reused for _, reused in results), [False, True, True, True])
+        self.assertFalse(os.path.exists(f"{results[0][0]}.lock"))
+
+    def test_stale_lock_is_taken_over(self):
+        lock_file = os.path.join(self.tmpdir.name, "state.lock")
+        open(lock_file, "w").close()
+        self.assertIsNone(bootstrap.try_lock(lock_file, stale_seconds=60))
+        os.utime(lock_file, (0, 0))
+        token = bootstrap.try_lock(lock_file, stale_seconds=60)
+        self.assertTrue(token)
+        # The previous holder must not remove the lock it lost:
+        bootstrap.release_lock(lock_file, "someone else")
+        self.assertTrue(os.path.exists(lock_file))
+        bootstrap.release_lock(lock_file, token)
+        self.assertFalse(os.path.exists(lock_file))
+        bootstrap.release_lock(lock_file, token)
+
+    def test_long_build_keeps_lock(self):
+        built = []
+
+        def build(path):
+            built.append(path)
+            time.sleep(0.5)
+            with open(path, "w") as f:
+                f.write("state")
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    bootstrap.cached_state(self.store_dir, "cd" * 32, build, timeout=5, poll=0.01, stale_seconds=0.2)
+                )
+            )
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(built), 1)
+        self.assertEqual(sorted(reused for _, reused in results), [False, True])
+
+    def make_config(self):
+        forcing = os.path.join(self.tmpdir.name, "forcing.nc")
+        if not os.path.exists(forcing):
+            with open(forcing, "w") as f:
+                f.write("forcing")
+        return {
+            "general": {"nyear": 10},
+            "pism": {
+                "executable": self.fake_pism,
+                "bootstrap_launcher": [sys.executable, self.fake_pism, self.calls],
+                "bootstrap_cache": True,
+                "validate_options": False,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "thisrun_work_dir": self.tmpdir.name,
+                "current_year": 0,
+                "input_sources": {"input": self.spinup},
+                "input_targets": {"input": "spinup.nc"},
+                "forcing_sources": {"surface_given_file": forcing},
+                "outdata_sources": {"ts_file": "ts.nc", "ex_file": "ex.nc"},
+                "restart_out_sources": {"restart": "restart.nc"},
+                "ts_vars": ["ivol"],
+                "ts_times": "yearly",
+                "ex_vars": ["thk"],
+                "ex_times": "yearly",
+                "outdata_size": "medium",
+                "pism_command_line_opts": [
+                    "-bootstrap",
+                    "-Mx 11",
+                    "-Lz 4000",
+                    "-sia_e 3",
+                    "-surface given",
+                    "-surface_given_file forcing.nc",
+                ],
+            },
+        }
+
+    def test_pism_assemble_command(self):
+        for _ in range(2):
+            config = self.make_config()
+            plugin.pism_assemble_command(config)
+            command = config["pism"]["execution_command"]
+            self.assertNotIn("-bootstrap", command)
+            self.assertNotIn("-Mx", command)
+            self.assertIn("-sia_e 3", command)
+            self.assertIn("-surface_given_file forcing.nc", command)
+            self.assertIn("-i spinup.nc", command)
+            state = config["pism"]["input_sources"]["input"]
+            with open(state) as f:
+                self.assertEqual(f.read(), "spinup")
+        with open(self.calls) as f:
+            calls = f.read().splitlines()
+        self.assertEqual(len(calls), 1)
+        # Bootstrapped with the couplers and physics, but without the output:
+        for option in ["-Mx 11", "-sia_e 3", "-surface given", f"-surface_given_file {self.tmpdir.name}/forcing.nc"]:
+            self.assertIn(option, calls[0])
+        for option in ["-ys", "-extra_file", "-ts_file", "restart.nc", "-y 10"]:
+            self.assertNotIn(option, calls[0])
+        self.assertIn("-y 0", calls[0])
+
+        # Other forcing gives another state:
+        with open(os.path.join(self.tmpdir.name, "forcing.nc"), "w") as f:
+            f.write("other forcing")
+        other = self.make_config()
+        plugin.pism_assemble_command(other)
+        self.assertNotEqual(other["pism"]["input_sources"]["input"], state)
+        with open(self.calls) as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
+
+    def test_options_are_validated_before_bootstrapping(self):
+        config = self.make_config()
+        config["pism"]["validate_options"] = "error"
+        with mock.patch.object(plugin, "_validate_options", side_effect=SystemExit(1)):
+            with self.assertRaises(SystemExit):
+                plugin._pism_assemble_command(config, "pism")
+        self.assertFalse(os.path.exists(self.calls))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.command`."""
+
+
+import unittest
+
+from esm_pism import plugin
+from esm_pism.command import CommandConflictError, PismCommand
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+class TestPismCommand(unittest.TestCase):
+    """Tests for `esm_pism.command`."""
+
+    def test_order_and_deduplication(self):
+        command = PismCommand.from_list(["-verbose 2", "-pik", "-ocean pico"])
+        command.add("pik").add("--verbose", 3).add("sea_level", "constant")
+        self.assertEqual(command.to_list(), ["--verbose 3", "-pik", "-ocean pico", "-sea_level constant"])
+        self.assertEqual(command.render("pismr"), "pismr --verbose 3 -pik -ocean pico -sea_level constant")
+
+    def test_conflict_error(self):
+        command = PismCommand(conflicts="error").add("verbose", 2).add("verbose", 2)
+        self.assertRaises(CommandConflictError, command.add, "verbose", 3)
+
+    def test_digest_is_stable(self):
+        first = PismCommand().add_kv_pairs({"a": 1, "b": 2}).add_flags(["c"])
+        second = PismCommand.from_list(first.to_list())
+        self.assertEqual(first.digest("pismr"), second.digest("pismr"))
+        self.assertNotEqual(first.digest("pismr"), second.add("a", 5).digest("pismr"))
+
+    def test_plugin_conflicting_options(self):
+        config = {
+            "pism": {
+                "command_conflicts": "error",
+                "kv_pairs": {"verbose": 2},
+                "pism_command_line_opts": ["-verbose 5"],
+            }
+        }
+        self.assertRaises(SystemExit, plugin.pism_set_kv_pairs, config)
+        config["pism"]["command_conflicts"] = "last_wins"
+        plugin.pism_set_kv_pairs(config)
+        self.assertEqual(config["pism"]["pism_command_line_opts"], ["-verbose 2"])
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.compress`."""
+
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import netCDF4
+import numpy as np
+
+from esm_pism import compress, plugin
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+def make_output_file(path, n_time=24, ny=30, nx=40):
+    """Writes an uncompressed stand-in for a PISM extra file"""
+    rng = np.random.default_rng(0)
+    with netCDF4.Dataset(path, "w", format="NETCDF3_64BIT_OFFSET") as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("y", ny)
+        nc.createDimension("x", nx)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "seconds since 1-1-1"
+        time[:] = np.arange(n_time) * 3.15569259747e7
+        thk = nc.createVariable("thk", "f4", ("time", "y", "x"))
+        thk.units = "m"
+        thk[:] = rng.uniform(0, 3000, (n_time, ny, nx)).astype("f4")
+        mask = nc.createVariable("mask", "i1", ("time", "y", "x"))
+        mask[:] = rng.integers(0, 4, (n_time, ny, nx))
+        nc.createVariable("pism_config", "b")
+        nc.title = "test"
+    return path
+
+
+class TestCompress(unittest.TestCase):
+    """Tests for `esm_pism.compress`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = make_output_file(os.path.join(self.tmpdir.name, "ex.nc"))
+        with netCDF4.Dataset(self.path) as nc:
+            self.thk = nc["thk"][:]
+            self.mask = nc["mask"][:]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_chunk_sizes(self):
+        self.assertEqual(compress.chunk_sizes((100, 10, 10), ("time", "y", "x"), "time", 4), [100, 10, 10])
+        self.assertEqual(
+            compress.chunk_sizes((100, 1000, 1000), ("time", "y", "x"), "time", 4, 4 * 100 * 100),
+            [100, 8, 8],
+        )
+        self.assertIsNone(compress.chunk_sizes((), (), "time", 1))
+
+    def test_compress_file(self):
+        size_before, size_after = compress.compress_file(self.path)
+        self.assertLess(size_after, size_before)
+        with netCDF4.Dataset(self.path) as nc:
+            self.assertEqual(nc.data_model, "NETCDF4")
+            self.assertEqual(nc.title, "test")
+            self.assertTrue(nc["thk"].filters()["zlib"])
+            self.assertTrue(nc["thk"].filters()["shuffle"])
+            self.assertEqual(nc["thk"].chunking()[0], 24)
+            np.testing.assert_array_equal(nc["thk"][:], self.thk)
+            np.testing.assert_array_equal(nc["mask"][:], self.mask)
+        self.assertEqual(compress.compress_file(self.path), (size_after, size_after))
+
+    def test_compress_file_bitround(self):
+        compress.compress_file(self.path, bitround={"thk": 8, "mask": 8})
+        with netCDF4.Dataset(self.path) as nc:
+            np.testing.assert_allclose(nc["thk"][:], self.thk, rtol=2.0 ** -8)
+            np.testing.assert_array_equal(nc["mask"][:], self.mask)
+
+    def test_failed_verification_keeps_original(self):
+        with open(self.path, "rb") as f:
+            original = f.read()
+        with mock.patch.object(compress, "_verify", return_value="thk differs"):
+            self.assertRaises(ValueError, compress.compress_file, self.path)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(os.listdir(self.tmpdir.name), ["ex.nc"])
+
+    def test_pism_compress_outputs(self):
+        make_output_file(os.path.join(self.tmpdir.name, "ts.nc"))
+        config = {
+            "pism": {
+                "thisrun_work_dir": self.tmpdir.name,
+                "restart_out_sources": {"restart": "restart.nc"},
+                "outdata_sources": {"ts_file": "ts.nc", "ex_file": "ex.nc"},
+                "ex_vars": ["thk"],
+                "compress_bitround_bits": 8,
+            }
+        }
+        plugin.pism_compress_outputs(config)
+        for name in ["ts.nc", "ex.nc"]:
+            self.assertTrue(compress.is_compressed(os.path.join(self.tmpdir.name, name)))
+        with netCDF4.Dataset(os.path.join(self.tmpdir.name, "ts.nc")) as nc:
+            np.testing.assert_array_equal(nc["thk"][:], self.thk)
+        with netCDF4.Dataset(self.path) as nc:
+            self.assertFalse(np.array_equal(nc["thk"][:], self.thk))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.concat`."""
+
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import netCDF4
+import numpy as np
+
+from esm_pism import concat, plugin
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+SECONDS_PER_YEAR = 365.2425 * 86400
+
+
+def make_chunk_output(path, start_year, nyear, ny=3, nx=4):
+    """Writes a stand-in for the yearly extra file of one chunk"""
+    with netCDF4.Dataset(path, "w") as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("y", ny)
+        nc.createDimension("x", nx)
+        x = nc.createVariable("x", "f8", ("x",))
+        x[:] = np.arange(nx)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "seconds since 1-1-1"
+        # PISM also writes the start of the chunk:
+        years = np.arange(start_year, start_year + nyear + 1)
+        time[:] = (years - 1) * SECONDS_PER_YEAR
+        thk = nc.createVariable("thk", "f4", ("time", "y", "x"))
+        thk[:] = years[:, None, None] * np.ones((ny, nx))
+    return path
+
+
+class TestConcat(unittest.TestCase):
+    """Tests for `esm_pism.concat`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.target = os.path.join(self.tmpdir.name, "all.nc")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _chunk(self, number, nyear=10):
+        return make_chunk_output(
+            os.path.join(self.tmpdir.name, f"ex_{number}.nc"), 1 + number * nyear, nyear
+        )
+
+    def test_append_chunks(self):
+        for number in range(3):
+            concat.append_chunk(self._chunk(number), self.target, number)
+        with netCDF4.Dataset(self.target) as nc:
+            np.testing.assert_array_equal(nc["thk"][:, 0, 0], np.arange(1, 32))
+            np.testing.assert_array_equal(nc["x"][:], np.arange(4))
+        index = concat.read_index(self.target)
+        self.assertEqual(index["records"], 31)
+        self.assertEqual(
+            [(c["first_record"], c["last_record"]) for c in index["chunks"]], [(0, 10), (11, 20), (21, 30)]
+        )
+        self.assertAlmostEqual(index["chunks"][1]["start_year"], 12)
+        self.assertEqual(concat.find_records(index, 13, 14), (11, 20))
+        self.assertEqual(concat.find_records(index, 5, 15), (0, 20))
+        self.assertIsNone(concat.find_records(index, 100, 200))
+
+    def test_records_per_chunk(self):
+        # Time series share chunks between many records, large fields do not:
+        self.assertEqual(concat.records_per_chunk([10], ("time",), "time", 8), concat.MAX_RECORDS_PER_CHUNK)
+        self.assertEqual(concat.records_per_chunk([10, 1000, 1000], ("time", "y", "x"), "time", 8), 1)
+        self.assertEqual(concat.records_per_chunk([10, 256, 256], ("time", "y", "x"), "time", 8), 8)
+        concat.append_chunk(self._chunk(0), self.target, 0)
+        with netCDF4.Dataset(self.target) as nc:
+            self.assertEqual(nc["time"].chunking(), [concat.MAX_RECORDS_PER_CHUNK])
+
+    def test_append_is_idempotent(self):
+        source = self._chunk(0)
+        self.assertIsNotNone(concat.append_chunk(source, self.target, 0))
+        self.assertIsNone(concat.append_chunk(source, self.target, 0))
+        self.assertEqual(concat.read_index(self.target)["records"], 11)
+
+    def test_interrupted_append_is_overwritten(self):
+        concat.append_chunk(self._chunk(0), self.target, 0)
+        index = concat.read_index(self.target)
+        concat.append_chunk(self._chunk(1), self.target, 1)
+        # As if the index had not been written after the second chunk:
+        concat.write_json(concat.index_path(self.target), index)
+        source = make_chunk_output(os.path.join(self.tmpdir.name, "ex_1b.nc"), 11, 5)
+        concat.append_chunk(source, self.target, "1b")
+        with netCDF4.Dataset(self.target) as nc:
+            np.testing.assert_array_equal(nc["thk"][:16, 0, 0], np.arange(1, 17))
+        self.assertEqual(concat.read_index(self.target)["records"], 16)
+
+    def test_interrupted_first_append_is_recreated(self):
+        # As if the first append had stopped after creating the target:
+        source = self._chunk(0)
+        with mock.patch.object(concat, "copy_values", side_effect=OSError("interrupted")):
+            self.assertRaises(OSError, concat.append_chunk, source, self.target, 0)
+        self.assertTrue(os.path.exists(self.target))
+        concat.append_chunk(source, self.target, 0)
+        self.assertEqual(concat.read_index(self.target)["records"], 11)
+        # A file the plugin did not create is left alone:
+        os.remove(concat.index_path(self.target))
+        self.assertRaises(ValueError, concat.append_chunk, self._chunk(1), self.target, 1)
+
+    def test_pism_concatenate_outputs(self):
+        for number in range(2):
+            make_chunk_output(os.path.join(self.tmpdir.name, "ex.nc"), 1 + number * 10, 10)
+            make_chunk_output(os.path.join(self.tmpdir.name, "ts.nc"), 1 + number * 10, 10, 1, 1)
+            config = {
+                "general": {"expid": "test", "run_number": number + 1},
+                "pism": {
+                    "thisrun_work_dir": self.tmpdir.name,
+                    "experiment_outdata_dir": os.path.join(self.tmpdir.name, "outdata"),
+                    "outdata_sources": {"ts_file": "ts.nc", "ex_file": "ex.nc"},
+                },
+            }
+            plugin.pism_concatenate_outputs(config)
+        for kind in ["ts_file", "ex_file"]:
+            target = os.path.join(self.tmpdir.name, "outdata", f"test_pism_{kind}.nc")
+            self.assertEqual(concat.read_index(target)["records"], 21)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.config_index`."""
+
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from esm_pism import config_index
+
+# Test requirement:
+from loguru import logger
+
+from .test_overrides import make_pism_config
+
+logger.remove()
+
+
+class TestConfigIndex(unittest.TestCase):
+    """Tests for `esm_pism.config_index`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmpdir.name, "cache")
+        os.makedirs(self.cache_dir)
+        self.config_file = make_pism_config(
+            os.path.join(self.tmpdir.name, "pism_config.nc")
+        )
+        config_index._memo.clear()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_build_config_index(self):
+        parameters = config_index.build_config_index(self.config_file)
+        self.assertEqual(
+            sorted(parameters),
+            [
+                "atmosphere.use_precip_linear_factor_for_temperature",
+                "frontal_melt.given.period",
+                "verbose",
+            ],
+        )
+        self.assertEqual(parameters["verbose"], {"default": 2.0, "type": "integer"})
+
+    def test_cached_index_skips_netcdf(self):
+        config_index.load_config_index(self.config_file, self.cache_dir)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        config_index._memo.clear()
+        with mock.patch.object(config_index, "read_config_attrs") as read_config_attrs:
+            index = config_index.load_config_index(self.config_file, self.cache_dir)
+            # Touching the file changes the mtime, but not the content hash:
+            os.utime(self.config_file, ns=(0, 0))
+            config_index.load_config_index(self.config_file, self.cache_dir)
+        read_config_attrs.assert_not_called()
+        self.assertIn("verbose", index["parameters"])
+
+    def test_changed_file_rebuilds_index(self):
+        config_index.load_config_index(self.config_file, self.cache_dir)
+        make_pism_config(self.config_file, {"new_key": 1.0})
+        index = config_index.load_config_index(self.config_file, self.cache_dir)
+        self.assertEqual(list(index["parameters"]), ["new_key"])
+
+    def test_check_value_type(self):
+        parameters = config_index.build_config_index(self.config_file)
+        self.assertIsNone(config_index.check_value_type("verbose", 5, parameters))
+        self.assertIsNotNone(config_index.check_value_type("verbose", 2.5, parameters))
+        self.assertIsNotNone(config_index.check_value_type("verbose", "lots", parameters))
+        flag = "atmosphere.use_precip_linear_factor_for_temperature"
+        self.assertIsNone(config_index.check_value_type(flag, "no", parameters))
+        self.assertIsNone(config_index.check_value_type(flag, False, parameters))
+        self.assertIsNotNone(config_index.check_value_type(flag, 88, parameters))
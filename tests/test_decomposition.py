@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.decomposition`."""
+
+
+import os
+import tempfile
+import unittest
+
+import netCDF4
+
+from esm_pism import decomposition, plugin
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+class TestDecomposition(unittest.TestCase):
+    """Tests for `esm_pism.decomposition`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.tmpdir.name, "input.nc")
+        with netCDF4.Dataset(self.input_file, "w") as nc:
+            nc.createDimension("x", 761)
+            nc.createDimension("y", 381)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_read_grid_shape(self):
+        self.assertEqual(decomposition.read_grid_shape(self.input_file), (761, 381))
+
+    def test_plan_layout_follows_grid_shape(self):
+        Nx, Ny, _ = decomposition.plan_layout(761, 381, 32)
+        self.assertEqual((Nx, Ny), (8, 4))
+        Nx, Ny, _ = decomposition.plan_layout(381, 761, 32)
+        self.assertEqual((Nx, Ny), (4, 8))
+
+    def test_plan_decomposition(self):
+        self.assertEqual(decomposition.plan_decomposition(381, 381, 64), (8, 8))
+        # 61 is prime, so all ranks only give thin strips:
+        self.assertEqual(decomposition.plan_decomposition(381, 381, 61), (1, 61))
+        Nx, Ny = decomposition.plan_decomposition(381, 381, 61, choose_ranks=True)
+        self.assertLess(Nx * Ny, 61)
+        self.assertIsNone(decomposition.plan_decomposition(10, 10, 64))
+
+    def test_candidate_ranks(self):
+        self.assertEqual(decomposition.candidate_ranks(10), list(range(1, 11)))
+        # Only logarithmically many counts far below a large allocation:
+        candidates = decomposition.candidate_ranks(100000)
+        self.assertLess(len(candidates), 1000)
+        self.assertEqual(candidates[-decomposition.NEAR_RANKS:], list(range(100000 - 63, 100001)))
+        self.assertEqual(candidates[0], 1)
+        # ... which still finds a layout about as good as the best of all counts:
+        best = min(
+            (layout for layout in map(lambda ranks: decomposition.plan_layout(381, 761, ranks), range(1, 2001)) if layout),
+            key=lambda layout: layout[2],
+        )
+        Nx, Ny = decomposition.plan_decomposition(381, 761, 2000, choose_ranks=True)
+        self.assertLess(decomposition.rank_cost(381, 761, Nx, Ny), best[2] * 1.01)
+
+    def _config(self):
+        return {
+            "general": {"nyear": 10},
+            "pism": {
+                "executable": "pismr",
+                "validate_options": False,
+                "plan_decomposition": True,
+                "nproc": 32,
+                "current_year": 0,
+                "input_sources": {"input": self.input_file},
+                "input_targets": {"input": "input.nc"},
+                "outdata_sources": {"ts_file": "ts.nc", "ex_file": "ex.nc"},
+                "restart_out_sources": {"restart": "restart.nc"},
+                "ts_vars": ["ivol"],
+                "ts_times": "yearly",
+                "ex_vars": ["thk"],
+                "ex_times": "yearly",
+                "outdata_size": "medium",
+            },
+        }
+
+    def test_pism_assemble_command(self):
+        config = self._config()
+        plugin.pism_assemble_command(config)
+        self.assertIn("-Nx 8 -Ny 4", config["pism"]["execution_command"])
+
+    def test_bootstrap_grid(self):
+        # The grid of the model comes from -Mx and -My, not from the file:
+        config = self._config()
+        config["pism"]["pism_command_line_opts"] = ["-bootstrap", "-Mx 381", "-My 761"]
+        plugin.pism_assemble_command(config)
+        self.assertIn("-Nx 4 -Ny 8", config["pism"]["execution_command"])
+
+    def test_linked_input(self):
+        config = self._config()
+        config["pism"]["link_inputs"] = "symlink"
+        config["pism"]["thisrun_work_dir"] = os.path.join(self.tmpdir.name, "work")
+        plugin.pism_assemble_command(config)
+        self.assertNotIn("input", config["pism"]["input_sources"])
+        self.assertIn("-Nx 8 -Ny 4", config["pism"]["execution_command"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.diagnostics`."""
+
+
+import os
+import tempfile
+import unittest
+
+import netCDF4
+import numpy as np
+
+from esm_pism import diagnostics, plugin
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+def make_extra_file(path, years):
+    """Writes an extra file with ``thk`` and ``mask`` on a 4 x 6 grid of 1 km cells"""
+    with netCDF4.Dataset(path, "w") as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("y", 4)
+        nc.createDimension("x", 6)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "seconds since 1-1-1"
+        time.calendar = "365_day"
+        time[:] = np.asarray(years, "f8") * 365 * 86400
+        nc.createVariable("x", "f8", ("x",))[:] = np.arange(6) * 1000.0
+        nc.createVariable("y", "f8", ("y",))[:] = np.arange(4) * 1000.0
+        thk = nc.createVariable("thk", "f8", ("time", "y", "x"))
+        mask = nc.createVariable("mask", "i4", ("time", "y", "x"))
+        for i, year in enumerate(years):
+            thk[i] = np.full((4, 6), float(year))
+            # Grounded (2) in the left half, floating (3) in the right half:
+            mask[i] = np.repeat([[2, 2, 2, 3, 3, 3]], 4, axis=0)
+    return path
+
+
+class TestDiagnostics(unittest.TestCase):
+    """Tests for `esm_pism.diagnostics`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.specs = {
+            "ice_volume": {"variable": "thk", "area_weighted": True, "units": "m3"},
+            "grounded_area": {"area_weighted": True, "where": {"mask": [2]}, "by_basin": True},
+            "max_thk": {"variable": "thk", "reduction": "max", "by_basin": True},
+        }
+        self.basins = np.repeat([[1, 1, 2, 2, 0, 0]], 4, axis=0)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_reduce_record(self):
+        fields = {"thk": np.full((4, 6), 2.0), "mask": np.repeat([[2, 2, 2, 3, 3, 3]], 4, axis=0)}
+        fields["thk"] = np.ma.masked_where(fields["mask"] == 3, fields["thk"])
+        results = diagnostics.reduce_record(fields, self.specs, np.full((4, 6), 1e6), self.basins)
+        self.assertEqual(results["ice_volume"], 12 * 2.0 * 1e6)
+        self.assertEqual(results["grounded_area"], 12e6)
+        self.assertEqual(results["grounded_area_basin_1"], 8e6)
+        self.assertEqual(results["grounded_area_basin_2"], 4e6)
+        self.assertEqual(results["max_thk_basin_2"], 2.0)
+        self.assertNotIn("ice_volume_basin_1", results)
+        # Masked cells of an integer mask never match, whatever their fill value:
+        fields["mask"] = np.ma.masked_where(self.basins == 1, fields["mask"])
+        results = diagnostics.reduce_record(fields, self.specs, np.full((4, 6), 1e6), self.basins)
+        self.assertEqual(results["grounded_area"], 4e6)
+
+    def test_reduce_file(self):
+        path = make_extra_file(os.path.join(self.tmpdir.name, "ex.nc"), [1, 2, 3, 4, 5])
+        times, time_attrs, rows = diagnostics.reduce_file(path, self.specs, self.basins, max_workers=2)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(time_attrs["calendar"], "365_day")
+        self.assertEqual([row["ice_volume"] for row in rows], [24e6 * year for year in [1, 2, 3, 4, 5]])
+
+    def test_pism_reduce_diagnostics(self):
+        make_extra_file(os.path.join(self.tmpdir.name, "ex.nc"), [1, 2, 3])
+        config = {
+            "general": {"expid": "test"},
+            "pism": {
+                "thisrun_work_dir": self.tmpdir.name,
+                "experiment_outdata_dir": os.path.join(self.tmpdir.name, "outdata"),
+                "outdata_sources": {"ex_file": "ex.nc"},
+                "diagnostics": self.specs,
+                "diagnostics_workers": 1,
+            },
+        }
+        plugin.pism_reduce_diagnostics(config)
+        # Repeating the chunk adds nothing, the next chunk appends:
+        plugin.pism_reduce_diagnostics(config)
+        make_extra_file(os.path.join(self.tmpdir.name, "ex.nc"), [4, 5])
+        plugin.pism_reduce_diagnostics(config)
+        with netCDF4.Dataset(os.path.join(self.tmpdir.name, "outdata", "test_pism_diagnostics.nc")) as nc:
+            self.assertEqual(len(nc["time"]), 5)
+            self.assertEqual(nc["ice_volume"].units, "m3")
+            np.testing.assert_allclose(nc["grounded_area"][:], 12e6)
+
+
+if __name__ == "__main__":
+    unittest.main()
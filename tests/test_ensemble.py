@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.ensemble`."""
+
+
+import json
+import os
+import tempfile
+import unittest
+
+import netCDF4
+
+from esm_pism import config_index, ensemble, plugin
+
+# Test requirement:
+from loguru import logger
+
+from .test_options import CONFIG_ATTRS
+from .test_overrides import make_pism_config
+
+logger.remove()
+
+
+class TestEnsemble(unittest.TestCase):
+    """Tests for `esm_pism.ensemble`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.config_file = make_pism_config(os.path.join(self.tmpdir.name, "pism_config.nc"), CONFIG_ATTRS)
+        config_index._memo.clear()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_config(self, spec):
+        return {
+            "general": {"expid": "sweep"},
+            "pism": {
+                "executable": "pismr",
+                "config_file": self.config_file,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "thisrun_config_dir": self.tmpdir.name,
+                "execution_command_opts": ["-i input.nc", "-sia_e 1", "-o restart.nc", "-ts_file /out/ts.nc"],
+                "ensemble_workers": 1,
+                "ensemble": spec,
+            },
+        }
+
+    def test_expand_members(self):
+        members = ensemble.expand_members({"grid": {"kv_pairs.sia_e": [1, 2, 3], "kv_pairs.ssa_e": [1, 2]}})
+        self.assertEqual(len(members), 6)
+        self.assertEqual(members[0], {"kv_pairs.sia_e": 1, "kv_pairs.ssa_e": 1})
+        self.assertRaises(ValueError, ensemble.expand_members, {"grid": {"sia_e": [1]}})
+
+    def test_latin_hypercube(self):
+        points = ensemble.latin_hypercube({"a": [0, 10], "b": [-1, 1]}, 5, seed=3)
+        self.assertEqual(points, ensemble.latin_hypercube({"a": [0, 10], "b": [-1, 1]}, 5, seed=3))
+        # One point per stratum:
+        self.assertEqual(sorted(int(point["a"] // 2) for point in points), [0, 1, 2, 3, 4])
+
+    def test_pism_expand_ensemble(self):
+        config = self.make_config(
+            {
+                "grid": {
+                    "kv_pairs.sia_e": [2, 3],
+                    "overrides_kv_pairs.atmosphere.given.period": [1, 1],
+                }
+            }
+        )
+        plugin.pism_expand_ensemble(config)
+        with open(config["pism"]["ensemble_manifest"]) as f:
+            manifest = json.load(f)
+        self.assertEqual(len(manifest["members"]), 4)
+        member = manifest["members"][3]
+        self.assertEqual(member["id"], "member_0003")
+        self.assertIn("-sia_e 3", member["command"])
+        self.assertIn("-o member_0003_restart.nc", member["command"])
+        self.assertIn("-ts_file /out/member_0003_ts.nc", member["command"])
+        self.assertIn(f"-pism_override {member['overrides_file']}", member["command"])
+        with netCDF4.Dataset(member["overrides_file"]) as nc:
+            self.assertEqual(nc.variables["pism_config"].getncattr("atmosphere.given.period"), 1)
+        commands_file = os.path.join(os.path.dirname(config["pism"]["ensemble_manifest"]), "commands.txt")
+        with open(commands_file) as f:
+            self.assertEqual(f.read().splitlines(), [member["command"] for member in manifest["members"]])
+
+    def test_invalid_members(self):
+        config = self.make_config({"grid": {"overrides_kv_pairs.atmosphere.given.perod": [1, 2]}})
+        self.assertRaises(SystemExit, plugin.pism_expand_ensemble, config)
+        config = self.make_config({"ranges": {"kv_pairs.sia_f": [1, 2]}, "samples": 3})
+        plugin.pism_expand_ensemble(config)
+        config = self.make_config({"ranges": {"kv_pairs.sia_f": [1, 2]}, "samples": 3})
+        config["pism"]["validate_options"] = "error"
+        self.assertRaises(SystemExit, plugin.pism_expand_ensemble, config)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,8 @@
 
 
 import os
+import subprocess
+import sys
 import unittest
 
 from esm_pism import plugin
@@ -45,3 +47,47 @@ class TestEsm_pism(unittest.TestCase):
     def test_pism_set_couplers_bad_name(self):
         self.example_config["pism"]["couplers"]["lala"] = "bad thing"
         self.assertRaises(SystemExit, plugin.pism_set_couplers, self.example_config)
+
+    def test_dual_hemisphere(self):
+        config = {"general": {"nyear": 10}}
+        for pism_key in ["pism_nh", "pism_sh"]:
+            config[pism_key] = {
+                "executable": "pismr",
+                "current_year": 0,
+                "input_targets": {"input": f"/input/{pism_key}.nc"},
+                "outdata_sources": {"ts_file": "ts.nc", "ex_file": "ex.nc"},
+                "restart_out_sources": {"restart": "restart.nc"},
+                "ts_vars": ["ivol"],
+                "ts_times": "yearly",
+                "ex_vars": ["thk"],
+                "ex_times": "yearly",
+                "outdata_size": "medium",
+                "kv_pairs": {"verbose": 2},
+                "couplers": {"ocean": {"pico": {"files": {"ocean_pico_file": f"/forcing/{pism_key}_ocean.nc"}}}},
+            }
+        for step in [plugin.pism_set_kv_pairs, plugin.pism_set_couplers, plugin.pism_assemble_command]:
+            step(config)
+        for pism_key in ["pism_nh", "pism_sh"]:
+            self.assertEqual(
+                config[pism_key]["forcing_sources"], {"ocean_pico_file": f"/forcing/{pism_key}_ocean.nc"}
+            )
+            self.assertIn(f"-i {pism_key}.nc", config[pism_key]["execution_command"])
+            self.assertIn(f"-ocean_pico_file {pism_key}_ocean.nc", config[pism_key]["execution_command"])
+        # Errors in the worker process of one instance stop the experiment:
+        config["pism_sh"]["couplers"]["lala"] = "bad thing"
+        self.assertRaises(SystemExit, plugin.pism_set_couplers, config)
+
+    def test_plugin_import_is_lightweight(self):
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, esm_pism.plugin; "
+                "print(sorted(m for m in ['xarray', 'netCDF4', 'numpy'] if m in sys.modules))",
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout
+        self.assertEqual(output.strip(), "[]")
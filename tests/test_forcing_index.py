@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.forcing_index`."""
+
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import netCDF4
+import numpy as np
+
+from esm_pism import forcing_index, plugin
+
+# Test requirement:
+from loguru import logger
+
+from .test_subset import make_transient_forcing
+
+logger.remove()
+
+
+def add_grid(path, dx=16000.0, nx=5, ny=4):
+    """Adds x and y coordinates in metres to a forcing file"""
+    with netCDF4.Dataset(path, "a") as nc:
+        x = nc.variables["x"] if "x" in nc.variables else nc.createVariable("x", "f8", ("x",))
+        x.units = "m"
+        x[:] = np.arange(nx) * dx
+        y = nc.createVariable("y", "f8", ("y",))
+        y.units = "m"
+        y[:] = np.arange(ny) * dx
+    return path
+
+
+class TestForcingIndex(unittest.TestCase):
+    """Tests for `esm_pism.forcing_index`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmpdir.name, "cache")
+        os.makedirs(self.cache_dir)
+        self.forcing_file = add_grid(
+            make_transient_forcing(os.path.join(self.tmpdir.name, "forcing.nc"), np.arange(0, 1000, 10))
+        )
+        forcing_index._memo.clear()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_build_forcing_index(self):
+        index = forcing_index.build_forcing_index(self.forcing_file)
+        self.assertEqual(index["variables"]["air_temp"], ["time", "y", "x"])
+        self.assertEqual(index["time"]["calendar"], "365_day")
+        self.assertEqual(index["time"]["max"], 990 * 365)
+        self.assertEqual(index["grid"]["x"]["step"], 16000.0)
+
+    def test_index_is_cached(self):
+        forcing_index.load_forcing_index(self.forcing_file, self.cache_dir)
+        forcing_index._memo.clear()
+        with mock.patch.object(forcing_index, "build_forcing_index") as build:
+            forcing_index.load_forcing_index(self.forcing_file, self.cache_dir)
+        build.assert_not_called()
+
+    def test_checks(self):
+        index = forcing_index.load_forcing_index(self.forcing_file)
+        self.assertIsNone(forcing_index.check_time_coverage(index, 100, 200))
+        self.assertIsNotNone(forcing_index.check_time_coverage(index, 950, 1050))
+        self.assertIsNone(forcing_index.check_grid(index, "16km", index["grid"]["fingerprint"]))
+        self.assertIsNotNone(forcing_index.check_grid(index, "8km"))
+        self.assertIsNotNone(forcing_index.check_grid(index, None, "another grid"))
+        self.assertIsNone(forcing_index.check_grid(index, None, None, (5, 4)))
+        self.assertIsNotNone(forcing_index.check_grid(index, None, None, (10, 8)))
+        # The cells reach half a step (8 km) beyond the coordinates:
+        self.assertIsNone(forcing_index.check_domain(index, (-8000.0, 72000.0), (0.0, 48000.0)))
+        self.assertIsNotNone(forcing_index.check_domain(index, (-10000.0, 64000.0), (0.0, 48000.0)))
+
+    def test_plugin_checks_coverage(self):
+        config = {
+            "general": {"nyear": 100},
+            "pism": {
+                "cache_dir": self.cache_dir,
+                "current_year": 950,
+                "resolution": "16km",
+                "check_forcing": True,
+                "couplers": {"ocean": {"pico": {"files": {"ocean_pico_file": self.forcing_file}}}},
+            },
+        }
+        self.assertRaises(SystemExit, plugin.pism_set_couplers, config)
+        # Periodic forcing does not need to cover the chunk:
+        config["pism"]["couplers"]["ocean"]["pico"]["kv_pairs"] = {"ocean_pico_period": 1000}
+        plugin.pism_set_couplers(config)
+
+    def test_plugin_checks_bootstrap_grid(self):
+        # An input file on a finer grid over the same domain:
+        input_file = os.path.join(self.tmpdir.name, "input.nc")
+        with netCDF4.Dataset(input_file, "w") as nc:
+            nc.createDimension("x", 9)
+            nc.createDimension("y", 7)
+        add_grid(input_file, 8000.0, 9, 7)
+        config = {
+            "general": {"nyear": 100},
+            "pism": {
+                "cache_dir": self.cache_dir,
+                "current_year": 100,
+                "check_forcing": True,
+                "input_sources": {"input": input_file},
+                "pism_command_line_opts": [],
+                "couplers": {"ocean": {"pico": {"files": {"ocean_pico_file": self.forcing_file}}}},
+            },
+        }
+        self.assertRaises(SystemExit, plugin.pism_set_couplers, config)
+        # When bootstrapping, the model grid is set by -Mx and -My:
+        config["pism"]["pism_command_line_opts"] = ["-bootstrap", "-Mx 5", "-My 4"]
+        plugin.pism_set_couplers(config)
+        config["pism"]["pism_command_line_opts"] = ["-bootstrap", "-Mx 9", "-My 7"]
+        self.assertRaises(SystemExit, plugin.pism_set_couplers, config)
+        # ... and the domain by -x_range and -y_range:
+        config["pism"]["pism_command_line_opts"] = ["-bootstrap", "-Mx 5", "-My 4", "-x_range -100000,64000"]
+        self.assertRaises(SystemExit, plugin.pism_set_couplers, config)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.handoff`."""
+
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from esm_pism import handoff, plugin
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+class TestHandoff(unittest.TestCase):
+    """Tests for `esm_pism.handoff`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmpdir.name, "forcing.nc")
+        with open(self.source, "w") as f:
+            f.write("data")
+        self.work_dir = os.path.join(self.tmpdir.name, "work")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_place_file(self):
+        target = os.path.join(self.work_dir, "forcing.nc")
+        self.assertEqual(handoff.place_file(self.source, target, "hardlink"), "hardlink")
+        self.assertTrue(os.path.samefile(self.source, target))
+        self.assertEqual(handoff.place_file(self.source, target, "symlink"), "symlink")
+        self.assertEqual(handoff.place_file(self.source, target + "2", "symlink"), "symlink")
+        self.assertEqual(os.readlink(target + "2"), self.source)
+        self.assertRaises(ValueError, handoff.place_file, self.source, target, "move")
+
+    def test_other_filesystem_is_copied(self):
+        target = os.path.join(self.work_dir, "forcing.nc")
+        with mock.patch.object(handoff, "same_filesystem", return_value=False):
+            self.assertEqual(handoff.place_file(self.source, target, "hardlink"), "copy")
+        self.assertFalse(os.path.samefile(self.source, target))
+        with open(target) as f:
+            self.assertEqual(f.read(), "data")
+
+    def test_linked_inputs(self):
+        config = {
+            "general": {},
+            "pism": {
+                "thisrun_work_dir": self.work_dir,
+                "link_inputs": "hardlink",
+                "link_files": {"ocean_pico_file": "symlink"},
+                "input_files": {"input": "input"},
+                "input_sources": {"input": self.source},
+                "input_targets": {"input": "restart_0100.nc"},
+            },
+        }
+        plugin._add_files({"ocean_pico_file": self.source}, config, "pism")
+        self.assertNotIn("ocean_pico_file", config["pism"]["forcing_sources"])
+        self.assertTrue(os.path.islink(os.path.join(self.work_dir, "forcing.nc")))
+        plugin._hand_off_restart(config, "pism")
+        self.assertNotIn("input", config["pism"]["input_sources"])
+        self.assertTrue(os.path.samefile(self.source, os.path.join(self.work_dir, "restart_0100.nc")))
+        self.assertEqual(config["pism"]["file_movements"]["restart_out"]["all_directions"], "move")
+        self.assertEqual(config["pism"]["linked_sources"]["input"], self.source)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.instrument`."""
+
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from esm_pism import compress, instrument, plugin
+
+# Test requirement:
+from loguru import logger
+
+from .test_compress import make_output_file
+from .test_overrides import make_pism_config
+
+logger.remove()
+
+
+class TestInstrument(unittest.TestCase):
+    """Tests for `esm_pism.instrument`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.log_dir = os.path.join(self.tmpdir.name, "log")
+        self.config = {
+            "general": {"expid": "test", "run_number": 3, "thisrun_log_dir": self.log_dir},
+            "pism": {
+                "config_file": make_pism_config(os.path.join(self.tmpdir.name, "pism_config.nc")),
+                "thisrun_config_dir": self.tmpdir.name,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "pism_command_line_opts": [],
+                "overrides_kv_pairs": {"verbose": 5},
+                "overrides_store": False,
+            },
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _records(self):
+        with open(os.path.join(self.log_dir, instrument.METRICS_FILE)) as f:
+            return [json.loads(line) for line in f]
+
+    def test_disabled_by_default(self):
+        with mock.patch.dict(os.environ, {instrument.INSTRUMENT_ENV: ""}):
+            plugin.pism_override_file(self.config)
+        self.assertFalse(os.path.exists(self.log_dir))
+
+    def test_records_entry_point(self):
+        self.config["pism"]["instrument"] = True
+        plugin.pism_set_flags(self.config)
+        plugin.pism_override_file(self.config)
+        records = self._records()
+        self.assertEqual([r["step"] for r in records], ["pism_set_flags", "pism_override_file"])
+        record = records[1]
+        self.assertEqual(record["status"], "ok")
+        self.assertEqual(record["run_number"], 3)
+        self.assertGreater(record["wall"], 0)
+        self.assertGreater(record["max_rss_kib"], 0)
+        # The template is read, the overrides file written:
+        self.assertEqual(record["netcdf_files"], 2)
+        self.assertGreaterEqual(record["files_touched"], 3)
+        if instrument.read_proc_io() is not None:
+            self.assertGreater(record["netcdf_bytes_written"], 0)
+
+    def test_counts_worker_processes(self):
+        paths = [make_output_file(os.path.join(self.tmpdir.name, f"ex_{i}.nc")) for i in range(2)]
+
+        @instrument.instrumented
+        def pism_compress(config):
+            return compress.compress_files([(path, {}) for path in paths], max_workers=2)
+
+        self.config["pism"]["instrument"] = True
+        pism_compress(self.config)
+        record = self._records()[0]
+        # The files are compressed in worker processes:
+        self.assertGreaterEqual(record["netcdf_files"], 2)
+        if instrument.read_proc_io() is not None:
+            self.assertGreater(record["netcdf_bytes_written"], 0)
+
+    def test_enabled_by_environment(self):
+        with mock.patch.dict(os.environ, {instrument.INSTRUMENT_ENV: "1"}):
+            plugin.pism_set_flags(self.config)
+        self.assertEqual(len(self._records()), 1)
+
+    def test_records_failures(self):
+        self.config["pism"]["instrument"] = True
+        self.config["pism"]["overrides_kv_pairs"] = {"my_wonderful_config_option": 88}
+        self.assertRaises(SystemExit, plugin.pism_override_file, self.config)
+        self.assertEqual(self._records()[0]["status"], "error")
+
+
+if __name__ == "__main__":
+    unittest.main()
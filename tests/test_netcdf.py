@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.netcdf`."""
+
+
+import os
+import tempfile
+import unittest
+
+import netCDF4
+import numpy as np
+
+from esm_pism import netcdf
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+class TestNetcdf(unittest.TestCase):
+    """Tests for `esm_pism.netcdf`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmpdir.name, "source.nc")
+        with netCDF4.Dataset(self.source, "w") as nc:
+            nc.title = "test"
+            nc.createDimension("time", None)
+            nc.createDimension("x", 4)
+            nc.createVariable("time", "f8", ("time",))[:] = np.arange(10)
+            nc.createVariable("x", "f8", ("x",))[:] = np.arange(4)
+            thk = nc.createVariable("thk", "f4", ("time", "x"), fill_value=-1.0)
+            thk.units = "m"
+            thk[:] = np.arange(40).reshape(10, 4)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_record_blocks(self):
+        self.assertEqual(list(netcdf.record_blocks(range(5), 2)), [(0, 2), (2, 4), (4, 5)])
+        self.assertEqual(list(netcdf.record_blocks([1, 2, 5, 6, 7], 10)), [(1, 3), (5, 8)])
+        self.assertEqual(list(netcdf.record_blocks([], 1)), [])
+
+    def test_copy_dataset(self):
+        target = os.path.join(self.tmpdir.name, "target.nc")
+        with netcdf.open_dataset(self.source) as src, netcdf.open_dataset(target, "w") as dst:
+            copied = netcdf.copy_dataset(
+                src,
+                dst,
+                "time",
+                variable_kwargs=lambda name, var: {"chunksizes": [3, 4]} if name == "thk" else {},
+                records=range(2, 8),
+                transforms={"x": lambda values: values * 10},
+            )
+            self.assertEqual(sorted(copied), ["thk", "time", "x"])
+        with netCDF4.Dataset(target) as nc:
+            self.assertEqual(nc.title, "test")
+            self.assertTrue(nc.dimensions["time"].isunlimited())
+            self.assertEqual(nc["thk"].chunking(), [3, 4])
+            self.assertEqual(nc["thk"].units, "m")
+            self.assertEqual(nc["thk"]._FillValue, -1.0)
+            np.testing.assert_array_equal(nc["time"][:], np.arange(2, 8))
+            np.testing.assert_array_equal(nc["thk"][:], np.arange(8, 32).reshape(6, 4))
+            np.testing.assert_array_equal(nc["x"][:], np.arange(4) * 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
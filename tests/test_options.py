@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.options`."""
+
+
+import os
+import tempfile
+import unittest
+
+from esm_pism import config_index, options, plugin
+
+# Test requirement:
+from loguru import logger
+
+from .test_overrides import make_pism_config
+
+logger.remove()
+
+CONFIG_ATTRS = {
+    "atmosphere.given.period": 0.0,
+    "atmosphere.given.period_type": "number",
+    "atmosphere.given.period_option": "atmosphere_given_period",
+    "stress_balance.sia.enhancement_factor": 1.0,
+    "stress_balance.sia.enhancement_factor_type": "number",
+    "stress_balance.sia.enhancement_factor_option": "sia_e",
+    "energy.basal_melt.use_grounded_cell_fraction": "yes",
+    "energy.basal_melt.use_grounded_cell_fraction_type": "flag",
+    "energy.basal_melt.use_grounded_cell_fraction_option": "subgl_basal_melt",
+    "output.runtime.verbosity": 2.0,
+    "output.runtime.verbosity_option": "verbose",
+}
+
+
+class TestOptions(unittest.TestCase):
+    """Tests for `esm_pism.options`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.config_file = make_pism_config(os.path.join(self.tmpdir.name, "pism_config.nc"), CONFIG_ATTRS)
+        config_index._memo.clear()
+        self.option_index = config_index.load_config_index(self.config_file)["options"]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_option_index(self):
+        self.assertEqual(self.option_index["sia_e"], "stress_balance.sia.enhancement_factor")
+        self.assertEqual(self.option_index["atmosphere.given.period"], "atmosphere.given.period")
+        self.assertNotIn("atmosphere.given.period_option", self.option_index)
+        # Only flags can be negated:
+        self.assertEqual(self.option_index["no_subgl_basal_melt"], "energy.basal_melt.use_grounded_cell_fraction")
+        self.assertNotIn("no_sia_e", self.option_index)
+
+    def test_check_options(self):
+        self.assertEqual(
+            options.check_options(
+                [
+                    "-sia_e",
+                    "atmosphere.given.period",
+                    "-i",
+                    "-log_view",
+                    "--my_option",
+                    "-no_subgl_basal_melt",
+                    "-pik",
+                ],
+                self.option_index,
+                known_options=["-my_option"],
+            ),
+            [],
+        )
+        errors = options.check_options(["-atmosphere_given_perod"], self.option_index)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("did you mean -atmosphere_given_period", errors[0])
+
+    def test_pism_assemble_command(self):
+        config = {
+            "general": {"nyear": 10},
+            "pism": {
+                "executable": "pismr",
+                "config_file": self.config_file,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "current_year": 0,
+                "input_targets": {"input": "input.nc"},
+                "outdata_sources": {"ts_file": "ts.nc", "ex_file": "ex.nc"},
+                "restart_out_sources": {"restart": "restart.nc"},
+                "ts_vars": ["ivol"],
+                "ts_times": "yearly",
+                "ex_vars": ["thk"],
+                "ex_times": "yearly",
+                "outdata_size": "medium",
+                "pism_command_line_opts": ["-sia_e 3", "-atmosphere_given_perod 1"],
+            },
+        }
+        # Unknown options are only reported, unless asked to stop:
+        plugin.pism_assemble_command(config)
+        self.assertIn("-atmosphere_given_perod 1", config["pism"]["execution_command"])
+        config["pism"]["validate_options"] = "error"
+        self.assertRaises(SystemExit, plugin.pism_assemble_command, config)
+        config["pism"]["pism_command_line_opts"] = ["-sia_e 3", "-atmosphere_given_period 1"]
+        plugin.pism_assemble_command(config)
+        self.assertIn("-atmosphere_given_period 1", config["pism"]["execution_command"])
+
+
+if __name__ == "__main__":
+    unittest.main()
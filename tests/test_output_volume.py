@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.output_volume`."""
+
+
+import os
+import tempfile
+import unittest
+
+import netCDF4
+
+from esm_pism import output_volume, plugin
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+class TestOutputVolume(unittest.TestCase):
+    """Tests for `esm_pism.output_volume`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.tmpdir.name, "input.nc")
+        with netCDF4.Dataset(self.input_file, "w") as nc:
+            nc.createDimension("x", 100)
+            nc.createDimension("y", 200)
+            nc.createDimension("z", 11)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_count_records(self):
+        self.assertEqual(output_volume.count_records("yearly", 0, 100), 100)
+        self.assertEqual(output_volume.count_records("monthly", 0, 10), 120)
+        self.assertEqual(output_volume.count_records("0:10:1000", 0, 100), 11)
+        self.assertEqual(output_volume.count_records("0:10:1000", 995, 100), 1)
+        self.assertEqual(output_volume.count_records("5,15,200", 0, 100), 2)
+
+    def test_estimate_output(self):
+        estimate = output_volume.estimate_output(100, 200, 11, 10, 0, ["thk", "temp"], "yearly", ["ivol"], "yearly")
+        self.assertEqual(estimate["ex_bytes"], 10 * 100 * 200 * 8 * (1 + 11))
+        self.assertEqual(estimate["ts_bytes"], 10 * 8)
+        self.assertEqual(estimate["writes"], 21)
+
+    def test_propose_cadence(self):
+        self.assertEqual(output_volume.propose_cadence("yearly", 0, 100, 7), "0:20:100")
+        self.assertEqual(output_volume.propose_cadence("0:1:1000", 0, 100, 30), "0:5:1000")
+        self.assertEqual(output_volume.propose_cadence("0:10:1000", 0, 100, 30), "0:10:1000")
+        self.assertIsNone(output_volume.propose_cadence("yearly", 0, 100, 0))
+
+    def test_pism_assemble_command(self):
+        config = {
+            "general": {"nyear": 100},
+            "pism": {
+                "executable": "pismr",
+                "validate_options": False,
+                "output_budget_gb": 0.1,
+                "output_budget_action": "error",
+                "current_year": 0,
+                "input_sources": {"input": self.input_file},
+                "input_targets": {"input": "input.nc"},
+                "outdata_sources": {"ts_file": "ts.nc", "ex_file": "ex.nc"},
+                "restart_out_sources": {"restart": "restart.nc"},
+                "ts_vars": ["ivol"],
+                "ts_times": "yearly",
+                "ex_vars": ["thk", "temp"],
+                "ex_times": "yearly",
+                "outdata_size": "small",
+            },
+        }
+        self.assertRaises(SystemExit, plugin.pism_assemble_command, config)
+        self.assertEqual(config["pism"]["output_estimate"]["ex_records"], 100)
+        config["pism"]["output_budget_action"] = "warn"
+        plugin.pism_assemble_command(config)
+        self.assertIn("-extra_times yearly", config["pism"]["execution_command"])
+
+    def test_bootstrap_grid(self):
+        # The grid of the model comes from -Mx, -My and -Mz, not from the file:
+        config = {
+            "general": {"nyear": 10},
+            "pism": {
+                "executable": "pismr",
+                "validate_options": False,
+                "output_budget_gb": 100,
+                "current_year": 0,
+                "pism_command_line_opts": ["-bootstrap", "-Mx 50", "-My 60", "-Mz 21"],
+                "input_sources": {"input": self.input_file},
+                "input_targets": {"input": "input.nc"},
+                "outdata_sources": {"ts_file": "ts.nc", "ex_file": "ex.nc"},
+                "restart_out_sources": {"restart": "restart.nc"},
+                "ts_vars": ["ivol"],
+                "ts_times": "yearly",
+                "ex_vars": ["thk", "temp"],
+                "ex_times": "yearly",
+                "outdata_size": "small",
+            },
+        }
+        plugin.pism_assemble_command(config)
+        self.assertEqual(config["pism"]["output_estimate"]["ex_bytes"], 10 * 50 * 60 * 8 * (1 + 21))
+
+
+if __name__ == "__main__":
+    unittest.main()
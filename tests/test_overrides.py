@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.overrides`."""
+
+
+import os
+import tempfile
+import unittest
+
+import netCDF4
+
+from esm_pism import overrides, plugin
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+def make_pism_config(path, attrs=None):
+    """Writes a small stand-in for PISM's ``pism_config.nc``"""
+    attrs = attrs or {
+        "verbose": 2.0,
+        "verbose_doc": "Verbosity level",
+        "verbose_type": "integer",
+        "atmosphere.use_precip_linear_factor_for_temperature": "no",
+        "atmosphere.use_precip_linear_factor_for_temperature_type": "flag",
+        "frontal_melt.given.period": 0.0,
+        "frontal_melt.given.period_type": "number",
+    }
+    with netCDF4.Dataset(path, "w") as nc:
+        var = nc.createVariable("pism_config", "b")
+        var.setncatts(attrs)
+    return path
+
+
+class TestOverrides(unittest.TestCase):
+    """Tests for `esm_pism.overrides`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.config_file = make_pism_config(
+            os.path.join(self.tmpdir.name, "pism_config.nc")
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_read_config_attrs(self):
+        attrs = overrides.read_config_attrs(self.config_file)
+        self.assertEqual(attrs["verbose"], 2.0)
+        self.assertIn("frontal_melt.given.period", attrs)
+
+    def test_write_overrides_file(self):
+        overrides_file = os.path.join(self.tmpdir.name, "pism_overrides.nc")
+        overrides.write_overrides_file(
+            overrides_file, {"verbose": 5, "frontal_melt.given.period": 3, "flag": False}
+        )
+        with netCDF4.Dataset(overrides_file) as nc:
+            self.assertEqual(list(nc.variables), ["pism_config"])
+            attrs = nc.variables["pism_config"].__dict__
+        self.assertEqual(attrs, {"verbose": 5.0, "frontal_melt.given.period": 3.0, "flag": "no"})
+        # No temporary files are left behind:
+        self.assertEqual(
+            sorted(os.listdir(self.tmpdir.name)), ["pism_config.nc", "pism_overrides.nc"]
+        )
+
+    def test_pism_override_file(self):
+        config = {
+            "pism": {
+                "config_file": self.config_file,
+                "thisrun_config_dir": self.tmpdir.name,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "pism_command_line_opts": [],
+                "overrides_kv_pairs": {"verbose": 5},
+            }
+        }
+        plugin.pism_override_file(config)
+        self.assertIn("-pism_override pism_overrides.nc", config["pism"]["pism_command_line_opts"])
+        overrides_attrs = overrides.read_config_attrs(
+            config["pism"]["config_sources"]["pism_overrides"]
+        )
+        self.assertEqual(overrides_attrs, {"verbose": 5.0})
+
+    def test_pism_override_file_unknown_key(self):
+        config = {
+            "pism": {
+                "config_file": self.config_file,
+                "thisrun_config_dir": self.tmpdir.name,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "pism_command_line_opts": [],
+                "overrides_kv_pairs": {"my_wonderful_config_option": 88},
+            }
+        }
+        self.assertRaises(SystemExit, plugin.pism_override_file, config)
+
+    def test_pism_override_file_bad_type(self):
+        config = {
+            "pism": {
+                "config_file": self.config_file,
+                "thisrun_config_dir": self.tmpdir.name,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "pism_command_line_opts": [],
+                "overrides_kv_pairs": {"frontal_melt.given.period": "three"},
+            }
+        }
+        self.assertRaises(SystemExit, plugin.pism_override_file, config)
+
+    def test_pism_override_file_reuses_stored_file(self):
+        stored_files = []
+        # Values PISM reads the same give the same file:
+        overrides_kv_pairs = [
+            {"frontal_melt.given.period": 3, "atmosphere.use_precip_linear_factor_for_temperature": True},
+            {"frontal_melt.given.period": 3.0, "atmosphere.use_precip_linear_factor_for_temperature": "yes"},
+        ]
+        for chunk in range(2):
+            thisrun_config_dir = os.path.join(self.tmpdir.name, f"run_{chunk}")
+            os.makedirs(thisrun_config_dir)
+            config = {
+                "pism": {
+                    "config_file": self.config_file,
+                    "thisrun_config_dir": thisrun_config_dir,
+                    "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                    "pism_command_line_opts": [],
+                    "overrides_kv_pairs": overrides_kv_pairs[chunk],
+                }
+            }
+            plugin.pism_override_file(config)
+            stored_files.append(os.stat(config["pism"]["config_sources"]["pism_overrides"]))
+        self.assertTrue(os.path.samestat(*stored_files))
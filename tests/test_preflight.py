@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.preflight`."""
+
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import netCDF4
+import numpy as np
+
+from esm_pism import plugin, preflight
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+def make_forcing_file(path, n_time=12, fmt="NETCDF3_CLASSIC"):
+    """Writes a small monthly forcing file"""
+    with netCDF4.Dataset(path, "w", format=fmt) as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("y", 20)
+        nc.createDimension("x", 30)
+        var = nc.createVariable("air_temp", "f4", ("time", "y", "x"))
+        var[:] = np.ones((n_time, 20, 30))
+    return path
+
+
+class TestPreflight(unittest.TestCase):
+    """Tests for `esm_pism.preflight`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmpdir.name, "cache")
+        os.makedirs(self.cache_dir)
+        self.good_file = make_forcing_file(os.path.join(self.tmpdir.name, "good.nc"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_check_file(self):
+        self.assertIsNone(preflight.check_file(self.good_file))
+        self.assertIn("does not exist", preflight.check_file(self.good_file + ".missing"))
+
+    def test_truncated_classic_file(self):
+        truncated = make_forcing_file(os.path.join(self.tmpdir.name, "truncated.nc"))
+        os.truncate(truncated, os.path.getsize(truncated) // 2)
+        self.assertIn("truncated", preflight.check_file(truncated))
+
+    def test_check_files_reports_all_and_caches(self):
+        not_netcdf = os.path.join(self.tmpdir.name, "not_netcdf.nc")
+        with open(not_netcdf, "w") as f:
+            f.write("hello")
+        paths = [self.good_file, not_netcdf, "/does/not/exist.nc"]
+        errors = preflight.check_files(paths, self.cache_dir)
+        self.assertEqual(sorted(errors), sorted(paths[1:]))
+        with mock.patch.object(preflight, "check_file") as check_file:
+            check_file.return_value = None
+            preflight.check_files(paths, self.cache_dir, max_workers=1)
+        # The good file passed before and is not checked again:
+        self.assertNotIn(mock.call(self.good_file), check_file.call_args_list)
+        self.assertEqual(check_file.call_count, 2)
+
+    def test_check_files_in_processes(self):
+        # Many files are checked in a process pool, with the same results:
+        paths = [make_forcing_file(os.path.join(self.tmpdir.name, f"forcing_{i}.nc")) for i in range(3)]
+        os.truncate(paths[1], os.path.getsize(paths[1]) // 2)
+        with mock.patch.object(preflight, "PROCESS_POOL_MIN_FILES", 2):
+            errors = preflight.check_files(paths + ["/does/not/exist.nc"], self.cache_dir, max_workers=2)
+        self.assertEqual(sorted(errors), sorted([paths[1], "/does/not/exist.nc"]))
+
+    def test_pism_check_forcing_files(self):
+        config = {
+            "pism": {
+                "cache_dir": self.cache_dir,
+                "forcing_sources": {"atmosphere_given_file": self.good_file},
+            }
+        }
+        plugin.pism_check_forcing_files(config)
+        config["pism"]["forcing_sources"]["ocean_pico_file"] = "/does/not/exist.nc"
+        self.assertRaises(SystemExit, plugin.pism_check_forcing_files, config)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.rechunk`."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import netCDF4
+import numpy as np
+
+from esm_pism import plugin, rechunk
+
+# Test requirement:
+from loguru import logger
+
+from .test_subset import make_transient_forcing
+
+logger.remove()
+
+
+def make_chunked_forcing(path, nrecords=12):
+    """Writes a compressed forcing file with chunks spanning all records"""
+    with netCDF4.Dataset(path, "w", format="NETCDF4") as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("y", 4)
+        nc.createDimension("x", 5)
+        nc.createVariable("time", "f8", ("time",))[:] = np.arange(nrecords) * 365.0
+        temp = nc.createVariable("air_temp", "f4", ("time", "y", "x"), zlib=True, chunksizes=(nrecords, 4, 5))
+        temp.units = "K"
+        temp[:] = np.arange(nrecords * 20, dtype="f4").reshape(nrecords, 4, 5)
+    return path
+
+
+class TestRechunk(unittest.TestCase):
+    """Tests for `esm_pism.rechunk`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = make_chunked_forcing(os.path.join(self.tmpdir.name, "atmosphere.nc"))
+        self.store_dir = os.path.join(self.tmpdir.name, "store")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_poorly_chunked(self):
+        self.assertEqual(rechunk.poorly_chunked(self.source), ["air_temp"])
+        classic = make_transient_forcing(os.path.join(self.tmpdir.name, "classic.nc"), range(10))
+        self.assertEqual(rechunk.poorly_chunked(classic), [])
+
+    def test_rechunk_to(self):
+        rechunked = rechunk.rechunk_to(self.source, self.store_dir)
+        self.assertNotEqual(rechunked, self.source)
+        self.assertEqual(os.path.basename(rechunked), "atmosphere.nc")
+        with netCDF4.Dataset(self.source) as src, netCDF4.Dataset(rechunked) as dst:
+            self.assertEqual(dst["air_temp"].chunking(), [1, 4, 5])
+            self.assertEqual(dst["air_temp"].units, "K")
+            np.testing.assert_array_equal(dst["air_temp"][:], src["air_temp"][:])
+        self.assertEqual(rechunk.poorly_chunked(rechunked), [])
+        # Files with the same contents share one conversion:
+        os.makedirs(os.path.join(self.tmpdir.name, "copy"))
+        copy = shutil.copy(self.source, os.path.join(self.tmpdir.name, "copy", "atmosphere.nc"))
+        self.assertEqual(rechunk.rechunk_to(copy, self.store_dir), rechunked)
+
+    def test_set_couplers(self):
+        config = {
+            "general": {"nyear": 10},
+            "pism": {
+                "current_year": 0,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "rechunk_forcing": True,
+                "couplers": {"atmosphere": {"given": {"files": {"atmosphere_given_file": self.source}}}},
+            },
+        }
+        plugin.pism_set_couplers(config)
+        rechunked = config["pism"]["forcing_sources"]["atmosphere_given_file"]
+        self.assertIn("forcing_rechunked", rechunked)
+
+
+if __name__ == "__main__":
+    unittest.main()
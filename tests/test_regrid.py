@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.regrid`."""
+
+
+import os
+import tempfile
+import unittest
+
+import netCDF4
+import numpy as np
+
+from esm_pism import plugin, regrid
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+def make_grid_file(path, x, y, n_time=0):
+    """Writes a file on the grid ``x``, ``y`` holding a field linear in x and y"""
+    with netCDF4.Dataset(path, "w") as nc:
+        nc.createDimension("x", len(x))
+        nc.createDimension("y", len(y))
+        nc.createVariable("x", "f8", ("x",))[:] = x
+        nc.createVariable("y", "f8", ("y",))[:] = y
+        field = x[None, :] + 2 * y[:, None]
+        if n_time:
+            nc.createDimension("time", None)
+            nc.createVariable("time", "f8", ("time",))[:] = np.arange(n_time)
+            temp = nc.createVariable("temp", "f4", ("time", "y", "x"))
+            temp[:] = field[None] + np.arange(n_time)[:, None, None]
+        else:
+            nc.createVariable("topg", "f8", ("y", "x"))[:] = field
+    return path
+
+
+class TestRegrid(unittest.TestCase):
+    """Tests for `esm_pism.regrid`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store_dir = os.path.join(self.tmpdir.name, "store")
+        regrid._memo.clear()
+        # A coarse source grid, with y decreasing:
+        self.source = make_grid_file(
+            os.path.join(self.tmpdir.name, "forcing.nc"), np.arange(0.0, 101, 20), np.arange(100.0, -1, -20), 3
+        )
+        self.input_file = make_grid_file(
+            os.path.join(self.tmpdir.name, "input.nc"), np.arange(0.0, 111, 10), np.arange(0.0, 101, 10)
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_axis_weights(self):
+        weights = regrid.axis_weights(np.array([0.0, 10.0, 20.0]), np.array([0.0, 5.0, 20.0, 25.0]))
+        np.testing.assert_array_equal(weights["lower"], [0, 0, 1, 1])
+        np.testing.assert_allclose(weights["weight"], [0, 0.5, 1, 1])
+        np.testing.assert_array_equal(weights["outside"], [False, False, False, True])
+
+    def test_regrid_to(self):
+        target_grid = regrid.read_grid(self.input_file)
+        regridded = regrid.regrid_to(self.source, target_grid, self.store_dir)
+        self.assertEqual(os.path.basename(regridded), "forcing.nc")
+        x, y = target_grid[2], target_grid[3]
+        with netCDF4.Dataset(regridded) as nc:
+            np.testing.assert_array_equal(nc["x"][:], x)
+            temp = nc["temp"][:]
+        self.assertEqual(temp.shape, (3, len(y), len(x)))
+        expected = x[None, :] + 2 * y[:, None]
+        # x = 110 lies outside of the source grid:
+        np.testing.assert_allclose(temp[2, :, :-1], expected[:, :-1] + 2, rtol=1e-6)
+        self.assertTrue(temp.mask[:, :, -1].all())
+        self.assertEqual(len(os.listdir(os.path.join(self.store_dir, "weights"))), 1)
+        self.assertEqual(regrid.regrid_to(self.source, target_grid, self.store_dir), regridded)
+
+    def test_same_grid_is_unchanged(self):
+        target_grid = regrid.read_grid(self.input_file)
+        self.assertEqual(regrid.regrid_to(self.input_file, target_grid, self.store_dir), self.input_file)
+
+    def test_pism_set_couplers(self):
+        config = {
+            "general": {"nyear": 10},
+            "pism": {
+                "regrid_forcing": True,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "input_sources": {"input": self.input_file},
+                "couplers": {"atmosphere": {"given": {"files": {"atmosphere_given_file": self.source}}}},
+            },
+        }
+        plugin.pism_set_couplers(config)
+        regridded = config["pism"]["forcing_sources"]["atmosphere_given_file"]
+        self.assertNotEqual(regridded, self.source)
+        with netCDF4.Dataset(regridded) as nc:
+            self.assertEqual(len(nc.dimensions["x"]), 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.staging`."""
+
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+import netCDF4
+import numpy as np
+
+from esm_pism import plugin, staging
+
+# Test requirement:
+from loguru import logger
+
+from .test_subset import make_transient_forcing
+
+logger.remove()
+
+
+class TestStaging(unittest.TestCase):
+    """Tests for `esm_pism.staging`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = make_transient_forcing(
+            os.path.join(self.tmpdir.name, "ocean_forcing.nc"), np.arange(0, 1000, 10)
+        )
+        self.config = {
+            "general": {"expid": "test", "nyear": 100, "current_date": "0100-01-01", "final_date": "1000-01-01"},
+            "pism": {
+                "current_year": 100,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "subset_forcing": True,
+                "prefetch_forcing": True,
+                "prefetch_background": False,
+                "couplers": {"ocean": {"pico": {"files": {"ocean_pico_file": self.source}}}},
+            },
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _next_chunk(self):
+        config = copy.deepcopy(self.config)
+        config["pism"]["current_year"] += 100
+        return config
+
+    def test_prefetch_and_use(self):
+        plugin.pism_prefetch_forcing(self.config)
+        config = self._next_chunk()
+        plugin.pism_set_couplers(config)
+        staged = config["pism"]["forcing_sources"]["ocean_pico_file"]
+        self.assertIn(os.path.join("staging", "test", "pism", "200"), staged)
+        self.assertEqual(os.path.basename(staged), "ocean_forcing.nc")
+        with netCDF4.Dataset(staged) as nc:
+            times = nc["time"][:] / 365
+        self.assertEqual((times[0], times[-1]), (200, 300))
+
+    def test_changed_source_is_not_used(self):
+        plugin.pism_prefetch_forcing(self.config)
+        make_transient_forcing(self.source, np.arange(0, 2000, 10))
+        config = self._next_chunk()
+        plugin.pism_set_couplers(config)
+        self.assertNotIn("staging", config["pism"]["forcing_sources"]["ocean_pico_file"])
+
+    def test_changed_window_is_not_used(self):
+        plugin.pism_prefetch_forcing(self.config)
+        # E.g. from pism_adapt_nyear, the subset no longer covers the chunk:
+        config = self._next_chunk()
+        config["general"]["nyear"] = 200
+        plugin.pism_set_couplers(config)
+        self.assertNotIn("staging", config["pism"]["forcing_sources"]["ocean_pico_file"])
+        # A shorter chunk is still covered:
+        config = self._next_chunk()
+        config["general"]["nyear"] = 50
+        plugin.pism_set_couplers(config)
+        self.assertIn("staging", config["pism"]["forcing_sources"]["ocean_pico_file"])
+
+    def test_changed_period_is_not_used(self):
+        plugin.pism_prefetch_forcing(self.config)
+        config = self._next_chunk()
+        config["pism"]["couplers"]["ocean"]["pico"]["kv_pairs"] = {"ocean_pico_period": 1000}
+        plugin.pism_set_couplers(config)
+        self.assertNotIn("staging", config["pism"]["forcing_sources"]["ocean_pico_file"])
+
+    def test_background_staging(self):
+        self.config["pism"]["prefetch_background"] = True
+        directory = staging.chunk_dir(os.path.join(self.tmpdir.name, "cache", "staging"), "test", "pism", 200)
+        process = staging.start_staging(
+            {
+                "config": {"general": {"nyear": 100}, "pism": {"current_year": 200}},
+                "pism_key": "pism",
+                "files": [["ocean_pico_file", self.source, None]],
+                "directory": directory,
+                "settings": "test",
+            }
+        )
+        self.assertEqual(process.wait(timeout=60), 0)
+        self.assertIsNotNone(staging.read_staged(directory, "ocean_pico_file", self.source, "test"))
+        self.assertIsNone(staging.read_staged(directory, "ocean_pico_file", self.source, "other settings"))
+
+    def test_settings_follow_input_grid(self):
+        restart = os.path.join(self.tmpdir.name, "restart.nc")
+        shutil.copy(self.source, restart)
+        self.config["pism"]["regrid_forcing"] = True
+        self.config["pism"]["input_sources"] = {"input": self.source}
+        settings = staging.settings_key(self.config, "pism")
+        # The next chunk starts from a restart on the same grid, linked into
+        # the work directory:
+        next_chunk = self._next_chunk()
+        next_chunk["pism"]["input_sources"] = {}
+        next_chunk["pism"]["linked_sources"] = {"input": restart}
+        self.assertEqual(staging.settings_key(next_chunk, "pism"), settings)
+
+    def test_nothing_staged_after_last_chunk(self):
+        self.config["general"]["final_date"] = "0200-01-01"
+        plugin.pism_prefetch_forcing(self.config)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir.name, "cache", "staging")))
+
+    def test_old_chunks_are_removed(self):
+        for _ in range(3):
+            plugin.pism_prefetch_forcing(self.config)
+            self.config = self._next_chunk()
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.tmpdir.name, "cache", "staging", "test", "pism"))), ["300", "400"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
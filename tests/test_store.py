@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.store`."""
+
+
+import os
+import tempfile
+import unittest
+
+from esm_pism import store
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+class TestStore(unittest.TestCase):
+    """Tests for `esm_pism.store`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store_dir = os.path.join(self.tmpdir.name, "store")
+        self.written = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _writer(self, content):
+        def writer(path):
+            self.written.append(content)
+            with open(path, "w") as f:
+                f.write(content)
+
+        return writer
+
+    def test_store_key_is_order_independent(self):
+        self.assertEqual(
+            store.store_key(overrides={"a": 1, "b": 2}, template_hash="x"),
+            store.store_key(template_hash="x", overrides={"b": 2, "a": 1}),
+        )
+        self.assertNotEqual(
+            store.store_key(overrides={"a": 1}, template_hash="x"),
+            store.store_key(overrides={"a": 1}, template_hash="y"),
+        )
+
+    def test_fetch_reuses_entries(self):
+        key = store.store_key(overrides={"a": 1})
+        targets = [os.path.join(self.tmpdir.name, f"run_{i}.nc") for i in range(3)]
+        reused = [store.fetch(self.store_dir, key, target, self._writer("a=1")) for target in targets]
+        self.assertEqual(reused, [False, True, True])
+        self.assertEqual(self.written, ["a=1"])
+        for target in targets:
+            with open(target) as f:
+                self.assertEqual(f.read(), "a=1")
+
+    def test_evict_least_recently_used(self):
+        for i in range(5):
+            store.fetch(
+                self.store_dir,
+                store.store_key(i=i),
+                os.path.join(self.tmpdir.name, f"run_{i}.nc"),
+                self._writer("x" * 100),
+                max_bytes=250,
+            )
+        remaining = [f for _, _, files in os.walk(self.store_dir) for f in files]
+        self.assertEqual(len(remaining), 2)
+        # Files already linked into runs survive eviction:
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, "run_0.nc")))
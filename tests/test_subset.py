@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.subset`."""
+
+
+import os
+import tempfile
+import unittest
+
+import netCDF4
+import numpy as np
+
+from esm_pism import plugin, subset
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+def make_transient_forcing(path, years, calendar="365_day"):
+    """Writes a forcing file with one record per entry in ``years``"""
+    with netCDF4.Dataset(path, "w", format="NETCDF3_CLASSIC") as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("y", 4)
+        nc.createDimension("x", 5)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "days since 0-1-1"
+        time.calendar = calendar
+        time[:] = np.asarray(years, dtype="f8") * 365
+        nc.createVariable("x", "f8", ("x",))[:] = np.arange(5)
+        temp = nc.createVariable("air_temp", "f4", ("time", "y", "x"))
+        for i, year in enumerate(years):
+            temp[i] = np.full((4, 5), year)
+    return path
+
+
+class TestSubset(unittest.TestCase):
+    """Tests for `esm_pism.subset`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = make_transient_forcing(
+            os.path.join(self.tmpdir.name, "ocean_forcing.nc"), np.arange(0, 1000, 10)
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_year_to_time(self):
+        self.assertEqual(subset.year_to_time(10, "days since 0-1-1", "noleap"), 3650)
+        self.assertEqual(subset.year_to_time(10, "years since 5-1-1"), 5)
+        self.assertEqual(subset.year_to_time(1, "seconds since 1-1-1", "360_day"), 0)
+
+    def test_plan_subset(self):
+        # Chunk from year 105 to 205 needs records at 100 ... 210:
+        self.assertEqual(subset.plan_subset(self.source, 105, 205), (10, 21))
+        # Everything needed:
+        self.assertIsNone(subset.plan_subset(self.source, -10, 2000))
+
+    def test_write_subset(self):
+        target = os.path.join(self.tmpdir.name, "subset.nc")
+        subset.write_subset(self.source, target, 10, 21)
+        with netCDF4.Dataset(target) as nc:
+            self.assertEqual(len(nc.dimensions["time"]), 12)
+            np.testing.assert_array_equal(nc.variables["air_temp"][:, 0, 0], np.arange(100, 220, 10))
+            self.assertEqual(nc.variables["time"].calendar, "365_day")
+            np.testing.assert_array_equal(nc.variables["x"][:], np.arange(5))
+
+    def test_plugin_subsets_forcing(self):
+        config = {
+            "general": {"nyear": 100},
+            "pism": {
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "current_year": 105,
+                "subset_forcing": True,
+                "couplers": {"ocean": {"pico": {"files": {"ocean_pico_file": self.source}}}},
+            },
+        }
+        plugin.pism_set_couplers(config)
+        subset_file = config["pism"]["forcing_sources"]["ocean_pico_file"]
+        self.assertNotEqual(subset_file, self.source)
+        self.assertEqual(os.path.basename(subset_file), "ocean_forcing.nc")
+        self.assertEqual(config["pism"]["forcing_in_work"]["ocean_pico_file"], "ocean_forcing.nc")
+        with netCDF4.Dataset(subset_file) as nc:
+            self.assertEqual(len(nc.dimensions["time"]), 12)
+
+    def test_plugin_stops_on_missing_forcing(self):
+        config = {
+            "general": {"nyear": 100},
+            "pism": {
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "current_year": 105,
+                "subset_forcing": True,
+                "couplers": {"ocean": {"pico": {"files": {"ocean_pico_file": self.source + ".missing"}}}},
+            },
+        }
+        self.assertRaises(SystemExit, plugin.pism_set_couplers, config)
+
+    def test_periodic_forcing_keeps_period(self):
+        self.assertEqual(subset.needed_years(5000, 100, period=1000, reference_year=0), (0, 1000))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.synthesis`."""
+
+
+import os
+import tempfile
+import unittest
+
+import netCDF4
+import numpy as np
+
+from esm_pism import plugin, store, synthesis
+from esm_pism.subset import year_to_time
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+def make_climatology(path, value, months=12):
+    """Writes a monthly climatology of ``air_temp`` with a constant offset ``value``"""
+    with netCDF4.Dataset(path, "w", format="NETCDF4") as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("y", 3)
+        nc.createDimension("x", 4)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "days since 1-1-1"
+        time.calendar = "365_day"
+        time[:] = np.arange(months) * 365.0 / months
+        nc.createVariable("x", "f8", ("x",))[:] = np.arange(4) * 1000.0
+        temp = nc.createVariable("air_temp", "f4", ("time", "y", "x"))
+        temp.units = "K"
+        temp[:] = value + np.arange(months, dtype="f4")[:, None, None] * np.ones((1, 3, 4), "f4")
+    return path
+
+
+class TestSynthesis(unittest.TestCase):
+    """Tests for `esm_pism.synthesis`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = make_climatology(os.path.join(self.tmpdir.name, "base.nc"), 250.0)
+        self.anomaly = make_climatology(os.path.join(self.tmpdir.name, "anomaly.nc"), -10.0, months=12)
+        self.index = os.path.join(self.tmpdir.name, "index.txt")
+        np.savetxt(self.index, [[0, 0.0], [100, 1.0]])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_read_index(self):
+        years, weights = synthesis.read_index(self.index)
+        np.testing.assert_array_equal(years, [0, 100])
+        self.assertEqual(weights.shape, (2, 1))
+        path = os.path.join(self.tmpdir.name, "index.nc")
+        with netCDF4.Dataset(path, "w") as nc:
+            nc.createDimension("time", None)
+            time = nc.createVariable("time", "f8", ("time",))
+            time.units = "days since 1-1-1"
+            time.calendar = "365_day"
+            time[:] = [year_to_time(year, time.units, time.calendar) for year in [100, 0]]
+            nc.createVariable("glacial_index", "f8", ("time",))[:] = [1.0, 0.0]
+        years, weights = synthesis.read_index(path)
+        np.testing.assert_allclose(years, [0, 100])
+        np.testing.assert_allclose(weights[:, 0], [0.0, 1.0])
+
+    def test_weights_at(self):
+        years, weights = synthesis.read_index(self.index)
+        np.testing.assert_allclose(synthesis.weights_at(np.array([25.0, 50.0]), years, weights)[:, 0], [0.25, 0.5])
+        with self.assertRaises(ValueError):
+            synthesis.weights_at(np.array([90.0, 110.0]), years, weights)
+
+    def test_synthesize_chunk(self):
+        spec = {"base": self.base, "anomalies": [self.anomaly], "index": self.index, "step": 10}
+        store_dir = os.path.join(self.tmpdir.name, "store")
+        path = synthesis.synthesize_chunk(spec, 20, 40, store_dir, "atmosphere.nc")
+        with netCDF4.Dataset(path) as nc:
+            # Three years of twelve months:
+            self.assertEqual(len(nc["time"]), 36)
+            self.assertEqual(nc["air_temp"].chunking(), [1, 3, 4])
+            self.assertEqual(nc["air_temp"].units, "K")
+            years = netCDF4.num2date(nc["time"][:], nc["time"].units, nc["time"].calendar)
+            self.assertEqual([date.year for date in years[::12]], [20, 30, 40])
+            # Year 30, January and July:
+            np.testing.assert_allclose(nc["air_temp"][12, 0, 0], 250.0 + 0.3 * -10.0)
+            np.testing.assert_allclose(nc["air_temp"][18, 0, 0], 256.0 + 0.3 * -4.0, rtol=1e-6)
+            np.testing.assert_array_equal(nc["x"][:], np.arange(4) * 1000.0)
+        self.assertEqual(synthesis.synthesize_chunk(spec, 20, 40, store_dir, "atmosphere.nc"), path)
+        # States are taken relative to the base:
+        spec = {"base": self.base, "states": [self.anomaly], "index": self.index}
+        path = synthesis.synthesize_chunk(spec, 50, 50, store_dir, "atmosphere.nc")
+        with netCDF4.Dataset(path) as nc:
+            np.testing.assert_allclose(nc["air_temp"][0, 0, 0], 250.0 + 0.5 * (-10.0 - 250.0))
+
+    def test_set_couplers(self):
+        spec = {"base": self.base, "anomalies": [self.anomaly], "index": self.index}
+        config = {
+            "general": {"nyear": 10},
+            "pism": {
+                "current_year": 0,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "couplers": {"atmosphere": {"given": {"files": {"atmosphere_given_file": spec}}}},
+            },
+        }
+        plugin.pism_set_couplers(config)
+        synthesized = config["pism"]["forcing_sources"]["atmosphere_given_file"]
+        self.assertIn("forcing_synthesized", synthesized)
+        self.assertEqual(os.path.basename(synthesized), "atmosphere_given_file.nc")
+        config["pism"]["current_year"] = 200
+        with self.assertRaises(SystemExit):
+            plugin.pism_set_couplers(config)
+
+    def test_set_couplers_links_into_run(self):
+        spec = {"base": self.base, "anomalies": [self.anomaly], "index": self.index}
+        forcing_dir = os.path.join(self.tmpdir.name, "run", "forcing")
+        config = {
+            "general": {"nyear": 10},
+            "pism": {
+                "current_year": 0,
+                "cache_dir": os.path.join(self.tmpdir.name, "cache"),
+                "thisrun_forcing_dir": forcing_dir,
+                "couplers": {"atmosphere": {"given": {"files": {"atmosphere_given_file": spec}}}},
+            },
+        }
+        plugin.pism_set_couplers(config)
+        linked = config["pism"]["forcing_sources"]["atmosphere_given_file"]
+        self.assertEqual(linked, os.path.join(forcing_dir, "atmosphere_given_file.nc"))
+        # Evicting the store entry does not remove the file of the run:
+        store.evict(os.path.join(self.tmpdir.name, "cache", "forcing_synthesized"), 0)
+        with netCDF4.Dataset(linked) as nc:
+            self.assertEqual(len(nc["time"]), 11 * 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `esm_pism.throughput`."""
+
+
+import os
+import tempfile
+import unittest
+
+import netCDF4
+import numpy as np
+
+from esm_pism import plugin, throughput
+
+# Test requirement:
+from loguru import logger
+
+logger.remove()
+
+
+def make_ts_file(path, start_year, nyear, wall_clock_hours):
+    """Writes a time series file with yearly records and PISM's run_stats"""
+    with netCDF4.Dataset(path, "w") as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("nv", 2)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "days since 0-1-1"
+        time.calendar = "365_day"
+        time.bounds = "time_bounds"
+        ends = np.arange(start_year + 1, start_year + nyear + 1, dtype="f8")
+        time[:] = ends * 365
+        nc.createVariable("time_bounds", "f8", ("time", "nv"))[:] = np.stack([ends - 1, ends], axis=1) * 365
+        nc.createVariable("ice_volume", "f8", ("time",))[:] = ends
+        run_stats = nc.createVariable("run_stats", "b")
+        run_stats.wall_clock_hours = wall_clock_hours
+    return path
+
+
+class TestThroughput(unittest.TestCase):
+    """Tests for `esm_pism.throughput`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_parse_compute_time(self):
+        self.assertEqual(throughput.parse_compute_time("08:30:00"), 8.5)
+        self.assertEqual(throughput.parse_compute_time("1-02:00:00"), 26)
+        self.assertEqual(throughput.parse_compute_time("90"), 1.5)
+
+    def test_measure_chunk(self):
+        ts_file = make_ts_file(os.path.join(self.tmpdir.name, "ts.nc"), 100, 50, 2.0)
+        measurement = throughput.measure_chunk(ts_file=ts_file)
+        self.assertAlmostEqual(measurement["model_years"], 50)
+        self.assertAlmostEqual(measurement["years_per_hour"], 25)
+        log_file = os.path.join(self.tmpdir.name, "pism.log")
+        with open(log_file, "w") as f:
+            f.write("PISM (basic evolution run mode)\nS 100.000:  0.50\nS 150.000:  0.50\n")
+        self.assertEqual(throughput.parse_log(log_file), 50)
+
+    def test_choose_nyear(self):
+        self.assertIsNone(throughput.choose_nyear([], 8))
+        # The median ignores the one slow chunk:
+        self.assertEqual(throughput.choose_nyear([100, 10, 100], 10, margin=0.1, step=200), 800)
+        self.assertEqual(throughput.choose_nyear([100], 10, margin=0.1, max_nyear=500), 500)
+        self.assertEqual(throughput.choose_nyear([0.01], 10, min_nyear=1), 1)
+
+    def test_measure_and_adapt(self):
+        config = {
+            "general": {
+                "expid": "test",
+                "run_number": 1,
+                "nyear": 50,
+                "compute_time": "10:00:00",
+                "current_date": "0100-01-01",
+                "final_date": "2000-01-01",
+                "experiment_log_dir": self.tmpdir.name,
+            },
+            "pism": {
+                "thisrun_work_dir": self.tmpdir.name,
+                "outdata_sources": {"ts_file": "ts.nc"},
+                "adaptive_nyear": True,
+                "adaptive_nyear_step": 10,
+            },
+        }
+        plugin.pism_adapt_nyear(config)
+        self.assertEqual(config["general"]["nyear"], 50)
+        make_ts_file(os.path.join(self.tmpdir.name, "ts.nc"), 100, 50, 2.0)
+        plugin.pism_measure_throughput(config)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, "test_pism_throughput.jsonl")))
+        plugin.pism_adapt_nyear(config)
+        self.assertEqual(config["general"]["nyear"], 220)
+        config["general"]["final_date"] = "0200-01-01"
+        plugin.pism_adapt_nyear(config)
+        self.assertEqual(config["general"]["nyear"], 100)
+
+
+if __name__ == "__main__":
+    unittest.main()